@@ -1,2 +1,16 @@
-from ._utils import concat_sdatas, add_obs
-from ._augment import RandomRC
\ No newline at end of file
+from ._utils import concat_sdatas, add_obs, ConcatSeqData
+from ._augment import (
+    RandomRC,
+    RandomJitter,
+    RandomMutation,
+    RandomInsertion,
+    RandomDeletion,
+    RandomTranslocation,
+    RandomAugment,
+)
+from ._encoding import TokensToOHE
+from ._dataloader import get_sdata_dataloader, SeqDataCollator
+from ._samplers import ContiguousBatchSampler, ChunkShuffleSampler
+from ._mmap import write_mmap_sdata, get_mmap_dataloader, MmapDataset
+from ._genome import write_genome_cache, get_genome_dataloader, GenomeDataset
+from ._prefetch import DevicePrefetcher
@@ -1,58 +1,106 @@
-from typing import List, Tuple, Union
+from typing import List, Optional, Sequence, Tuple, Union
 
+import numpy as np
 import torch
 
+
+def _as_tensor(x: Union[np.ndarray, torch.Tensor]) -> torch.Tensor:
+    return torch.from_numpy(x) if isinstance(x, np.ndarray) else x
+
+
+def _sample_mask(
+    n: int, mask: Optional[torch.Tensor], device: torch.device
+) -> torch.Tensor:
+    if mask is None:
+        return torch.ones(n, dtype=torch.bool, device=device)
+    return torch.as_tensor(mask, dtype=torch.bool, device=device)
+
+
+def _random_ohe(
+    n: int, alphabet_size: int, length: int, like: torch.Tensor
+) -> torch.Tensor:
+    """Random one-hot sequences of shape (n, alphabet_size, length)."""
+    tokens = torch.randint(alphabet_size, (n, length), device=like.device)
+    return torch.nn.functional.one_hot(tokens, alphabet_size).transpose(1, 2).to(like.dtype)
+
+
+def _gather_length(
+    x: torch.Tensor, idx: torch.Tensor, length_axis: int = -1
+) -> torch.Tensor:
+    """Gather positions idx (shape: (N, L_out)) along the length axis of each sequence."""
+    length_axis = length_axis % x.ndim
+    shape = [1] * x.ndim
+    shape[0], shape[length_axis] = idx.shape
+    idx = idx.reshape(shape).expand(
+        *[idx.shape[1] if i == length_axis else s for i, s in enumerate(x.shape)]
+    )
+    return torch.gather(x, length_axis, idx)
+
+
 class RandomRC:
     """Randomly applies a reverse-complement transformation to each sequence in a training batch \\
-        
+
     Takes in a user-defined probability, rc_prob. This is applied to each sequence independently.
 
     Parameters
     ----------
     rc_prob : float, optional
         Probability to apply a reverse-complement transformation, defaults to 0.5.
+    inplace : bool, optional
+        Whether to reverse-complement the selected sequences of the batch in-place instead of
+        returning a new tensor, defaults to False.
     """
 
-    def __init__(self, rc_prob=0.5):
+    def __init__(self, rc_prob=0.5, inplace=False):
         """Creates random reverse-complement object usable by EvoAug."""
         self.rc_prob = rc_prob
+        self.inplace = inplace
 
-    def __call__(self, *x: torch.Tensor) -> Union[torch.Tensor, Tuple[torch.Tensor]]:
+    def __call__(
+        self, *x: torch.Tensor, mask: Optional[torch.Tensor] = None
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor]]:
         """Randomly transforms sequences in a batch with a reverse-complement transformation.
 
         Parameters
         ----------
         x : torch.Tensor
             Batch (or tuple of batches) of one-hot sequences (shape: (N, A, L)).
+        mask : torch.Tensor, optional
+            Boolean mask of the sequences that may be transformed, defaults to all.
 
         Returns
         -------
         torch.Tensor
             Sequences with random reverse-complements applied.
         """
+        x = tuple(_as_tensor(_x) for _x in x)
         n = x[0].shape[0]
         # randomly select sequences to apply rc transformation
-        ind_rc = torch.rand(n) < self.rc_prob
-        
+        ind_rc = torch.rand(n, device=x[0].device) < self.rc_prob
+        ind_rc &= _sample_mask(n, mask, x[0].device)
+
         out: List[torch.Tensor] = []
         for _x in x:
-            # make a copy of the sequence
-            x_aug = torch.clone(_x)
-
-            # apply reverse-complement transformation
-            x_aug[ind_rc] = torch.flip(x_aug[ind_rc], dims=[1, 2])
-            
-            out.append(x_aug)
-        
+            if self.inplace:
+                # only the selected sequences are copied
+                _x[ind_rc] = _x[ind_rc].flip(dims=[1, 2])
+                out.append(_x)
+            else:
+                ind = ind_rc.view(-1, *[1] * (_x.ndim - 1))
+                out.append(torch.where(ind, _x.flip(dims=[1, 2]), _x))
+
         if len(out) == 1:
             return out[0]
         else:
             return tuple(out)
 
+
 class RandomJitter:
     def __init__(self, max_jitter: int, length_axis: int) -> None:
         """Randomly jitter a sequence that has been padded on either side to support jittering by `max_jitter` amount.
 
+        Each sequence of the batch gets its own offset; the windows are gathered in a single op.
+
         Parameters
         ----------
         max_jitter : int
@@ -62,7 +110,9 @@ class RandomJitter:
         self.max_jitter = max_jitter
         self.length_axis = length_axis
 
-    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+    def __call__(
+        self, x: torch.Tensor, mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
         """Apply random jittering.
 
         Parameters
@@ -71,13 +121,274 @@ class RandomJitter:
             Batch of sequences where the length axis corresponds to the `length_axis`
             parameter given at initialization. E.g. shape: (N, A, L), then
             `length_axis` should be 2.
+        mask : torch.Tensor, optional
+            Boolean mask of the sequences that may be jittered, the others are centered.
+            Defaults to all.
 
         Returns
         -------
         torch.Tensor
             Jittered sequence.
         """
-        length = x.shape[self.length_axis]
-        start = torch.randint(0, self.max_jitter, (1,))
-        end = length - self.max_jitter * 2 + start
-        return x[(slice(None),) * (self.length_axis % x.ndim) + (slice(start, end),)]
+        x = _as_tensor(x)
+        n, length = x.shape[0], x.shape[self.length_axis]
+        start = torch.randint(0, 2 * self.max_jitter + 1, (n,), device=x.device)
+        start = torch.where(_sample_mask(n, mask, x.device), start, self.max_jitter)
+        idx = start[:, None] + torch.arange(length - 2 * self.max_jitter, device=x.device)
+        return _gather_length(x, idx, self.length_axis)
+
+
+class RandomMutation:
+    """Randomly mutates a fraction of the positions of each sequence in a batch.
+
+    Mutated positions are replaced by random one-hot characters (which may equal the original
+    character), for all sequences at once.
+
+    Parameters
+    ----------
+    mut_frac : float, optional
+        Fraction of positions to mutate in each sequence, defaults to 0.05.
+    inplace : bool, optional
+        Whether to mutate the batch in-place instead of returning a new tensor, defaults to False.
+    """
+
+    def __init__(self, mut_frac: float = 0.05, inplace: bool = False):
+        self.mut_frac = mut_frac
+        self.inplace = inplace
+
+    def __call__(
+        self, x: torch.Tensor, mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """Randomly mutate sequences in a batch.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Batch of one-hot sequences (shape: (N, A, L)).
+        mask : torch.Tensor, optional
+            Boolean mask of the sequences that may be mutated, defaults to all.
+
+        Returns
+        -------
+        torch.Tensor
+            Mutated sequences.
+        """
+        x = _as_tensor(x)
+        N, A, L = x.shape
+        num_mut = int(round(self.mut_frac * L))
+        # rank positions randomly and mutate the num_mut first ones
+        ranks = torch.rand(N, L, device=x.device).argsort(dim=1).argsort(dim=1)
+        mutate = (ranks < num_mut) & _sample_mask(N, mask, x.device)[:, None]
+        random = _random_ohe(N, A, L, x)
+        if self.inplace:
+            return torch.where(mutate[:, None, :], random, x, out=x)
+        return torch.where(mutate[:, None, :], random, x)
+
+
+class RandomInsertion:
+    """Randomly inserts a stretch of random DNA into each sequence in a batch.
+
+    Sequences are extended to a common length L + insert_max by padding the end with random
+    DNA, so that sequences with shorter (or no) insertions can be batched together.
+
+    Parameters
+    ----------
+    insert_min : int, optional
+        Minimum length of the insertions, defaults to 0.
+    insert_max : int, optional
+        Maximum length of the insertions, defaults to 20.
+    """
+
+    def __init__(self, insert_min: int = 0, insert_max: int = 20):
+        self.insert_min = insert_min
+        self.insert_max = insert_max
+
+    def __call__(
+        self, x: torch.Tensor, mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """Randomly insert random DNA into sequences in a batch.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Batch of one-hot sequences (shape: (N, A, L)).
+        mask : torch.Tensor, optional
+            Boolean mask of the sequences that may get an insertion, the others are only padded.
+            Defaults to all.
+
+        Returns
+        -------
+        torch.Tensor
+            Sequences with insertions (shape: (N, A, L + insert_max)).
+        """
+        x = _as_tensor(x)
+        N, A, L = x.shape
+        n_ins = torch.randint(self.insert_min, self.insert_max + 1, (N,), device=x.device)
+        n_ins = torch.where(_sample_mask(N, mask, x.device), n_ins, 0)
+        pos = (torch.rand(N, device=x.device) * (L + 1)).long()[:, None]
+        n_ins = n_ins[:, None]
+        j = torch.arange(L + self.insert_max, device=x.device)[None, :]
+        # positions past the insertion are shifted by its length, the rest is random DNA
+        src = torch.where(j >= pos + n_ins, j - n_ins, j)
+        random = ((j >= pos) & (j < pos + n_ins)) | (j >= L + n_ins)
+        out = _gather_length(x, src.clamp(max=L - 1))
+        return torch.where(random[:, None, :], _random_ohe(N, A, L + self.insert_max, x), out)
+
+
+class RandomDeletion:
+    """Randomly deletes a stretch of each sequence in a batch.
+
+    Sequences keep their length L: the end of each sequence is padded with as much random DNA
+    as was deleted.
+
+    Parameters
+    ----------
+    delete_min : int, optional
+        Minimum length of the deletions, defaults to 0.
+    delete_max : int, optional
+        Maximum length of the deletions, defaults to 20.
+    """
+
+    def __init__(self, delete_min: int = 0, delete_max: int = 20):
+        self.delete_min = delete_min
+        self.delete_max = delete_max
+
+    def __call__(
+        self, x: torch.Tensor, mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """Randomly delete stretches of sequences in a batch.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Batch of one-hot sequences (shape: (N, A, L)).
+        mask : torch.Tensor, optional
+            Boolean mask of the sequences that may get a deletion, defaults to all.
+
+        Returns
+        -------
+        torch.Tensor
+            Sequences with deletions.
+        """
+        x = _as_tensor(x)
+        N, A, L = x.shape
+        n_del = torch.randint(self.delete_min, self.delete_max + 1, (N,), device=x.device)
+        n_del = torch.where(_sample_mask(N, mask, x.device), n_del, 0)[:, None]
+        pos = (torch.rand(N, 1, device=x.device) * (L - n_del + 1)).long()
+        j = torch.arange(L, device=x.device)[None, :]
+        src = torch.where(j >= pos, j + n_del, j)
+        out = _gather_length(x, src.clamp(max=L - 1))
+        return torch.where((j >= L - n_del)[:, None, :], _random_ohe(N, A, L, x), out)
+
+
+class RandomTranslocation:
+    """Randomly rolls each sequence in a batch by its own shift.
+
+    Parameters
+    ----------
+    shift_min : int, optional
+        Minimum absolute shift, defaults to 0.
+    shift_max : int, optional
+        Maximum absolute shift, defaults to 20.
+    """
+
+    def __init__(self, shift_min: int = 0, shift_max: int = 20):
+        self.shift_min = shift_min
+        self.shift_max = shift_max
+
+    def __call__(
+        self, x: torch.Tensor, mask: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """Randomly roll sequences in a batch.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Batch of one-hot sequences (shape: (N, A, L)).
+        mask : torch.Tensor, optional
+            Boolean mask of the sequences that may be rolled, defaults to all.
+
+        Returns
+        -------
+        torch.Tensor
+            Rolled sequences.
+        """
+        x = _as_tensor(x)
+        N, _, L = x.shape
+        shift = torch.randint(self.shift_min, self.shift_max + 1, (N,), device=x.device)
+        sign = torch.randint(2, (N,), device=x.device) * 2 - 1
+        shift = torch.where(_sample_mask(N, mask, x.device), shift * sign, 0)
+        idx = (torch.arange(L, device=x.device)[None, :] - shift[:, None]) % L
+        return _gather_length(x, idx)
+
+
+class RandomAugment:
+    """Applies a random combination of augmentations to each sequence in a batch.
+
+    Every sequence gets its own subset of the augmentations, as in EvoAug, but each augmentation
+    is applied once to the whole batch with a mask of the sequences that selected it, so the cost
+    does not grow with the batch size. Can be passed as a single transform, e.g.
+    `transforms={"ohe_seq": RandomAugment([RandomRC(), RandomMutation()])}`.
+
+    Parameters
+    ----------
+    augments : list
+        Augmentations to choose from, applied in the given order (e.g. `RandomRC`,
+        `RandomMutation`, `RandomInsertion`, `RandomDeletion`, `RandomTranslocation`).
+    max_augs_per_seq : int, optional
+        Maximum number of augmentations applied to each sequence, defaults to all.
+    hard_aug : bool, optional
+        Whether to always apply max_augs_per_seq augmentations instead of a random number between
+        1 and max_augs_per_seq, defaults to True.
+    """
+
+    def __init__(
+        self,
+        augments: Sequence,
+        max_augs_per_seq: Optional[int] = None,
+        hard_aug: bool = True,
+    ):
+        self.augments = list(augments)
+        self.max_augs_per_seq = min(
+            max_augs_per_seq if max_augs_per_seq is not None else len(augments), len(augments)
+        )
+        self.hard_aug = hard_aug
+
+    def sample_combos(self, n: int, device: Optional[torch.device] = None) -> torch.Tensor:
+        """Sample which augmentations to apply to each of n sequences.
+
+        Returns
+        -------
+        torch.Tensor
+            Boolean mask of shape (n, len(augments)).
+        """
+        if self.hard_aug:
+            num_aug = torch.full((n,), self.max_augs_per_seq, device=device)
+        else:
+            num_aug = torch.randint(1, self.max_augs_per_seq + 1, (n,), device=device)
+        ranks = torch.rand(n, len(self.augments), device=device).argsort(dim=1).argsort(dim=1)
+        return ranks < num_aug[:, None]
+
+    def __call__(
+        self, x: torch.Tensor, combos: Optional[torch.Tensor] = None
+    ) -> torch.Tensor:
+        """Apply random combinations of augmentations to a batch of sequences.
+
+        Parameters
+        ----------
+        x : torch.Tensor
+            Batch of one-hot sequences (shape: (N, A, L)).
+        combos : torch.Tensor, optional
+            Boolean mask of shape (N, len(augments)) of the augmentations to apply to each
+            sequence. If None, sampled with `sample_combos`.
+
+        Returns
+        -------
+        torch.Tensor
+            Augmented sequences.
+        """
+        x = _as_tensor(x)
+        combos = self.sample_combos(x.shape[0], x.device) if combos is None else combos
+        for i, augment in enumerate(self.augments):
+            x = augment(x, mask=combos[:, i])
+        return x
@@ -0,0 +1,321 @@
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+import xarray as xr
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from .._settings import settings
+from ._samplers import ChunkShuffleSampler, ContiguousBatchSampler
+from ._utils import ConcatSeqData
+
+
+class _IndexDataset(Dataset):
+    # fetches whole batches of indices with one vectorized lookup instead of one per sample
+    def __init__(self, indices: np.ndarray):
+        self.indices = indices
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, idx: int) -> int:
+        return self.indices[idx]
+
+    def __getitems__(self, idx: List[int]) -> np.ndarray:
+        return self.indices[np.asarray(idx)]
+
+
+class SeqDataCollator:
+    """Loads a batch of sequences from a SeqData by integer index.
+
+    Used as the collate function of the dataloaders returned by `get_sdata_dataloader`, whose
+    datasets are just arrays of indices. For each batch, the indices are sorted to read all
+    variables with a single `isel` (one pass over the chunks of dask-backed variables, and a
+    plain slice if the indices are contiguous), the original order is restored, multiple target
+    variables are stacked along a last axis and the transforms are applied before converting to
+    tensors.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object to load from. Never copied.
+    variables : list of str
+        Variables to load into the batch under their own names.
+    target_vars : list of str, optional
+        Variables to stack into the batch under target_var, by default None
+    target_var : str, optional
+        Name of the stacked targets in the batch, by default "target"
+    transforms : dict, optional
+        Functions to apply to the NumPy arrays of the batch in order, keyed by name. Keys that are
+        tuples of names pass a tuple of the arrays to the function, which returns a tuple of
+        arrays assigned back to the same names, by default None
+    dtypes : torch.dtype or dict, optional
+        Data type(s) to convert the numeric arrays of the batch to, by default torch.float32
+
+    Raises
+    ------
+    ValueError
+        If transforms has keys that are not in the batch.
+    """
+
+    def __init__(
+        self,
+        sdata: Union[xr.Dataset, ConcatSeqData],
+        variables: List[str],
+        target_vars: Optional[List[str]] = None,
+        target_var: str = "target",
+        transforms: Optional[Dict[Union[str, Tuple[str, ...]], Callable]] = None,
+        dtypes: Union[torch.dtype, Dict[str, torch.dtype]] = torch.float32,
+    ):
+        self.target_vars = target_vars if target_vars is not None else []
+        self.variables = list(dict.fromkeys(variables + self.target_vars))
+        self.sdata = sdata[self.variables]
+        self.return_vars = variables
+        self.target_var = target_var
+        self.transforms = transforms if transforms is not None else {}
+        self.dtypes = dtypes
+        names = set(variables) | ({target_var} if self.target_vars else set())
+        missing = {
+            name
+            for key in self.transforms
+            for name in (key if isinstance(key, tuple) else (key,))
+            if name not in names
+        }
+        if missing:
+            raise ValueError(f"Got transforms for {sorted(missing)}, which are not in the batch.")
+
+    def __call__(
+        self, indices: Union[List[int], np.ndarray]
+    ) -> Dict[str, Union[torch.Tensor, np.ndarray]]:
+        indices = np.asarray(indices)
+        if len(indices) > 0 and np.array_equal(
+            indices, np.arange(indices[0], indices[0] + len(indices))
+        ):
+            subset = self.sdata.isel(_sequence=slice(indices[0], indices[-1] + 1)).compute()
+            arrays = {var: subset[var].values for var in self.variables}
+        else:
+            order = np.argsort(indices, kind="stable")
+            inverse = np.empty_like(order)
+            inverse[order] = np.arange(len(order))
+            subset = self.sdata.isel(_sequence=indices[order]).compute()
+            arrays = {var: subset[var].values[inverse] for var in self.variables}
+        batch = {var: arrays[var] for var in self.return_vars}
+        if self.target_vars:
+            targets = [arrays[var] for var in self.target_vars]
+            batch[self.target_var] = targets[0] if len(targets) == 1 else np.stack(targets, axis=-1)
+        for name, transform in self.transforms.items():
+            if isinstance(name, tuple):
+                batch.update(zip(name, transform(tuple(batch[var] for var in name))))
+            else:
+                batch[name] = transform(batch[name])
+        return {name: self._to_tensor(name, arr) for name, arr in batch.items()}
+
+    def _to_tensor(
+        self, name: str, arr: Union[np.ndarray, torch.Tensor]
+    ) -> Union[torch.Tensor, np.ndarray]:
+        if isinstance(arr, np.ndarray) and arr.dtype.kind in "SUO":
+            return arr
+        dtype = self.dtypes.get(name) if isinstance(self.dtypes, dict) else self.dtypes
+        return torch.as_tensor(arr, dtype=dtype)
+
+
+def get_sdata_dataloader(
+    sdata: Union[xr.Dataset, ConcatSeqData],
+    seq_var: Union[str, List[str]],
+    target_vars: Optional[Union[str, List[str]]] = None,
+    indices: Optional[np.ndarray] = None,
+    batch_size: Optional[int] = None,
+    shuffle: bool = False,
+    transforms: Optional[Dict[Union[str, Tuple[str, ...]], Callable]] = None,
+    dtypes: Union[torch.dtype, Dict[str, torch.dtype]] = torch.float32,
+    target_var: str = "target",
+    sampler: Optional[Sampler] = None,
+    contiguous_batches: bool = False,
+    shuffle_buffer: Optional[int] = None,
+    seed: Optional[int] = None,
+    num_workers: Optional[int] = None,
+    prefetch_factor: Optional[int] = None,
+    pin_memory: bool = False,
+    drop_last: bool = False,
+) -> DataLoader:
+    """Get a PyTorch DataLoader that streams batches from a SeqData by integer index.
+
+    Unlike selecting a subset of a SeqData (e.g. `sdata.sel(_sequence=train_mask)`) and building a
+    dataloader on it, the SeqData is never copied: the dataset of the dataloader is just the array of
+    indices to load (e.g. the training split) and each batch is read from the shared SeqData when it
+    is collated. Target variables are stacked per batch, so no concatenated target variable has to
+    be added to the SeqData either.
+
+    Batches are fetched as a whole: the indices of a batch are looked up in one vectorized call and
+    its sequences are read with a single `isel`, never one sample at a time. Without shuffling,
+    consecutive indices are read as contiguous slices. With contiguous_batches=True, this also holds
+    when shuffling, since only the order of fixed contiguous batches is shuffled
+    (see `ContiguousBatchSampler`). For chunked SeqDatas, shuffle_buffer shuffles chunk by chunk
+    instead of fully at random, so each batch only reads from a few chunks (see
+    `ChunkShuffleSampler`).
+
+    Parameters
+    ----------
+    sdata : xr.Dataset or ConcatSeqData
+        SeqData object to load from, or a virtual concatenation of several
+        (see `concat_sdatas`).
+    seq_var : str or list of str
+        Variable(s) holding the sequences (or any other inputs), loaded under their own names.
+    target_vars : str or list of str, optional
+        Target variable(s), stacked along a last axis (if more than one) and loaded as target_var,
+        by default None
+    indices : numpy.ndarray, optional
+        Integer indices along "_sequence" to load, e.g. `np.flatnonzero(sdata["train_val"])`.
+        If None, all sequences are loaded, by default None
+    batch_size : int, optional
+        Batch size. If None, uses settings.batch_size
+    shuffle : bool, optional
+        Whether to shuffle the indices every epoch, by default False
+    transforms : dict, optional
+        Functions to apply to the NumPy arrays of each batch keyed by variable name (or target_var),
+        e.g. {"ohe_seq": lambda x: x.swapaxes(1, 2)}. Tuple keys transform several variables at
+        once (see `SeqDataCollator`), by default None
+    dtypes : torch.dtype or dict, optional
+        Data type(s) of the tensors, by default torch.float32
+    target_var : str, optional
+        Name of the stacked targets in each batch, by default "target"
+    sampler : torch.utils.data.Sampler, optional
+        Sampler over positions in indices. Mutually exclusive with shuffle, by default None
+    contiguous_batches : bool, optional
+        Whether to load batches of consecutive positions in indices and only shuffle the order of
+        the batches. Can't be used with a sampler, by default False
+    shuffle_buffer : int, optional
+        If shuffling, the number of chunks of seq_var (along "_sequence") to shuffle together
+        instead of shuffling all indices. If None, all indices are shuffled. Can't be used with
+        contiguous_batches or a sampler, by default None
+    seed : int, optional
+        Random seed for shuffling if contiguous_batches=True or shuffle_buffer is given,
+        by default None
+    num_workers : int, optional
+        Number of dataloader workers. If None, uses settings.dl_num_workers
+    prefetch_factor : int, optional
+        Number of batches loaded in advance by each worker, by default None
+    pin_memory : bool, optional
+        Whether to pin the memory of the batches, by default False
+    drop_last : bool, optional
+        Whether to drop the last batch if it is smaller than the batch size, by default False
+
+    Returns
+    -------
+    DataLoader
+        Dataloader yielding dictionaries of tensors.
+
+    Raises
+    ------
+    ValueError
+        If contiguous_batches or shuffle_buffer is used with a sampler, or both are used together.
+    """
+    if contiguous_batches and sampler is not None:
+        raise ValueError("contiguous_batches can't be used with a sampler.")
+    if shuffle_buffer is not None and (contiguous_batches or sampler is not None):
+        raise ValueError("shuffle_buffer can't be used with contiguous_batches or a sampler.")
+    seq_vars = [seq_var] if isinstance(seq_var, str) else list(seq_var)
+    if isinstance(target_vars, str):
+        target_vars = [target_vars]
+    indices = np.arange(sdata.sizes["_sequence"]) if indices is None else np.asarray(indices)
+    batch_size = batch_size if batch_size is not None else settings.batch_size
+    num_workers = num_workers if num_workers is not None else settings.dl_num_workers
+    collator = SeqDataCollator(
+        sdata,
+        variables=seq_vars,
+        target_vars=target_vars,
+        target_var=target_var,
+        transforms=transforms,
+        dtypes=dtypes,
+    )
+    dataset = _IndexDataset(indices)
+    if shuffle and shuffle_buffer is not None:
+        if isinstance(sdata, ConcatSeqData):
+            chunks = sdata.chunksizes(seq_vars[0])
+        else:
+            chunks = sdata[seq_vars[0]].chunksizes.get("_sequence")
+        chunks = chunks if chunks is not None else (sdata.sizes["_sequence"],)
+        sampler = ChunkShuffleSampler(indices, chunks, buffer_size=shuffle_buffer, seed=seed)
+        shuffle = False
+    if contiguous_batches:
+        batch_sampler = ContiguousBatchSampler(
+            len(indices), batch_size, shuffle=shuffle, drop_last=drop_last, seed=seed
+        )
+        return DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            num_workers=num_workers,
+            prefetch_factor=prefetch_factor,
+            pin_memory=pin_memory,
+            collate_fn=collator,
+        )
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        sampler=sampler,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor,
+        pin_memory=pin_memory,
+        drop_last=drop_last,
+        collate_fn=collator,
+    )
+
+
+def train_val_indices(
+    sdata: xr.Dataset,
+    train_var: str = "train_val",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Get the integer indices of the training and validation sequences of a SeqData.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object.
+    train_var : str, optional
+        Variable holding the split, either booleans (True = train) or the "train"/"val" labels
+        of `eugene.preprocess.train_test_homology_split`, by default "train_val"
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        Indices of the training and validation sequences.
+    """
+    split = np.asarray(sdata[train_var].values)
+    if split.dtype.kind in "SUO":
+        split = split.astype("U")
+        return np.flatnonzero(split == "train"), np.flatnonzero(split == "val")
+    split = split.astype(bool)
+    return np.flatnonzero(split), np.flatnonzero(~split)
+
+
+def nan_target_mask(
+    sdata: xr.Dataset,
+    target_vars: Union[str, List[str]],
+) -> np.ndarray:
+    """Get a mask of the sequences with a NaN in any of their targets.
+
+    The mask is reduced chunk by chunk for dask-backed targets, so large multitask targets
+    (e.g. one target per cell) never have to be fully loaded into memory.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object.
+    target_vars : str or list of str
+        Target variables to check.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask along "_sequence", True for sequences with a NaN target.
+    """
+    if isinstance(target_vars, str):
+        target_vars = [target_vars]
+    mask = None
+    for target_var in target_vars:
+        isnull = sdata[target_var].isnull()
+        other_dims = [dim for dim in isnull.dims if dim != "_sequence"]
+        isnull = isnull.any(other_dims) if other_dims else isnull
+        mask = isnull if mask is None else mask | isnull
+    return np.asarray(mask.values, dtype=bool)
@@ -0,0 +1,77 @@
+from typing import Optional, Union
+
+import numpy as np
+import torch
+
+from ..preprocess._utils import unpack_tokens
+
+
+class TokensToOHE:
+    """Expands integer tokens to one-hot encoded sequences on the fly.
+
+    Meant to be used as a transform on variables created with `eugene.preprocess.tokenize_seqs_sdata`
+    so that only the compact tokens are stored and loaded, e.g. `transforms={"ohe_seq": TokensToOHE()}`.
+    Works on NumPy arrays (e.g. in the collate step of a dataloader) as well as on torch tensors
+    (e.g. on the GPU at the start of a forward pass). Tokens equal to the alphabet size (unknown
+    characters) are expanded to a vector filled with `fill_value`.
+
+    Parameters
+    ----------
+    alphabet_size : int, optional
+        Number of characters in the alphabet, defaults to 4.
+    length : int, optional
+        Length of the sequences if the tokens are 2-bit packed (stored in the "length" attribute
+        of the packed variable). If None, the tokens are assumed to be unpacked, defaults to None.
+    fill_value : float, optional
+        Value to fill unknown characters with, defaults to 0.
+    channels_first : bool, optional
+        Whether to return sequences with shape (N, A, L) instead of (N, L, A), defaults to False.
+    dtype : numpy.dtype, optional
+        Data type of the one-hot encoded sequences, defaults to np.float32.
+    """
+
+    def __init__(
+        self,
+        alphabet_size: int = 4,
+        length: Optional[int] = None,
+        fill_value: float = 0,
+        channels_first: bool = False,
+        dtype: np.dtype = np.float32,
+    ):
+        self.alphabet_size = alphabet_size
+        self.length = length
+        self.fill_value = fill_value
+        self.channels_first = channels_first
+        self.lut = np.concatenate(
+            [
+                np.eye(alphabet_size, dtype=dtype),
+                np.full((1, alphabet_size), fill_value, dtype=dtype),
+            ]
+        )
+
+    def __call__(
+        self, x: Union[np.ndarray, torch.Tensor]
+    ) -> Union[np.ndarray, torch.Tensor]:
+        """Expand a batch of tokens to one-hot encoded sequences.
+
+        Parameters
+        ----------
+        x : numpy.ndarray or torch.Tensor
+            Batch of tokens (shape: (N, L)) or packed tokens (shape: (N, ceil(L / 4))).
+
+        Returns
+        -------
+        numpy.ndarray or torch.Tensor
+            One-hot encoded sequences (shape: (N, L, A) or (N, A, L) if `channels_first`).
+        """
+        if isinstance(x, torch.Tensor):
+            if self.length is not None:
+                shifts = torch.tensor([6, 4, 2, 0], dtype=torch.uint8, device=x.device)
+                x = (x.to(torch.uint8)[..., None] >> shifts) & 3
+                x = x.reshape(*x.shape[:-2], -1)[..., : self.length]
+            ohe = torch.as_tensor(self.lut, device=x.device)[x.long()]
+        else:
+            if self.length is not None:
+                x = unpack_tokens(x, self.length)
+            ohe = self.lut[x]
+        return ohe.swapaxes(-1, -2) if self.channels_first else ohe
@@ -0,0 +1,326 @@
+import json
+import os
+from os import PathLike
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from .._settings import settings
+from ..preprocess._utils import pack_tokens
+from ._mmap import _stack_items
+
+_DNA_LUT = np.full(256, 4, dtype=np.uint8)
+for _i, _c in enumerate(b"ACGT"):
+    _DNA_LUT[_c] = _i
+    _DNA_LUT[ord(chr(_c).lower())] = _i
+
+
+def _iter_fasta(fasta: PathLike) -> Iterator[Tuple[str, np.ndarray]]:
+    """Yield the name and tokens (A=0, C=1, G=2, T=3, other=4) of each record of a FASTA file."""
+    name, lines = None, []
+    with open(fasta, "rb") as f:
+        for line in f:
+            if line.startswith(b">"):
+                if name is not None:
+                    yield name, _DNA_LUT[np.frombuffer(b"".join(lines), dtype=np.uint8)]
+                name, lines = line[1:].split()[0].decode(), []
+            else:
+                lines.append(line.rstrip())
+    if name is not None:
+        yield name, _DNA_LUT[np.frombuffer(b"".join(lines), dtype=np.uint8)]
+
+
+def write_genome_cache(
+    fasta: PathLike,
+    cache_dir: Optional[PathLike] = None,
+) -> PathLike:
+    """Encode a reference FASTA into a 2-bit packed cache that can be memory-mapped.
+
+    Each chromosome is packed at 4 bases per byte into a single flat file, and runs of unknown
+    bases (e.g. N) are stored separately as intervals. A human genome then takes ~750 MB on disk
+    and is read on demand through the page cache by `GenomeDataset`. The FASTA is read one
+    chromosome at a time.
+
+    Parameters
+    ----------
+    fasta : PathLike
+        Path to the (uncompressed) reference FASTA.
+    cache_dir : PathLike, optional
+        Directory to write the cache to. If None, uses "{fasta}.2bit", by default None
+
+    Returns
+    -------
+    PathLike
+        The cache directory.
+    """
+    cache_dir = cache_dir if cache_dir is not None else f"{fasta}.2bit"
+    os.makedirs(cache_dir, exist_ok=True)
+    chroms: Dict[str, Dict[str, int]] = {}
+    n_blocks = []
+    offset = 0
+    with open(os.path.join(cache_dir, "genome.bin"), "wb") as f:
+        for name, tokens in _iter_fasta(fasta):
+            unknown = np.diff(np.concatenate([[0], tokens == 4, [0]]).astype(np.int8))
+            starts, ends = np.flatnonzero(unknown == 1), np.flatnonzero(unknown == -1)
+            n_blocks.append(np.stack([starts, ends], axis=1) + 4 * offset)
+            packed = pack_tokens(np.where(tokens == 4, 0, tokens))
+            f.write(packed.tobytes())
+            chroms[name] = {"length": len(tokens), "offset": offset}
+            offset += len(packed)
+    np.save(
+        os.path.join(cache_dir, "n_blocks.npy"),
+        np.concatenate(n_blocks) if n_blocks else np.empty((0, 2), dtype=np.int64),
+    )
+    with open(os.path.join(cache_dir, "chroms.json"), "w") as f:
+        json.dump(chroms, f)
+    print(f"Wrote 2-bit cache of {len(chroms)} chromosomes from {fasta} to {cache_dir}")
+    return cache_dir
+
+
+def read_bed(
+    bed: PathLike,
+    target_cols: Optional[List[int]] = None,
+) -> pd.DataFrame:
+    """Read the intervals (and optionally targets) of a BED file.
+
+    Parameters
+    ----------
+    bed : PathLike
+        Path to the BED file. Header, track and comment lines are skipped.
+    target_cols : list of int, optional
+        0-based indices of the columns holding targets, by default None
+
+    Returns
+    -------
+    pd.DataFrame
+        Intervals with columns "chrom", "start", "end" and one column per target.
+    """
+    df = pd.read_csv(
+        bed, sep="\t", header=None, comment="#", dtype={0: str}, skip_blank_lines=True
+    )
+    df = df[~df[0].str.startswith(("track", "browser"))]
+    intervals = pd.DataFrame(
+        {
+            "chrom": df[0].values,
+            "start": df[1].astype(np.int64).values,
+            "end": df[2].astype(np.int64).values,
+        }
+    )
+    for i, col in enumerate(target_cols or []):
+        intervals[f"target_{i}"] = df[col].astype(np.float32).values
+    return intervals
+
+
+class GenomeDataset(Dataset):
+    """Dataset extracting one-hot encoded windows from a reference genome at batch time.
+
+    Sequences are never pre-extracted: the reference is kept as a memory-mapped 2-bit cache (see
+    `write_genome_cache`) and every batch of intervals is extracted, padded and one-hot encoded
+    with a few vectorized lookups. Windows of seq_length bases are centered on the intervals and
+    can be randomly shifted by up to max_shift bases and reverse-complemented, so the windowing
+    and jitter can change between runs without redoing any preprocessing. Windows reaching past
+    the ends of a chromosome and unknown bases are encoded as zeros.
+
+    Parameters
+    ----------
+    fasta : PathLike
+        Path to the reference FASTA. Its 2-bit cache is written on first use.
+    bed : PathLike or pd.DataFrame
+        BED file (or DataFrame with "chrom", "start" and "end" columns) of the intervals.
+    seq_length : int, optional
+        Length of the extracted windows. If None, uses the length of the first interval,
+        by default None
+    target_cols : list of int, optional
+        0-based indices of the columns of the BED file holding targets. If bed is a DataFrame,
+        its columns starting with "target" are used. Several targets are stacked along a last
+        axis, a single target has no target axis, by default None
+    max_shift : int, optional
+        Maximum random shift of the windows in each direction, by default 0
+    rc_prob : float, optional
+        Probability to reverse-complement each window, by default 0
+    cache_dir : PathLike, optional
+        Directory of the 2-bit cache. If None, uses "{fasta}.2bit", by default None
+    seq_var : str, optional
+        Name of the sequences in the batches, by default "ohe_seq"
+    target_var : str, optional
+        Name of the targets in the batches, by default "target"
+    transforms : dict, optional
+        Functions to apply to the NumPy arrays of each batch keyed by name, e.g.
+        {"ohe_seq": lambda x: x.swapaxes(1, 2)}, by default None
+    dtype : torch.dtype, optional
+        Data type of the one-hot encoded sequences, by default torch.float32
+    """
+
+    def __init__(
+        self,
+        fasta: PathLike,
+        bed: Union[PathLike, pd.DataFrame],
+        seq_length: Optional[int] = None,
+        target_cols: Optional[List[int]] = None,
+        max_shift: int = 0,
+        rc_prob: float = 0,
+        cache_dir: Optional[PathLike] = None,
+        seq_var: str = "ohe_seq",
+        target_var: str = "target",
+        transforms: Optional[Dict[str, Callable]] = None,
+        dtype: torch.dtype = torch.float32,
+    ):
+        self.cache_dir = cache_dir if cache_dir is not None else f"{fasta}.2bit"
+        if not os.path.exists(os.path.join(self.cache_dir, "chroms.json")):
+            write_genome_cache(fasta, self.cache_dir)
+        with open(os.path.join(self.cache_dir, "chroms.json")) as f:
+            chroms = json.load(f)
+        intervals = bed if isinstance(bed, pd.DataFrame) else read_bed(bed, target_cols)
+        missing = set(intervals["chrom"]) - set(chroms)
+        if missing:
+            raise ValueError(f"Chromosomes {sorted(missing)} of the intervals are not in {fasta}")
+        self.seq_length = (
+            seq_length
+            if seq_length is not None
+            else int(intervals["end"].iloc[0] - intervals["start"].iloc[0])
+        )
+        centers = (intervals["start"].values + intervals["end"].values) // 2
+        self.chrom_offsets = np.array([4 * chroms[c]["offset"] for c in intervals["chrom"]])
+        self.chrom_lengths = np.array([chroms[c]["length"] for c in intervals["chrom"]])
+        self.starts = centers - self.seq_length // 2
+        target_names = [col for col in intervals.columns if col.startswith("target")]
+        self.targets = (
+            intervals[target_names].values.astype(np.float32) if target_names else None
+        )
+        if self.targets is not None and len(target_names) == 1:
+            # a single target is loaded with shape (N,), as in get_sdata_dataloader
+            self.targets = self.targets[:, 0]
+        self.max_shift = max_shift
+        self.rc_prob = rc_prob
+        self.seq_var = seq_var
+        self.target_var = target_var
+        self.transforms = transforms if transforms is not None else {}
+        self.dtype = dtype
+        self.n_blocks = np.load(os.path.join(self.cache_dir, "n_blocks.npy"))
+        self._genome: Optional[np.ndarray] = None
+
+    @property
+    def genome(self) -> np.ndarray:
+        """The memory-mapped 2-bit packed genome, opened on first access in each process."""
+        if self._genome is None:
+            self._genome = np.memmap(
+                os.path.join(self.cache_dir, "genome.bin"), dtype=np.uint8, mode="r"
+            )
+        return self._genome
+
+    def __getstate__(self):
+        # don't pickle the map, workers reopen it
+        state = self.__dict__.copy()
+        state["_genome"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        return {k: v[0] for k, v in self.__getitems__([idx]).items()}
+
+    def __getitems__(self, idx: List[int]) -> Dict[str, torch.Tensor]:
+        idx = np.asarray(idx)
+        starts = self.starts[idx]
+        if self.max_shift > 0:
+            # torch's RNG is seeded per dataloader worker, NumPy's isn't
+            starts = starts + torch.randint(
+                -self.max_shift, self.max_shift + 1, (len(idx),)
+            ).numpy()
+        tokens = self.extract(starts, idx)
+        if self.rc_prob > 0:
+            rc = torch.rand(len(idx)).numpy() < self.rc_prob
+            tokens[rc] = np.where(tokens[rc] == 4, 4, 3 - tokens[rc])[:, ::-1]
+        # unknown bases (token 4) map to the zero row
+        ohe = np.eye(5, 4, dtype=np.float32)[tokens]
+        batch = {self.seq_var: ohe}
+        if self.targets is not None:
+            batch[self.target_var] = self.targets[idx]
+        for name, transform in self.transforms.items():
+            batch[name] = transform(batch[name])
+        batch = {name: torch.as_tensor(arr) for name, arr in batch.items()}
+        batch[self.seq_var] = batch[self.seq_var].to(self.dtype)
+        return batch
+
+    def extract(self, starts: np.ndarray, idx: np.ndarray) -> np.ndarray:
+        """Extract the tokens of windows starting at starts on the chromosomes of intervals idx.
+
+        Returns
+        -------
+        numpy.ndarray
+            Tokens of shape (len(starts), seq_length), 4 for unknown or out of bounds bases.
+        """
+        pos = starts[:, None] + np.arange(self.seq_length)
+        inside = (pos >= 0) & (pos < self.chrom_lengths[idx, None])
+        pos = self.chrom_offsets[idx, None] + np.clip(pos, 0, self.chrom_lengths[idx, None] - 1)
+        tokens = (self.genome[pos >> 2] >> (6 - 2 * (pos & 3)).astype(np.uint8)) & 3
+        if len(self.n_blocks) == 0:
+            return np.where(inside, tokens, 4).astype(np.uint8)
+        block = np.searchsorted(self.n_blocks[:, 0], pos, side="right") - 1
+        unknown = (block >= 0) & (pos < self.n_blocks[np.maximum(block, 0), 1])
+        return np.where(inside & ~unknown, tokens, 4).astype(np.uint8)
+
+    @staticmethod
+    def collate(
+        batch: Union[Dict[str, torch.Tensor], List[Dict[str, torch.Tensor]]]
+    ) -> Dict[str, torch.Tensor]:
+        """Collate function for batches that are already extracted by `__getitems__`.
+
+        DataLoaders of torch<2 don't call `__getitems__` and pass a list of items instead,
+        which are stacked.
+        """
+        return _stack_items(batch)
+
+
+def get_genome_dataloader(
+    fasta: PathLike,
+    bed: Union[PathLike, pd.DataFrame],
+    seq_length: Optional[int] = None,
+    target_cols: Optional[List[int]] = None,
+    max_shift: int = 0,
+    rc_prob: float = 0,
+    cache_dir: Optional[PathLike] = None,
+    transforms: Optional[Dict[str, Callable]] = None,
+    batch_size: Optional[int] = None,
+    shuffle: bool = False,
+    sampler: Optional[Sampler] = None,
+    num_workers: Optional[int] = None,
+    prefetch_factor: Optional[int] = None,
+    pin_memory: bool = False,
+    drop_last: bool = False,
+) -> DataLoader:
+    """Get a PyTorch DataLoader extracting windows of a reference genome on the fly.
+
+    The returned dataloader can be passed to `eugene.train.fit`. See `GenomeDataset` and
+    `get_sdata_dataloader` for the parameters.
+
+    Returns
+    -------
+    DataLoader
+        Dataloader yielding dictionaries of tensors.
+    """
+    dataset = GenomeDataset(
+        fasta,
+        bed,
+        seq_length=seq_length,
+        target_cols=target_cols,
+        max_shift=max_shift,
+        rc_prob=rc_prob,
+        cache_dir=cache_dir,
+        transforms=transforms,
+    )
+    return DataLoader(
+        dataset,
+        batch_size=batch_size if batch_size is not None else settings.batch_size,
+        shuffle=shuffle,
+        sampler=sampler,
+        num_workers=num_workers if num_workers is not None else settings.dl_num_workers,
+        prefetch_factor=prefetch_factor,
+        pin_memory=pin_memory,
+        drop_last=drop_last,
+        collate_fn=GenomeDataset.collate,
+    )
@@ -0,0 +1,238 @@
+import os
+from os import PathLike
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+import torch
+import xarray as xr
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from .._settings import settings
+
+
+def write_mmap_sdata(
+    sdata: xr.Dataset,
+    path: PathLike,
+    variables: Union[str, List[str]],
+    target_vars: Optional[Union[str, List[str]]] = None,
+    target_var: str = "target",
+    dtypes: Optional[Dict[str, np.dtype]] = None,
+    chunk_size: Optional[int] = None,
+) -> None:
+    """Export variables of a SeqData to flat memory-mapped binary files.
+
+    Each variable is written to `{path}/{var}.npy` as a single contiguous array (the .npy header
+    is padded so the data starts at a 64-byte aligned offset). Target variables are stacked like
+    in `get_sdata_dataloader` and written to `{path}/{target_var}.npy`. The SeqData is read and
+    written in chunks along "_sequence", so it never has to fit into memory. Exported directories
+    can then be served with `MmapDataset` or `get_mmap_dataloader` without deserializing any chunks.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object to export.
+    path : PathLike
+        Directory to write the arrays to. Created if it doesn't exist.
+    variables : str or list of str
+        Variables to export, e.g. "ohe_seq".
+    target_vars : str or list of str, optional
+        Target variables to stack and export as target_var, by default None
+    target_var : str, optional
+        Name of the stacked targets, by default "target"
+    dtypes : dict, optional
+        Data types to store variables (or target_var) as, e.g. {"ohe_seq": np.float32}.
+        Variables not listed keep their data type, by default None
+    chunk_size : int, optional
+        Number of sequences to read and write at once. If None, the chunk size of the first
+        dask-backed variable or 10000 is used, by default None
+    """
+    variables = [variables] if isinstance(variables, str) else list(variables)
+    target_vars = [target_vars] if isinstance(target_vars, str) else target_vars
+    dtypes = dtypes if dtypes is not None else {}
+    os.makedirs(path, exist_ok=True)
+    to_read = list(dict.fromkeys(variables + (target_vars or [])))
+    if chunk_size is None:
+        chunks = [sdata[var].chunksizes.get("_sequence") for var in to_read]
+        chunks = [chunk for chunk in chunks if chunk is not None]
+        chunk_size = chunks[0][0] if chunks else 10000
+    n_seqs = sdata.sizes["_sequence"]
+
+    outputs = {}
+    for var in variables:
+        arr = sdata[var]
+        outputs[var] = np.lib.format.open_memmap(
+            os.path.join(path, f"{var}.npy"),
+            mode="w+",
+            dtype=dtypes.get(var, arr.dtype),
+            shape=arr.shape,
+        )
+    if target_vars:
+        shape = sdata[target_vars[0]].shape
+        shape = shape if len(target_vars) == 1 else shape + (len(target_vars),)
+        outputs[target_var] = np.lib.format.open_memmap(
+            os.path.join(path, f"{target_var}.npy"),
+            mode="w+",
+            dtype=dtypes.get(
+                target_var, np.result_type(*[sdata[var].dtype for var in target_vars])
+            ),
+            shape=shape,
+        )
+    for start in range(0, n_seqs, chunk_size):
+        block = sdata[to_read].isel(_sequence=slice(start, start + chunk_size)).compute()
+        for var in variables:
+            outputs[var][start : start + chunk_size] = block[var].values
+        if target_vars:
+            targets = [block[var].values for var in target_vars]
+            outputs[target_var][start : start + chunk_size] = (
+                targets[0] if len(targets) == 1 else np.stack(targets, axis=-1)
+            )
+    for out in outputs.values():
+        out.flush()
+    print(f"Wrote {list(outputs.keys())} for {n_seqs} sequences to {path}")
+
+
+class MmapDataset(Dataset):
+    """Dataset serving batches from arrays exported with `write_mmap_sdata`.
+
+    The arrays are memory-mapped (copy-on-write, so they are never modified on disk) and single
+    samples are returned as `torch.from_numpy` views of the maps, so nothing is deserialized or
+    copied when loading them. The maps are opened lazily in each process, so DataLoader workers
+    share the page cache of the operating system instead of each holding their own copy of the
+    data. Batches of indices (see `get_mmap_dataloader`) are gathered into a new array with a
+    single fancy-indexing read per array, which copies the batch once.
+
+    Parameters
+    ----------
+    path : PathLike
+        Directory written by `write_mmap_sdata`.
+    variables : list of str, optional
+        Arrays to load. If None, all arrays in the directory are loaded, by default None
+    indices : numpy.ndarray, optional
+        Indices of the sequences to serve, e.g. the training split. If None, all sequences are
+        served, by default None
+    transforms : dict, optional
+        Functions to apply to the NumPy arrays of each sample or batch keyed by variable, e.g.
+        {"ohe_seq": lambda x: x.swapaxes(-1, -2)}, by default None
+    dtypes : torch.dtype or dict, optional
+        Data type(s) to convert the tensors to. If None, the stored data types are kept, which
+        avoids any copy, by default None
+    """
+
+    def __init__(
+        self,
+        path: PathLike,
+        variables: Optional[List[str]] = None,
+        indices: Optional[np.ndarray] = None,
+        transforms: Optional[Dict[str, Callable]] = None,
+        dtypes: Optional[Union[torch.dtype, Dict[str, torch.dtype]]] = None,
+    ):
+        self.path = path
+        if variables is None:
+            variables = sorted(
+                file[:-4] for file in os.listdir(path) if file.endswith(".npy")
+            )
+        self.variables = variables
+        self.transforms = transforms if transforms is not None else {}
+        self.dtypes = dtypes
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+        n_seqs = len(self.arrays[variables[0]])
+        self.indices = np.arange(n_seqs) if indices is None else np.asarray(indices)
+
+    @property
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The memory-mapped arrays, opened on first access in each process."""
+        if self._arrays is None:
+            self._arrays = {
+                var: np.load(os.path.join(self.path, f"{var}.npy"), mmap_mode="c")
+                for var in self.variables
+            }
+        return self._arrays
+
+    def __getstate__(self):
+        # don't pickle the maps, workers reopen them
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, idx: int) -> Dict[str, torch.Tensor]:
+        # loaded as a batch of one, so transforms always see batches, and sliced to get a view
+        start = int(self.indices[idx])
+        return {var: data[0] for var, data in self._load(slice(start, start + 1)).items()}
+
+    def __getitems__(self, idx: List[int]) -> Dict[str, torch.Tensor]:
+        return self._load(self.indices[np.asarray(idx)])
+
+    def _load(self, idx: Union[slice, np.ndarray]) -> Dict[str, torch.Tensor]:
+        batch = {}
+        for var, arr in self.arrays.items():
+            data = arr[idx]
+            if var in self.transforms:
+                data = self.transforms[var](data)
+            if isinstance(data, np.ndarray):
+                data = torch.from_numpy(np.asarray(data))
+            dtype = self.dtypes.get(var) if isinstance(self.dtypes, dict) else self.dtypes
+            batch[var] = data.to(dtype) if dtype is not None else data
+        return batch
+
+    @staticmethod
+    def collate(
+        batch: Union[Dict[str, torch.Tensor], List[Dict[str, torch.Tensor]]]
+    ) -> Dict[str, torch.Tensor]:
+        """Collate function for batches that are already gathered by `__getitems__`.
+
+        DataLoaders of torch<2 don't call `__getitems__` and pass a list of items instead,
+        which are stacked.
+        """
+        return _stack_items(batch)
+
+
+def _stack_items(
+    batch: Union[Dict[str, torch.Tensor], List[Dict[str, torch.Tensor]]]
+) -> Dict[str, torch.Tensor]:
+    """Stack a list of items into a batch, batches gathered by `__getitems__` are kept as is."""
+    if isinstance(batch, dict):
+        return batch
+    return {key: torch.stack([item[key] for item in batch]) for key in batch[0]}
+
+
+def get_mmap_dataloader(
+    path: PathLike,
+    variables: Optional[List[str]] = None,
+    indices: Optional[np.ndarray] = None,
+    batch_size: Optional[int] = None,
+    shuffle: bool = False,
+    transforms: Optional[Dict[str, Callable]] = None,
+    dtypes: Optional[Union[torch.dtype, Dict[str, torch.dtype]]] = None,
+    sampler: Optional[Sampler] = None,
+    num_workers: Optional[int] = None,
+    prefetch_factor: Optional[int] = None,
+    pin_memory: bool = False,
+    drop_last: bool = False,
+) -> DataLoader:
+    """Get a PyTorch DataLoader over arrays exported with `write_mmap_sdata`.
+
+    Each batch is gathered from the memory-mapped arrays with a single read per array. See
+    `MmapDataset` and `get_sdata_dataloader` for the parameters.
+
+    Returns
+    -------
+    DataLoader
+        Dataloader yielding dictionaries of tensors.
+    """
+    dataset = MmapDataset(
+        path, variables=variables, indices=indices, transforms=transforms, dtypes=dtypes
+    )
+    return DataLoader(
+        dataset,
+        batch_size=batch_size if batch_size is not None else settings.batch_size,
+        shuffle=shuffle,
+        sampler=sampler,
+        num_workers=num_workers if num_workers is not None else settings.dl_num_workers,
+        prefetch_factor=prefetch_factor,
+        pin_memory=pin_memory,
+        drop_last=drop_last,
+        collate_fn=MmapDataset.collate,
+    )
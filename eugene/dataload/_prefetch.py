@@ -0,0 +1,114 @@
+import queue
+import threading
+from typing import Any, Iterable, Iterator, Optional, Union
+
+import torch
+
+
+def _apply(batch: Any, fn) -> Any:
+    """Apply fn to every tensor of a (nested) batch."""
+    if isinstance(batch, torch.Tensor):
+        return fn(batch)
+    if isinstance(batch, dict):
+        return {key: _apply(value, fn) for key, value in batch.items()}
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_apply(value, fn) for value in batch)
+    return batch
+
+
+class DevicePrefetcher:
+    """Iterates over a dataloader while the next batches are loaded and copied to a device.
+
+    Batches are fetched from the wrapped dataloader by a background thread, so loading (and
+    collating) the next batches overlaps with the computation on the current one, on CPU-only
+    machines as well. If pin_memory, the tensors of the batches are staged in page-locked memory by
+    that thread. On CUDA devices, the batches are then copied with non-blocking copies issued on a
+    side stream, and the compute stream only waits for a copy when its batch is yielded. Used by
+    `eugene.evaluate.InferenceEngine`, and by `eugene.train.fit` with prefetch_to_device=True.
+
+    Parameters
+    ----------
+    loader : Iterable
+        Dataloader (or any iterable) yielding tensors or dicts, lists or tuples of tensors.
+    device : str or torch.device, optional
+        Device to move the batches to. If None, uses "cuda" if available, else "cpu".
+    pin_memory : bool, optional
+        Whether to pin the batches before copying. If None, pins when copying to a CUDA device.
+        Ignored if CUDA is unavailable.
+    prefetch : int, optional
+        Number of batches to load ahead, by default 2
+    """
+
+    def __init__(
+        self,
+        loader: Iterable,
+        device: Optional[Union[str, torch.device]] = None,
+        pin_memory: Optional[bool] = None,
+        prefetch: int = 2,
+    ):
+        self.loader = loader
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.is_cuda = self.device.type == "cuda"
+        pin_memory = self.is_cuda if pin_memory is None else pin_memory
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.prefetch = prefetch
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def _load(self, out: queue.Queue, stop: threading.Event) -> None:
+        try:
+            for batch in self.loader:
+                if self.pin_memory:
+                    batch = _apply(batch, lambda t: t if t.is_pinned() else t.pin_memory())
+                while not stop.is_set():
+                    try:
+                        out.put((batch, None), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            out.put((None, StopIteration()))
+        except Exception as e:
+            out.put((None, e))
+
+    def __iter__(self) -> Iterator[Any]:
+        batches: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._load, args=(batches, stop), daemon=True)
+        thread.start()
+        stream = torch.cuda.Stream(self.device) if self.is_cuda else None
+
+        def next_batch():
+            batch, error = batches.get()
+            if error is not None:
+                raise error
+            if stream is None:
+                return _apply(batch, lambda t: t.to(self.device))
+            with torch.cuda.stream(stream):
+                return _apply(batch, lambda t: t.to(self.device, non_blocking=True))
+
+        try:
+            try:
+                upcoming = next_batch()
+            except StopIteration:
+                return
+            while True:
+                if stream is not None:
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_stream(stream)
+                    # the copies were allocated on the side stream
+                    _apply(upcoming, lambda t: t.record_stream(current))
+                batch = upcoming
+                try:
+                    # issue the copy of the next batch before handing out the current one
+                    upcoming = next_batch()
+                except StopIteration:
+                    yield batch
+                    return
+                yield batch
+        finally:
+            stop.set()
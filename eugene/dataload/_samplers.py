@@ -0,0 +1,104 @@
+from typing import Iterator, List, Optional, Sequence
+
+import numpy as np
+from torch.utils.data import Sampler
+
+
+class ContiguousBatchSampler(Sampler[List[int]]):
+    """Batch sampler yielding contiguous slabs of positions.
+
+    Every batch is a run of `batch_size` consecutive positions, so dataloaders built with
+    `get_sdata_dataloader` read it with a single slice of the SeqData instead of fancy indexing
+    (and from a single chunk of dask-backed variables most of the time). With shuffle=True, the
+    order of the batches is shuffled every epoch while their composition stays fixed.
+
+    Parameters
+    ----------
+    n : int
+        Number of positions to sample from, e.g. the length of the dataset.
+    batch_size : int
+        Number of positions per batch.
+    shuffle : bool, optional
+        Whether to shuffle the order of the batches every epoch, by default False
+    drop_last : bool, optional
+        Whether to drop the last batch if it is smaller than batch_size, by default False
+    seed : int, optional
+        Random seed for shuffling, by default None
+    """
+
+    def __init__(
+        self,
+        n: int,
+        batch_size: int,
+        shuffle: bool = False,
+        drop_last: bool = False,
+        seed: Optional[int] = None,
+    ):
+        self.n = n
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.rng = np.random.default_rng(seed)
+
+    def __iter__(self) -> Iterator[List[int]]:
+        starts = np.arange(0, len(self) * self.batch_size, self.batch_size)
+        if self.shuffle:
+            starts = self.rng.permutation(starts)
+        for start in starts:
+            yield list(range(start, min(start + self.batch_size, self.n)))
+
+    def __len__(self) -> int:
+        if self.drop_last:
+            return self.n // self.batch_size
+        return -(-self.n // self.batch_size)
+
+
+class ChunkShuffleSampler(Sampler[int]):
+    """Sampler shuffling chunk by chunk for chunked (e.g. zarr-backed) SeqDatas.
+
+    Fully random sampling makes every batch touch almost every chunk of a chunked store. Instead,
+    every epoch this sampler shuffles the order of the chunks and then shuffles the sequences within
+    consecutive groups of buffer_size chunks, like the shuffle buffer of webdataset. Each batch
+    then only reads from the buffer_size chunks held in the buffer, so I/O stays nearly sequential
+    while the shuffling is adequate for training. Larger buffers shuffle better at the cost of
+    memory.
+
+    Parameters
+    ----------
+    indices : numpy.ndarray
+        Integer indices along "_sequence" that are sampled, e.g. the training split. The sampler
+        yields positions in indices, like the samplers passed to `get_sdata_dataloader`.
+    chunks : tuple of int
+        Chunk sizes along "_sequence", e.g. `sdata["ohe_seq"].chunksizes["_sequence"]`.
+    buffer_size : int, optional
+        Number of chunks to shuffle together, by default 8
+    seed : int, optional
+        Random seed, by default None
+    """
+
+    def __init__(
+        self,
+        indices: np.ndarray,
+        chunks: Sequence[int],
+        buffer_size: int = 8,
+        seed: Optional[int] = None,
+    ):
+        indices = np.asarray(indices)
+        chunk_ids = np.searchsorted(np.cumsum(chunks), indices, side="right")
+        order = np.argsort(chunk_ids, kind="stable")
+        splits = np.flatnonzero(np.diff(chunk_ids[order])) + 1
+        self.chunk_positions = np.split(order, splits) if len(order) > 0 else []
+        self.n = len(indices)
+        self.buffer_size = buffer_size
+        self.rng = np.random.default_rng(seed)
+
+    def __iter__(self) -> Iterator[int]:
+        chunk_order = self.rng.permutation(len(self.chunk_positions))
+        for start in range(0, len(chunk_order), self.buffer_size):
+            buffer = np.concatenate(
+                [self.chunk_positions[i] for i in chunk_order[start : start + self.buffer_size]]
+            )
+            yield from self.rng.permutation(buffer).tolist()
+
+    def __len__(self) -> int:
+        return self.n
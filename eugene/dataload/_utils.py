@@ -12,14 +12,183 @@ from typing import (
     Union,
     cast,
 )
+import dask.array as da
+import numpy as np
 import pandas as pd
+import torch
 import xarray as xr
+from torch.utils.data import WeightedRandomSampler
+
+
+class ConcatSeqData:
+    """Virtual concatenation of multiple SeqDatas along "_sequence".
+
+    Indexes across the member SeqDatas without materializing their union: selecting sequences
+    with `isel` reads each member only for the sequences that come from it, so e.g. several MPRA
+    libraries can be trained on together (see `get_sdata_dataloader`) without any copy. Only an
+    integer dataset-of-origin index per sequence is kept, and it is exposed as the batch_var
+    variable. Selecting a single variable (`cdata["target"]`) concatenates that variable only,
+    which is meant for small per-sequence variables like targets and splits.
+
+    Parameters
+    ----------
+    sdatas : list of xr.Dataset
+        SeqDatas to concatenate. The variables that are loaded must have the same dimensions
+        (other than "_sequence") in all of them.
+    keys : list, optional
+        Names of the SeqDatas stored in batch_var. If None, uses their positions, by default None
+    batch_var : str, optional
+        Name of the dataset-of-origin variable, by default "batch"
+    variables : list of str, optional
+        Variables to expose. If None, the variables shared by all SeqDatas, by default None
+    """
+
+    def __init__(
+        self,
+        sdatas: Iterable[xr.Dataset],
+        keys: Optional[List] = None,
+        batch_var: str = "batch",
+        variables: Optional[List[str]] = None,
+    ):
+        self.sdatas = list(sdatas)
+        self.keys = np.asarray(keys if keys is not None else range(len(self.sdatas)))
+        self.batch_var = batch_var
+        if variables is None:
+            variables = [
+                var
+                for var in self.sdatas[0].data_vars
+                if all(var in sdata.data_vars for sdata in self.sdatas[1:])
+            ]
+            variables.append(batch_var)
+        self.variables = list(variables)
+        sizes = np.array([sdata.sizes["_sequence"] for sdata in self.sdatas])
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)])
+        self.origin = np.repeat(
+            np.arange(len(self.sdatas), dtype=np.min_scalar_type(len(self.sdatas))), sizes
+        )
+
+    @property
+    def sizes(self) -> Dict[str, int]:
+        return {"_sequence": int(self.offsets[-1])}
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __repr__(self) -> str:
+        return (
+            f"ConcatSeqData of {len(self.sdatas)} SeqDatas ({len(self)} sequences) "
+            f"with variables {self.variables}"
+        )
+
+    def __getitem__(
+        self, key: Union[str, List[str]]
+    ) -> Union[xr.DataArray, "ConcatSeqData"]:
+        if isinstance(key, str):
+            if key == self.batch_var:
+                return xr.DataArray(self.keys[self.origin], dims=["_sequence"])
+            return xr.concat([sdata[key] for sdata in self.sdatas], dim="_sequence")
+        return ConcatSeqData(self.sdatas, self.keys, self.batch_var, list(key))
+
+    def chunksizes(self, var: str) -> Optional[Tuple[int, ...]]:
+        """Chunk sizes of var along "_sequence" across the SeqDatas, None if not chunked."""
+        chunks = [sdata[var].chunksizes.get("_sequence") for sdata in self.sdatas]
+        if any(chunk is None for chunk in chunks):
+            return None
+        return tuple(size for chunk in chunks for size in chunk)
+
+    def locate(self, indices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Get the dataset of origin and the index within it of global indices."""
+        indices = np.asarray(indices)
+        origin = self.origin[indices]
+        return origin, indices - self.offsets[origin]
+
+    def isel(
+        self, _sequence: Union[slice, np.ndarray, List[int]]
+    ) -> xr.Dataset:
+        """Select sequences by global integer index, reading each SeqData only once.
+
+        Returns
+        -------
+        xr.Dataset
+            SeqData of the selected sequences, lazy if the SeqDatas are.
+        """
+        if isinstance(_sequence, slice):
+            indices = np.arange(*_sequence.indices(len(self)))
+        else:
+            indices = np.asarray(_sequence)
+        origin, local = self.locate(indices)
+        variables = [var for var in self.variables if var != self.batch_var]
+        parts, positions = [], []
+        for i in np.unique(origin):
+            selected = np.flatnonzero(origin == i)
+            parts.append(self.sdatas[i][variables].isel(_sequence=local[selected]))
+            positions.append(selected)
+        subset = xr.concat(parts, dim="_sequence", join="exact") if len(parts) > 1 else parts[0]
+        order = np.concatenate(positions)
+        if len(parts) > 1 or not np.array_equal(order, np.arange(len(order))):
+            inverse = np.empty_like(order)
+            inverse[order] = np.arange(len(order))
+            subset = subset.isel(_sequence=inverse)
+        if self.batch_var in self.variables:
+            subset[self.batch_var] = xr.DataArray(self.keys[origin], dims=["_sequence"])
+        return subset
+
+    def weighted_sampler(
+        self,
+        weights: Optional[Union[List[float], Dict[Any, float]]] = None,
+        indices: Optional[np.ndarray] = None,
+        num_samples: Optional[int] = None,
+        replacement: bool = True,
+        seed: Optional[int] = None,
+    ) -> WeightedRandomSampler:
+        """Get a sampler drawing sequences from the SeqDatas in given proportions.
+
+        Can be passed as the sampler of `get_sdata_dataloader` (with the same indices), e.g. to
+        draw as many sequences from a small library as from a large one every epoch.
+
+        Parameters
+        ----------
+        weights : list or dict, optional
+            Relative weight of each SeqData (or of each key). If None, the SeqDatas are sampled
+            equally often regardless of their size, by default None
+        indices : numpy.ndarray, optional
+            Global indices the sampler draws positions for, e.g. the training split. If None, all
+            sequences, by default None
+        num_samples : int, optional
+            Number of samples per epoch. If None, the number of indices, by default None
+        replacement : bool, optional
+            Whether to draw with replacement, by default True
+        seed : int, optional
+            Random seed, by default None
+
+        Returns
+        -------
+        WeightedRandomSampler
+            Sampler over positions in indices.
+        """
+        indices = np.arange(len(self)) if indices is None else np.asarray(indices)
+        if weights is None:
+            weights = np.ones(len(self.sdatas))
+        elif isinstance(weights, dict):
+            weights = np.array([weights[key] for key in self.keys.tolist()], dtype=float)
+        origin = self.origin[indices]
+        counts = np.bincount(origin, minlength=len(self.sdatas))
+        sample_weights = np.asarray(weights, dtype=float)[origin] / counts[origin]
+        generator = torch.Generator().manual_seed(seed) if seed is not None else None
+        return WeightedRandomSampler(
+            torch.as_tensor(sample_weights, dtype=torch.double),
+            num_samples=num_samples if num_samples is not None else len(indices),
+            replacement=replacement,
+            generator=generator,
+        )
 
 
 def concat_sdatas(
     sdatas: Iterable[xr.Dataset],
     keys: Optional[List] = None,
-) -> xr.Dataset:
+    virtual: bool = False,
+    batch_var: str = "batch",
+) -> Union[xr.Dataset, ConcatSeqData]:
     """Concatenate multiple SeqDatas into one.
 
     Adds a "batch" variable to concatenated SeqData along the "_sequence" dimension.
@@ -27,44 +196,111 @@ def concat_sdatas(
     If there is not it will raise an error.
 
     Parameters
+    ----------
+    sdatas : list of xr.Dataset
+        SeqDatas to concatenate. They are not modified.
+    keys : list, optional
+        Values of the batch variable for each SeqData. If None, uses their positions.
+    virtual : bool, optional
+        Whether to return a `ConcatSeqData` view that reads from the SeqDatas on demand instead
+        of copying them into a new SeqData, by default False
+    batch_var : str, optional
+        Name of the batch variable, by default "batch"
+
+    Returns
+    -------
+    xr.Dataset or ConcatSeqData
+        The concatenated SeqData, or a view of it if virtual.
     """
-    for i, s in enumerate(sdatas):
-        s["batch"] = keys[i]
+    sdatas = list(sdatas)
+    keys = keys if keys is not None else list(range(len(sdatas)))
+    if virtual:
+        return ConcatSeqData(sdatas, keys=keys, batch_var=batch_var)
+    sdatas = [
+        s.assign({batch_var: xr.DataArray(np.full(s.sizes["_sequence"], key), dims=["_sequence"])})
+        for s, key in zip(sdatas, keys)
+    ]
     return xr.concat(sdatas, dim="_sequence")
 
 
+def _normalize_keys(keys: np.ndarray) -> np.ndarray:
+    """Decode bytes keys (e.g. ids stored as S dtype in zarr) so they match str keys."""
+    keys = np.asarray(keys)
+    if keys.dtype.kind == "S":
+        return keys.astype("U")
+    if keys.dtype.kind == "O" and len(keys) > 0 and isinstance(keys[0], bytes):
+        return np.array([key.decode() for key in keys], dtype=object)
+    return keys
+
+
+def _take_fill(values: np.ndarray, indexer: np.ndarray, fill: bool) -> np.ndarray:
+    """Take values[indexer], filling -1 (unmatched) with NaN or None like a left join.
+
+    If fill, the output is cast to a type that can hold missing values even if no index of this
+    indexer is missing, so blocks of a dask array all get the same type.
+    """
+    missing = indexer < 0
+    if len(values) == 0:
+        # empty obs, every key is missing and only the type of the values matters
+        values = np.empty(1, dtype=values.dtype)
+    out = values[np.where(missing, 0, indexer)]
+    if not fill:
+        return out
+    if out.dtype.kind in "iub":
+        out = out.astype(float)
+    elif out.dtype.kind not in "fcmM":
+        out = out.astype(object)
+    out[missing] = None if out.dtype.kind == "O" else np.nan if out.dtype.kind in "fc" else "NaT"
+    return out
+
+
 def add_obs(
     sdata: xr.Dataset,
     obs: pd.DataFrame,
     on: Optional[str] = None,
     left_on: Optional[str] = None,
     right_on: Optional[str] = None,
+    columns: Optional[List[str]] = None,
+    report_unmatched: bool = True,
 ) -> None:
     """Add observational metadata to a SeqData.
 
+    The keys of the SeqData are aligned to a hash index of the keys of obs (a left join), and only
+    the requested columns are gathered and added to the SeqData. If the keys of the SeqData are
+    dask-backed (e.g. read from zarr), the added columns stay lazy and are gathered chunk by chunk.
+    The number of sequences without a match in obs is reported, which computes the alignment once
+    (one integer per sequence) for dask-backed keys, shared by all added columns.
+
     Parameters
     ----------
     sdata : xr.Dataset
         The SeqData to add observations to.
     obs : pd.DataFrame
-        The observations to add.
+        The observations to add. Keys must be unique.
     on : str, optional
         The column name to join on. If not given, left_on and right_on must be given.
     left_on : str, optional
         The column name in the SeqData to join on. If not given, on must be given.
     right_on : str, optional
         The column name in the observations to join on. If not given, on must be given.
-    
+    columns : list of str, optional
+        The columns of obs to add. If None, all columns but the key are added.
+    report_unmatched : bool, optional
+        Whether to report the number of sequences without a match in obs. If False, the
+        alignment of dask-backed keys stays lazy too, and columns that can't hold missing values
+        (e.g. integers) are always cast to a type that can, by default True
+
     Raises
     ------
     ValueError
         If on is not given and left_on or right_on are not given.
         If on is given and left_on or right_on are given.
+        If the keys of obs are not unique.
     """
     if on is None and (left_on is None or right_on is None):
-        raise ValueError
+        raise ValueError("Either on or both left_on and right_on must be given.")
     if on is not None and (left_on is not None or right_on is not None):
-        raise ValueError
+        raise ValueError("on can't be given together with left_on or right_on.")
 
     if on is None:
         assert left_on is not None
@@ -73,11 +309,38 @@ def add_obs(
         left_on = on
         right_on = on
 
-    sdata[left_on] = sdata[left_on].astype("U").astype("O")
-    df = sdata[left_on].to_dataframe()
-    merged_df = df.merge(obs, left_on=left_on, right_on=right_on, how="left")
+    index = pd.Index(_normalize_keys(obs[right_on].values))
+    if not index.is_unique:
+        raise ValueError(f"Keys in column {right_on} of obs are not unique.")
+    columns = columns if columns is not None else [col for col in obs.columns if col != right_on]
+
+    keys = sdata[left_on].data
+    if isinstance(keys, da.Array):
+        indexer = keys.map_blocks(
+            lambda block: index.get_indexer(_normalize_keys(block)), dtype=np.int64
+        )
+        if report_unmatched:
+            # computed once, so the added columns don't each align the keys again
+            indexer = da.from_array(indexer.compute(), chunks=keys.chunks)
+    else:
+        indexer = index.get_indexer(_normalize_keys(keys))
+    fill = True
+    if report_unmatched:
+        n_unmatched = int((indexer < 0).sum())
+        fill = n_unmatched > 0
+        if n_unmatched > 0:
+            print(
+                f"{n_unmatched} of {sdata.sizes['_sequence']} sequences have no match in obs on "
+                f"{left_on}, their {columns} are missing."
+            )
 
-    for col in merged_df.columns:
-        if col == left_on:
-            continue
-        sdata[col] = xr.DataArray(merged_df[col].values, dims=["_sequence"])
+    for col in columns:
+        values = obs[col].to_numpy()
+        if isinstance(indexer, da.Array):
+            dtype = _take_fill(values[:1], np.zeros(1, dtype=np.int64), fill).dtype
+            data = indexer.map_blocks(
+                lambda block, values=values: _take_fill(values, block, fill), dtype=dtype
+            )
+        else:
+            data = _take_fill(values, indexer, fill)
+        sdata[col] = xr.DataArray(data, dims=["_sequence"])
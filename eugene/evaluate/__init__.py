@@ -2,3 +2,5 @@ from .metrics._binary_classification import median_calc, auc_calc, escore
 from ._evaluate import evaluate_model
 from ._predict import predictions, predictions_sequence_module
 from ._predict import train_val_predictions, train_val_predictions_sequence_module
+from ._inference import InferenceEngine
+from ._utils import PredictionStore, PredictionWriter
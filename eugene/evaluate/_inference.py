@@ -0,0 +1,251 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+import xarray as xr
+from tqdm.auto import tqdm
+
+from .._settings import settings
+from ..dataload._dataloader import get_sdata_dataloader
+from ..dataload._prefetch import DevicePrefetcher
+from ..models._tta import TestTimeAugmentation
+from ..models._utils import _predict_in_batches
+from ._utils import PredictionStore
+
+
+class InferenceEngine:
+    """Lightweight, Trainer-free inference for trained models.
+
+    The model is moved to the device and put in eval mode once, and can then be reused for any
+    number of calls. Forward passes run under `torch.inference_mode` and batches are loaded and
+    copied to the device ahead of the computation (see `eugene.dataload.DevicePrefetcher`).
+    Predictions are written straight into preallocated SeqData variables (or any output buffer)
+    batch by batch, without collecting the outputs or building a DataFrame.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Trained model, e.g. a SequenceModule.
+    device : str or torch.device, optional
+        Device to run the model on. If None, uses "cuda" if settings.gpus > 0, else "cpu".
+    batch_size : int, optional
+        Batch size. If None, uses settings.batch_size
+    num_workers : int, optional
+        Number of dataloader workers. If None, uses settings.dl_num_workers
+    prefetch_factor : int, optional
+        Number of batches loaded in advance by each worker, by default None
+    tta : bool, optional
+        Whether to average the predictions of each sequence and its reverse complement in a
+        single forward pass (see `eugene.models.TestTimeAugmentation`), by default False
+    shifts : sequence of int, optional
+        Shifts of the sequences to also average over, e.g. (-1, 1), by default None
+    tta_reduce : str, optional
+        How to reduce the predictions of the variants, "mean", "median" or "max", by default "mean"
+    """
+
+    def __init__(
+        self,
+        model: torch.nn.Module,
+        device: Optional[Union[str, torch.device]] = None,
+        batch_size: Optional[int] = None,
+        num_workers: Optional[int] = None,
+        prefetch_factor: Optional[int] = None,
+        tta: bool = False,
+        shifts: Optional[Sequence[int]] = None,
+        tta_reduce: str = "mean",
+    ):
+        if device is None:
+            device = "cuda" if settings.gpus > 0 and torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        self.model = model.to(self.device).eval()
+        if tta or shifts:
+            self.model = TestTimeAugmentation(
+                self.model, rc=tta, shifts=shifts or (), reduce=tta_reduce
+            )
+        self.batch_size = batch_size if batch_size is not None else settings.batch_size
+        self.num_workers = num_workers if num_workers is not None else settings.dl_num_workers
+        self.prefetch_factor = prefetch_factor
+
+    def predict(
+        self,
+        x,
+        out=None,
+        seq_var: str = "ohe_seq",
+        transform: Optional[Callable] = None,
+        verbose: bool = False,
+    ):
+        """Predict on an array, tensor, (lazy) SeqData variable or iterable of batches.
+
+        See `eugene.models.SequenceModule.predict` for the parameters.
+        """
+        with torch.inference_mode():
+            return _predict_in_batches(
+                self.model,
+                x,
+                batch_size=self.batch_size,
+                device=self.device,
+                out=out,
+                seq_var=seq_var,
+                transform=transform,
+                verbose=verbose,
+            )
+
+    def predict_sdata(
+        self,
+        sdata: xr.Dataset,
+        seq_var: str = "ohe_seq",
+        pred_vars: Optional[Union[str, List[str]]] = None,
+        indices: Optional[np.ndarray] = None,
+        transforms: Optional[Dict[str, Callable]] = None,
+        store: Optional[Union[PredictionStore, Dict[str, PredictionStore]]] = None,
+        target_vars: Optional[Union[str, List[str]]] = None,
+        splits: Optional[np.ndarray] = None,
+        verbose: bool = True,
+    ) -> List[str]:
+        """Predict on a SeqData and write the predictions into it batch by batch.
+
+        Parameters
+        ----------
+        sdata : xr.Dataset
+            SeqData to predict on and add the predictions to.
+        seq_var : str, optional
+            Variable holding the model inputs, by default "ohe_seq"
+        pred_vars : str or list of str, optional
+            Names of the variables to write each output of the model to. If None, uses
+            "predictions_{i}" for each output.
+        indices : numpy.ndarray, optional
+            Integer indices of the sequences to predict on. Other sequences keep their existing
+            predictions (or NaN if the variables are new). If None, predicts on all sequences.
+        transforms : dict, optional
+            Functions to apply to the NumPy arrays of each batch keyed by variable, e.g.
+            {"ohe_seq": lambda x: x.swapaxes(1, 2)}, by default None
+        store : PredictionStore or dict, optional
+            Store to also append the predictions of each batch to, or stores keyed by the labels
+            of splits. Batches already written to resumed stores are read back from them instead
+            of being predicted, by default None
+        target_vars : str or list of str, optional
+            Target variables appended to store with the predictions, by default None
+        splits : numpy.ndarray, optional
+            Label of each sequence of indices (e.g. "train" or "val"), selecting the store of a
+            dict store its predictions are appended to. Each store receives the rows of its split
+            of every batch, so all splits are predicted in a single pass, by default None
+        verbose : bool, optional
+            Whether to show a progress bar, by default True
+
+        Returns
+        -------
+        list of str
+            Names of the prediction variables.
+        """
+        n_seqs = sdata.sizes["_sequence"]
+        indices = np.arange(n_seqs) if indices is None else np.asarray(indices)
+        pred_vars = [pred_vars] if isinstance(pred_vars, str) else pred_vars
+        if isinstance(store, dict):
+            if splits is None:
+                raise ValueError("splits is required to append to a dict of stores.")
+            stores, splits = store, np.asarray(splits)
+        else:
+            stores = {None: store} if store is not None else {}
+        batch_starts = np.arange(0, len(indices), self.batch_size)
+        batch_ids = np.arange(len(batch_starts))
+        outputs = None
+        if stores:
+            # batches of resumed stores are read back instead of being predicted again
+            written = np.array(
+                [all(s.written(batch_idx) for s in stores.values()) for batch_idx in batch_ids],
+                dtype=bool,
+            )
+            if written.any():
+                print(f"Resuming predictions, {written.sum()} batches already written")
+                # positions in indices of the sequences of the written batches
+                positions = np.flatnonzero(np.repeat(written, self.batch_size)[: len(indices)])
+                for label, split_store in stores.items():
+                    if label is not None:
+                        positions_split = positions[splits[positions] == label]
+                    else:
+                        positions_split = positions
+                    out = split_store.read(batch_ids[written])[0]
+                    outputs, pred_vars = self._write_outputs(
+                        sdata, outputs, pred_vars, indices, indices[positions_split], out
+                    )
+            batch_ids = batch_ids[~written]
+        if len(batch_ids) == 0:
+            return pred_vars if pred_vars is not None else []
+        missing = np.concatenate(
+            [indices[batch_starts[batch_idx] :][: self.batch_size] for batch_idx in batch_ids]
+        )
+        dataloader = get_sdata_dataloader(
+            sdata,
+            seq_var=seq_var,
+            target_vars=target_vars if stores else None,
+            indices=missing,
+            batch_size=self.batch_size,
+            num_workers=self.num_workers,
+            prefetch_factor=self.prefetch_factor,
+            transforms=transforms,
+            shuffle=False,
+            pin_memory=self.device.type == "cuda",
+        )
+        with torch.inference_mode():
+            for batch_idx, batch in zip(
+                batch_ids,
+                tqdm(
+                    DevicePrefetcher(dataloader, self.device),
+                    total=len(dataloader),
+                    desc="Predicting on batches",
+                    disable=not verbose,
+                ),
+            ):
+                out = self.model(batch[seq_var]).reshape(len(batch[seq_var]), -1)
+                out = out.float().cpu().numpy()
+                start = batch_starts[batch_idx]
+                outputs, pred_vars = self._write_outputs(
+                    sdata, outputs, pred_vars, indices, indices[start : start + len(out)], out
+                )
+                targets = batch["target"].cpu().numpy() if "target" in batch else None
+                for label, split_store in stores.items():
+                    rows = slice(None)
+                    if label is not None:
+                        rows = splits[start : start + len(out)] == label
+                    split_store.append(
+                        out[rows, : len(outputs)],
+                        targets[rows] if targets is not None else None,
+                        batch_idx=int(batch_idx),
+                    )
+        for split_store in stores.values():
+            split_store.flush()
+        return pred_vars
+
+    def _write_outputs(
+        self,
+        sdata: xr.Dataset,
+        outputs: Optional[List[np.ndarray]],
+        pred_vars: Optional[List[str]],
+        indices: np.ndarray,
+        rows: np.ndarray,
+        out: np.ndarray,
+    ) -> Tuple[List[np.ndarray], List[str]]:
+        """Write outputs to rows of the prediction variables, allocating them on the first call."""
+        if outputs is None:
+            if pred_vars is None:
+                pred_vars = [f"predictions_{i}" for i in range(out.shape[1])]
+            outputs = self._init_outputs(sdata, pred_vars, indices)
+        for i, output in enumerate(outputs):
+            output[rows] = out[:, i]
+        return outputs, pred_vars
+
+    @staticmethod
+    def _init_outputs(
+        sdata: xr.Dataset, pred_vars: List[str], indices: np.ndarray
+    ) -> List[np.ndarray]:
+        """Allocate the prediction variables and return their (writable) arrays."""
+        outputs = []
+        for pred_var in pred_vars:
+            existing = pred_var in sdata and sdata[pred_var].dims == ("_sequence",)
+            if existing and len(indices) < sdata.sizes["_sequence"]:
+                values = np.array(sdata[pred_var].values, dtype=np.float32)
+            else:
+                values = np.full(sdata.sizes["_sequence"], np.nan, dtype=np.float32)
+            sdata[pred_var] = xr.DataArray(values, dims=["_sequence"])
+            outputs.append(values)
+        return outputs
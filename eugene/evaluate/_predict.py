@@ -1,13 +1,15 @@
 import os
 import numpy as np
 import pandas as pd
-from typing import Union, List, Optional
-from torch.utils.data import DataLoader
+from typing import Literal, Union, List, Optional, Sequence, Tuple
+from torch.utils.data import DataLoader, Sampler
 from pytorch_lightning import LightningModule, Trainer
 from eugene import settings
 import xarray as xr
 import seqdata as sd
-from ._utils import PredictionWriter
+from ._utils import PredictionStore, PredictionWriter
+from ._inference import InferenceEngine
+from ..dataload._dataloader import train_val_indices
 
 
 def predictions(
@@ -18,6 +20,8 @@ def predictions(
     name: Optional[str] = None,
     version: Optional[str] = "",
     file_label: Optional[str] = "",
+    write_format: Literal["tsv", "zarr", "parquet"] = "tsv",
+    resume: bool = False,
 ):
     """Predictions from a model and dataloader.
     
@@ -41,6 +45,11 @@ def predictions(
         Version of the model. If None, uses "".
     file_label : str, optional
         Label to add to the file name. If None, uses "".
+    write_format : str, optional
+        "tsv" to write all predictions at the end, or "zarr" or "parquet" to append them to
+        a chunked store batch by batch (see `PredictionStore`). By default "tsv".
+    resume : bool, optional
+        Whether to skip batches already written to a zarr or Parquet store, by default False
     
     Returns
     -------
@@ -50,22 +59,74 @@ def predictions(
     gpus = gpus if gpus is not None else settings.gpus
     model_name = model.model_name
     name = name if name is not None else model_name
-    if out_dir is not None:
+    num_outs = model.output_dim
+    if out_dir is not None and write_format != "tsv":
+        # stream each batch to the store and only run the batches it is missing
+        writer = PredictionWriter(
+            output_dir=os.path.join(out_dir, name, version),
+            file_label=file_label,
+            write_interval="batch",
+            format=write_format,
+            resume=resume,
+        )
+        dataloader, writer.batch_ids = _skip_written_batches(dataloader, writer.store)
+        predictor = Trainer(logger=False, callbacks=writer, devices=gpus)
+        if len(writer.batch_ids) > 0:
+            predictor.predict(model, dataloader, return_predictions=False)
+        ps = writer.store.read()[0]
+    elif out_dir is not None:
         out_dir = os.path.join(out_dir, name, version)
         predictor = Trainer(
             logger=False,
             callbacks=PredictionWriter(output_dir=out_dir, file_label=file_label),
             devices=gpus,
         )
+        ps = np.concatenate(predictor.predict(model, dataloader), axis=0)
     else:
         predictor = Trainer(logger=False, devices=gpus)
-    ps = np.concatenate(predictor.predict(model, dataloader), axis=0)
-    num_outs = model.output_dim
+        ps = np.concatenate(predictor.predict(model, dataloader), axis=0)
     preds = pd.DataFrame(data=ps[:, 0:num_outs])
     preds.columns = [f"predictions_{i}" for i in range(num_outs)]
     return preds
 
 
+class _BatchSubset(Sampler):
+    """Batch sampler yielding only the batches of another batch sampler at the given positions."""
+
+    def __init__(self, batch_sampler: Sampler, batch_ids: List[int]):
+        self.batch_sampler = batch_sampler
+        self.batch_ids = set(batch_ids)
+        self.n_batches = len(batch_ids)
+
+    def __iter__(self):
+        for i, batch in enumerate(self.batch_sampler):
+            if i in self.batch_ids:
+                yield batch
+
+    def __len__(self) -> int:
+        return self.n_batches
+
+
+def _skip_written_batches(
+    dataloader: DataLoader, store: PredictionStore
+) -> Tuple[DataLoader, List[int]]:
+    """Get a dataloader that only loads the batches missing from store, and their indices."""
+    batch_ids = [i for i in range(len(dataloader)) if not store.written(i)]
+    if len(batch_ids) == len(dataloader) or dataloader.batch_sampler is None:
+        return dataloader, list(range(len(dataloader)))
+    print(f"Resuming predictions, {len(dataloader) - len(batch_ids)} batches already written")
+    kwargs = dict(prefetch_factor=dataloader.prefetch_factor) if dataloader.num_workers > 0 else {}
+    dataloader = DataLoader(
+        dataloader.dataset,
+        batch_sampler=_BatchSubset(dataloader.batch_sampler, batch_ids),
+        collate_fn=dataloader.collate_fn,
+        num_workers=dataloader.num_workers,
+        pin_memory=dataloader.pin_memory,
+        **kwargs,
+    )
+    return dataloader, batch_ids
+
+
 def predictions_sequence_module(
     model: LightningModule,
     sdata: Optional[xr.Dataset] = None,
@@ -84,12 +145,21 @@ def predictions_sequence_module(
     file_label: str = "",
     prefix: str = "",
     suffix: str = "",
+    write_format: Literal["tsv", "zarr", "parquet"] = "tsv",
+    resume: bool = False,
+    tta: bool = False,
+    shifts: Optional[Sequence[int]] = None,
+    tta_reduce: str = "mean",
+    use_trainer: bool = False,
+    engine: Optional[InferenceEngine] = None,
     copy: bool = False,
 ) -> xr.Dataset:
     """Predictions for a SequenceModule model and SeqData
 
-    This is a wrapper around the predictions function that takes a SeqData object and
-    builds a dataloader from it. It also adds the predictions to the SeqData object.
+    By default, predictions are made with an `InferenceEngine`, which writes them straight
+    into the SeqData batch by batch without constructing a PyTorch Lightning Trainer. With
+    use_trainer=True, this is a wrapper around the predictions function that builds a
+    dataloader from the SeqData. Either way, the predictions are added to the SeqData object.
 
     Parameters
     ----------
@@ -108,6 +178,23 @@ def predictions_sequence_module(
     num_workers : int, optional
         Number of workers to use. If None, uses settings.dl_num_workers.
     transforms : dict, optional 
+    write_format : str, optional
+        "tsv" to write all predictions at the end, or "zarr" or "parquet" to append them to
+        a chunked store as they are made (see `PredictionStore`). By default "tsv".
+    resume : bool, optional
+        Whether to skip batches already written to a zarr or Parquet store, by default False
+    tta : bool, optional
+        Whether to average the predictions of each sequence and its reverse complement in a
+        single forward pass per batch, by default False. Not supported with use_trainer=True.
+    shifts : sequence of int, optional
+        Shifts of the sequences to also average over, e.g. (-1, 1), by default None
+    tta_reduce : str, optional
+        How to reduce the predictions of the variants, "mean", "median" or "max", by default "mean"
+    use_trainer : bool, optional
+        Whether to predict with a PyTorch Lightning Trainer instead of an InferenceEngine.
+    engine : InferenceEngine, optional
+        Engine to reuse across calls. If None, one is created for the model. Test-time
+        augmentation is then configured on the engine, not with tta and shifts.
 
     Returns
     -------
@@ -120,6 +207,54 @@ def predictions_sequence_module(
     target_vars = [target_vars] if type(target_vars) == str else target_vars
     if not store_only:
         out_dir = out_dir if out_dir is not None else settings.output_dir
+    if use_trainer and (tta or shifts):
+        raise ValueError("Test-time augmentation is only supported with use_trainer=False.")
+    if engine is not None and (tta or shifts):
+        raise ValueError(
+            "tta and shifts are ignored by an existing engine, create the InferenceEngine with "
+            "them instead."
+        )
+    if not use_trainer:
+        if engine is None:
+            gpus = gpus if gpus is not None else settings.gpus
+            engine = InferenceEngine(
+                model,
+                device="cuda" if gpus > 0 else "cpu",
+                batch_size=batch_size,
+                num_workers=num_workers,
+                prefetch_factor=prefetch_factor,
+                tta=tta,
+                shifts=shifts,
+                tta_reduce=tta_reduce,
+            )
+        if in_memory:
+            print(f"Loading {seq_var} into memory")
+            sdata[seq_var].load()
+        pred_vars = [f"{prefix}{target_var}_predictions{suffix}" for target_var in target_vars]
+        store = None
+        if out_dir is not None and write_format != "tsv":
+            name = name if name is not None else model.model_name
+            out_dir = os.path.join(out_dir, name, version)
+            os.makedirs(out_dir, exist_ok=True)
+            store = PredictionStore(
+                os.path.join(out_dir, f"{file_label}_predictions"),
+                format=write_format,
+                resume=resume,
+            )
+        engine.predict_sdata(
+            sdata,
+            seq_var=seq_var,
+            pred_vars=pred_vars,
+            transforms=transforms,
+            store=store,
+            target_vars=target_vars,
+        )
+        if out_dir is not None and store is None:
+            name = name if name is not None else model.model_name
+            _write_predictions_tsv(
+                sdata, pred_vars, target_vars, os.path.join(out_dir, name, version), file_label
+            )
+        return sdata if copy else None
     if target_vars is not None:
         if isinstance(target_vars, str):
             target_vars = [target_vars]
@@ -151,6 +286,8 @@ def predictions_sequence_module(
         name=name,
         version=version,
         file_label=file_label,
+        write_format=write_format,
+        resume=resume,
     )
     pred_cols = preds.columns
     for i, target_var in enumerate(target_vars):
@@ -161,6 +298,28 @@ def predictions_sequence_module(
     return sdata if copy else None
 
 
+def _write_predictions_tsv(
+    sdata: xr.Dataset,
+    pred_vars: List[str],
+    target_vars: List[str],
+    out_dir: os.PathLike,
+    file_label: str,
+    indices: Optional[np.ndarray] = None,
+) -> None:
+    """Write predictions and targets to a tsv with the layout of PredictionWriter."""
+    os.makedirs(out_dir, exist_ok=True)
+    indices = slice(None) if indices is None else indices
+    pred_df = pd.DataFrame(
+        {
+            **{f"predictions_{i}": sdata[var].values[indices] for i, var in enumerate(pred_vars)},
+            **{f"target_{i}": sdata[var].values[indices] for i, var in enumerate(target_vars)},
+        }
+    )
+    pred_df.to_csv(
+        os.path.join(out_dir, file_label) + "_predictions.tsv", sep="\t", index=False
+    )
+
+
 def train_val_predictions(
     model: LightningModule,
     train_dataloader: DataLoader,
@@ -170,6 +329,8 @@ def train_val_predictions(
     out_dir: Optional[os.PathLike] = None,
     name: Optional[str] = None,
     version: str = "",
+    write_format: Literal["tsv", "zarr", "parquet"] = "tsv",
+    resume: bool = False,
 ) -> pd.DataFrame:
     """Predictions from a model and train/val dataloaders.
 
@@ -193,42 +354,27 @@ def train_val_predictions(
         Name of the model. If None, uses model.model_name.
     version : str, optional
         Version of the model. If None, uses "".
+    write_format : str, optional
+        "tsv", "zarr" or "parquet", see `predictions`. By default "tsv".
+    resume : bool, optional
+        Whether to skip batches already written to a zarr or Parquet store, by default False
 
     Returns
     -------
     preds : pd.DataFrame
         Predictions from the model and dataloader in a pandas dataframe.
     """
-    gpus = gpus if gpus is not None else settings.gpus
-    model_name = model.model_name
-    name = name if name is not None else model_name
-    if out_dir is not None:
-        out_dir = os.path.join(out_dir, name, version)
-        train_predictor = Trainer(
-            logger=False,
-            callbacks=PredictionWriter(out_dir, file_label="train"),
-            devices=gpus,
-        )
-        val_predictor = Trainer(
-            logger=False,
-            callbacks=PredictionWriter(out_dir, file_label="val"),
-            devices=gpus,
-        )
-    else:
-        train_predictor = Trainer(logger=False, devices=gpus)
-        val_predictor = Trainer(logger=False, devices=gpus)
-
-    t = np.concatenate(train_predictor.predict(model, train_dataloader), axis=0)
-    v = np.concatenate(val_predictor.predict(model, val_dataloader), axis=0)
-    num_outs = model.output_dim
-    preds = pd.concat(
-        [
-            pd.DataFrame(data=t[:, 0:num_outs]),
-            pd.DataFrame(data=v[:, 0:num_outs]),
-        ],
-        axis=0,
-    ).reset_index(drop=True)
-    preds.columns = [f"predictions_{i}" for i in range(num_outs)]
+    kwargs = dict(
+        gpus=gpus,
+        out_dir=out_dir,
+        name=name,
+        version=version,
+        write_format=write_format,
+        resume=resume,
+    )
+    t = predictions(model, train_dataloader, file_label="train", **kwargs)
+    v = predictions(model, val_dataloader, file_label="val", **kwargs)
+    preds = pd.concat([t, v], axis=0).reset_index(drop=True)
     preds[train_var] = [True] * len(t) + [False] * len(v)
     return preds
 
@@ -251,12 +397,22 @@ def train_val_predictions_sequence_module(
     version: str = "",
     prefix: str = "",
     suffix: str = "",
+    write_format: Literal["tsv", "zarr", "parquet"] = "tsv",
+    resume: bool = False,
+    tta: bool = False,
+    shifts: Optional[Sequence[int]] = None,
+    tta_reduce: str = "mean",
+    use_trainer: bool = False,
+    engine: Optional[InferenceEngine] = None,
     copy: bool = False,
 ):
     """Predictions for a SequenceModule model and SeqData
 
-    This is a wrapper around the predictions function that takes a SeqData object and
-    builds a dataloader from it. It also adds the predictions to the SeqData object.
+    By default, predictions are made with an `InferenceEngine` in a single pass over the
+    SeqData in its native order, and written in place to the prediction variables, so
+    neither split is copied and nothing has to be reordered. With use_trainer=True, this is
+    a wrapper around the train_val_predictions function that builds train and val
+    dataloaders from the SeqData. Either way, the predictions are added to the SeqData object.
 
     Parameters
     ----------
@@ -277,6 +433,23 @@ def train_val_predictions_sequence_module(
     num_workers : int, optional
         Number of workers to use. If None, uses settings.dl_num_workers.
     transforms : dict, optional 
+    write_format : str, optional
+        "tsv" to write all predictions at the end, or "zarr" or "parquet" to append them to
+        a chunked store as they are made (see `PredictionStore`). By default "tsv".
+    resume : bool, optional
+        Whether to skip batches already written to a zarr or Parquet store, by default False
+    tta : bool, optional
+        Whether to average the predictions of each sequence and its reverse complement in a
+        single forward pass per batch, by default False. Not supported with use_trainer=True.
+    shifts : sequence of int, optional
+        Shifts of the sequences to also average over, e.g. (-1, 1), by default None
+    tta_reduce : str, optional
+        How to reduce the predictions of the variants, "mean", "median" or "max", by default "mean"
+    use_trainer : bool, optional
+        Whether to predict with PyTorch Lightning Trainers instead of an InferenceEngine.
+    engine : InferenceEngine, optional
+        Engine to reuse across calls. If None, one is created for the model. Test-time
+        augmentation is then configured on the engine, not with tta and shifts.
 
     Returns
     -------
@@ -290,6 +463,66 @@ def train_val_predictions_sequence_module(
     target_vars = [target_vars] if type(target_vars) == str else target_vars
     if not store_only:
         out_dir = out_dir if out_dir is not None else settings.output_dir
+    if use_trainer and (tta or shifts):
+        raise ValueError("Test-time augmentation is only supported with use_trainer=False.")
+    if engine is not None and (tta or shifts):
+        raise ValueError(
+            "tta and shifts are ignored by an existing engine, create the InferenceEngine with "
+            "them instead."
+        )
+    if not use_trainer:
+        if engine is None:
+            gpus = gpus if gpus is not None else settings.gpus
+            engine = InferenceEngine(
+                model,
+                device="cuda" if gpus > 0 else "cpu",
+                batch_size=batch_size,
+                num_workers=num_workers,
+                prefetch_factor=prefetch_factor,
+                tta=tta,
+                shifts=shifts,
+                tta_reduce=tta_reduce,
+            )
+        if in_memory:
+            print(f"Loading {seq_var} into memory")
+            sdata[seq_var].load()
+        pred_vars = [f"{prefix}{target_var}_predictions{suffix}" for target_var in target_vars]
+        if out_dir is not None and write_format != "tsv":
+            # a single pass in the native order, streaming the rows of each split to its store
+            name = name if name is not None else model.model_name
+            out_dir = os.path.join(out_dir, name, version)
+            os.makedirs(out_dir, exist_ok=True)
+            train_idx, val_idx = train_val_indices(sdata, train_var)
+            indices = np.sort(np.concatenate([train_idx, val_idx]))
+            stores = {
+                label: PredictionStore(
+                    os.path.join(out_dir, f"{label}_predictions"),
+                    format=write_format,
+                    resume=resume,
+                )
+                for label in ["train", "val"]
+            }
+            engine.predict_sdata(
+                sdata,
+                seq_var=seq_var,
+                pred_vars=pred_vars,
+                indices=indices,
+                transforms=transforms,
+                store=stores,
+                target_vars=target_vars,
+                splits=np.where(np.isin(indices, train_idx), "train", "val"),
+            )
+            return sdata if copy else None
+        engine.predict_sdata(sdata, seq_var=seq_var, pred_vars=pred_vars, transforms=transforms)
+        if out_dir is not None:
+            name = name if name is not None else model.model_name
+            out_dir = os.path.join(out_dir, name, version)
+            train_idx, val_idx = train_val_indices(sdata, train_var)
+            for label, indices in [("train", train_idx), ("val", val_idx)]:
+                _write_predictions_tsv(
+                    sdata, pred_vars, target_vars, out_dir, label, indices=indices
+                )
+        return sdata if copy else None
     if target_vars is not None:
         if isinstance(target_vars, str):
             target_vars = [target_vars]
@@ -338,6 +571,8 @@ def train_val_predictions_sequence_module(
         out_dir=out_dir,
         name=name,
         version=version,
+        write_format=write_format,
+        resume=resume,
     )
 
     # Create an empty dataframe the same size as preds
@@ -1,18 +1,286 @@
 import os
+from typing import Dict, List, Literal, Optional, Sequence, Tuple, Union
+
 import pandas as pd
 import numpy as np
+import zarr
 from pytorch_lightning.callbacks import BasePredictionWriter
 
 
+def _as_rows(values: np.ndarray) -> np.ndarray:
+    """Flatten values to float32 rows, keeping the number of columns of empty batches."""
+    values = np.asarray(values, dtype=np.float32)
+    return values.reshape(len(values), int(np.prod(values.shape[1:])))
+
+
+class PredictionStore:
+    """Appendable, chunked store of predictions and targets.
+
+    Batches of predictions (and targets) are appended as float32 as they come, so nothing has
+    to be held in memory, either to a chunked zarr group ("{path}.zarr" with "predictions" and
+    "targets" arrays) or to a Parquet dataset ("{path}.parquet" with columns "batch",
+    "predictions_{i}" and "target_{i}"). Parquet rows are buffered and written as one part file
+    of chunk_size rows at a time, call `flush` after the last batch. The rows of every written
+    batch are recorded ("batches" array of zarr groups, "batch" column of Parquet files), so a
+    partially written run can be resumed: with resume=True, batches that were already written
+    are kept and can be skipped (see `written` and `read`).
+
+    Parameters
+    ----------
+    path : str
+        Path of the store without extension.
+    format : str, optional
+        "zarr" or "parquet", by default "zarr"
+    chunk_size : int, optional
+        Number of rows per zarr chunk or Parquet part file, by default 100000
+    resume : bool, optional
+        Whether to keep the batches already written to the store instead of overwriting it,
+        by default False
+    """
+
+    def __init__(
+        self,
+        path: str,
+        format: Literal["zarr", "parquet"] = "zarr",
+        chunk_size: int = 100000,
+        resume: bool = False,
+    ):
+        if format not in ["zarr", "parquet"]:
+            raise ValueError(f"Unknown format {format}, must be 'zarr' or 'parquet'.")
+        self.path = f"{path}.{format}"
+        self.format = format
+        self.chunk_size = chunk_size
+        self.resume = resume
+        self._group = None
+        # batch index -> (start, stop) rows of zarr arrays or part number of Parquet files
+        self._index: Dict[int, Union[Tuple[int, int], int]] = {}
+        self._buffer: List[Tuple[int, np.ndarray, np.ndarray]] = []
+        if format == "parquet":
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError(
+                    "Install [pyarrow](https://arrow.apache.org/docs/python) to write predictions to Parquet."
+                )
+            if not resume and os.path.exists(self.path):
+                for file in os.listdir(self.path):
+                    os.remove(os.path.join(self.path, file))
+            os.makedirs(self.path, exist_ok=True)
+            for file in os.listdir(self.path):
+                if file.endswith(".parquet"):
+                    part = int(file[5:-8])
+                    batches = pq.read_table(self._part(part), columns=["batch"])["batch"]
+                    self._index.update(dict.fromkeys(np.unique(batches.to_numpy()).tolist(), part))
+        elif resume and os.path.exists(self.path):
+            self._group = zarr.open_group(self.path, mode="r+")
+            batches = self._group["batches"][:]
+            self._index = {int(idx): (int(start), int(stop)) for idx, start, stop in batches}
+            # drop rows appended after the last recorded batch, e.g. by an interrupted run
+            rows = int(batches[:, 2].max()) if len(batches) else 0
+            for name in ["predictions", "targets"]:
+                self._group[name].resize((rows, self._group[name].shape[1]))
+
+    def _create_zarr(self, n_preds: int, n_targets: int) -> zarr.Group:
+        group = zarr.open_group(self.path, mode="w")
+        for name, n_cols in [("predictions", n_preds), ("targets", n_targets)]:
+            group.zeros(
+                name=name,
+                shape=(0, n_cols),
+                chunks=(self.chunk_size, max(n_cols, 1)),
+                dtype="float32",
+            )
+        # one (batch index, start row, stop row) row per batch, appended after its rows
+        group.zeros(name="batches", shape=(0, 3), chunks=(4096, 3), dtype="int64")
+        return group
+
+    def _part(self, part: int) -> str:
+        return os.path.join(self.path, f"part-{part:08d}.parquet")
+
+    @property
+    def batches(self) -> List[int]:
+        """Indices of the batches written to the store, in increasing order."""
+        return sorted(self._index)
+
+    def written(self, batch_idx: int) -> bool:
+        """Whether batch batch_idx was already written to the store."""
+        return batch_idx in self._index
+
+    def append(
+        self,
+        predictions: np.ndarray,
+        targets: Optional[np.ndarray] = None,
+        batch_idx: Optional[int] = None,
+    ) -> None:
+        """Append a batch of predictions (and targets), unless batch_idx was already written.
+
+        If batch_idx is None, the batch is numbered after the last written batch.
+        """
+        predictions = _as_rows(predictions)
+        targets = (
+            np.empty((len(predictions), 0), dtype=np.float32)
+            if targets is None
+            else _as_rows(targets)
+        )
+        if batch_idx is None:
+            batch_idx = max(self._index, default=-1) + 1
+        elif self.written(batch_idx):
+            return
+        if self.format == "parquet":
+            # buffered batches are numbered after the last part file until they are flushed
+            self._index[batch_idx] = max(self._index.values(), default=-1) + (not self._buffer)
+            self._buffer.append((batch_idx, predictions, targets))
+            if sum(len(preds) for _, preds, _ in self._buffer) >= self.chunk_size:
+                self.flush()
+            return
+        if self._group is None:
+            self._group = self._create_zarr(predictions.shape[1], targets.shape[1])
+        start = self._group["predictions"].shape[0]
+        self._group["predictions"].append(predictions)
+        self._group["targets"].append(targets)
+        self._group["batches"].append(np.array([[batch_idx, start, start + len(predictions)]]))
+        self._index[batch_idx] = (start, start + len(predictions))
+
+    def flush(self) -> None:
+        """Write the buffered Parquet rows to a new part file. Zarr stores are always up to date."""
+        if not self._buffer:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        part = self._index[self._buffer[0][0]]
+        predictions = np.concatenate([preds for _, preds, _ in self._buffer])
+        targets = np.concatenate([targets for _, _, targets in self._buffer])
+        columns = {
+            "batch": np.concatenate(
+                [np.full(len(preds), idx, dtype=np.int64) for idx, preds, _ in self._buffer]
+            )
+        }
+        columns.update({f"predictions_{i}": predictions[:, i] for i in range(predictions.shape[1])})
+        columns.update({f"target_{i}": targets[:, i] for i in range(targets.shape[1])})
+        # write to a temporary file first so interrupted writes are never picked up
+        pq.write_table(pa.table(columns), self._part(part) + ".tmp", row_group_size=self.chunk_size)
+        os.replace(self._part(part) + ".tmp", self._part(part))
+        self._buffer = []
+
+    def read(
+        self, batch_idx: Optional[Union[int, Sequence[int]]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Read the predictions and targets of written batches in order, or of all batches."""
+        if batch_idx is None:
+            batch_ids = self.batches
+        else:
+            batch_ids = [int(idx) for idx in np.atleast_1d(batch_idx)]
+        if not batch_ids:
+            return np.empty((0, 0), np.float32), np.empty((0, 0), np.float32)
+        if self.format == "parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            self.flush()
+            parts = sorted({self._index[idx] for idx in batch_ids})
+            table = pa.concat_tables([pq.read_table(self._part(part)) for part in parts])
+            batches = table["batch"].to_numpy()
+            # rows of the requested batches, in the requested order
+            order = np.argsort(batches, kind="stable")
+            bounds = np.searchsorted(batches[order], [batch_ids, np.add(batch_ids, 1)])
+            rows = np.concatenate([order[start:stop] for start, stop in bounds.T])
+            columns = [col for col in table.column_names if col != "batch"]
+            values = (
+                np.stack([table[col].to_numpy() for col in columns], axis=1)[rows]
+                if columns
+                else np.empty((len(rows), 0))
+            ).astype(np.float32)
+            is_pred = np.array([col.startswith("predictions_") for col in columns], dtype=bool)
+            return values[:, is_pred], values[:, ~is_pred]
+        ranges = np.array([self._index[idx] for idx in batch_ids])
+        if (ranges[1:, 0] == ranges[:-1, 1]).all():
+            # contiguous batches are read in one slice
+            ranges = np.array([[ranges[0, 0], ranges[-1, 1]]])
+        out = []
+        for name in ["predictions", "targets"]:
+            out.append(np.concatenate([self._group[name][start:stop] for start, stop in ranges]))
+        return out[0], out[1]
+
+
 class PredictionWriter(BasePredictionWriter):
-    def __init__(self, output_dir: str, file_label: str, write_interval="epoch"):
+    """Writes the outputs of `SequenceModule.predict_step` (predictions, then targets) to disk.
+
+    With format="tsv", all outputs are written to one tab-separated file at the end of the
+    epoch. With format="zarr" or "parquet", outputs are appended as float32 to a chunked
+    `PredictionStore`, batch by batch if write_interval="batch", so they never have to be held
+    in memory, and partially written runs can be resumed.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory to write to.
+    file_label : str
+        Prefix of the file names, e.g. "train".
+    write_interval : str, optional
+        "batch" or "epoch", by default "epoch"
+    format : str, optional
+        "tsv", "zarr" or "parquet", by default "tsv"
+    chunk_size : int, optional
+        Number of rows per zarr chunk or Parquet part file, by default 100000
+    resume : bool, optional
+        Whether to skip batches already written by a previous run, by default False
+    batch_ids : sequence of int, optional
+        Index of each batch of the dataloader in the store, for dataloaders that only load the
+        batches missing from a partially written store. If None, batches are stored under their
+        own index, by default None
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        file_label: str,
+        write_interval="epoch",
+        format: Literal["tsv", "zarr", "parquet"] = "tsv",
+        chunk_size: int = 100000,
+        resume: bool = False,
+        batch_ids: Optional[Sequence[int]] = None,
+    ):
         super().__init__(write_interval)
         self.output_dir = output_dir
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
         self.file_label = file_label
+        if format == "tsv" and write_interval != "epoch":
+            raise ValueError("TSV predictions can only be written at the end of the epoch.")
+        self.format = format
+        self.store = (
+            PredictionStore(
+                os.path.join(output_dir, f"{file_label}_predictions"),
+                format=format,
+                chunk_size=chunk_size,
+                resume=resume,
+            )
+            if format != "tsv"
+            else None
+        )
+        self.batch_ids = batch_ids
+
+    def _append(self, pl_module, outputs, batch_idx):
+        batch_idx = self.batch_ids[batch_idx] if self.batch_ids is not None else batch_idx
+        outputs = np.asarray(outputs)
+        outputs = outputs.reshape(len(outputs), -1)
+        num_outputs = pl_module.output_dim
+        self.store.append(outputs[:, :num_outputs], outputs[:, num_outputs:], batch_idx=batch_idx)
+
+    def write_on_batch_end(
+        self, trainer, pl_module, prediction, batch_indices, batch, batch_idx, dataloader_idx
+    ):
+        self._append(pl_module, prediction, batch_idx)
+
+    def on_predict_end(self, trainer, pl_module):
+        if self.store is not None:
+            self.store.flush()
 
     def write_on_epoch_end(self, trainer, pl_module, outputs, batch_indices):
+        if self.store is not None:
+            for batch_idx, batch_outputs in enumerate(outputs):
+                self._append(pl_module, batch_outputs, batch_idx)
+            return
         outputs = np.concatenate(outputs, axis=0)
         num_outputs = pl_module.output_dim
         pred_cols = [f"predictions_{i}" for i in range(num_outputs)]
@@ -20,7 +20,8 @@ class RobustModel(LightningModule):
     optimizer : torch.optim.Optimizer or dict
         PyTorch optimizer as a class or dictionary
     augment_list : list
-        List of data augmentations, each a callable class from augment.py.
+        List of data augmentations, each a callable class from eugene.dataload._augment
+        accepting a mask of the sequences to augment.
         Default is empty list -- no augmentations.
     max_augs_per_seq : int
         Maximum number of augmentations to apply to each sequence. Value is superceded by the number of augmentations in augment_list.
@@ -131,41 +132,33 @@ class RobustModel(LightningModule):
     def _sample_aug_combos(self, batch_size):
         """Set the number of augmentations and randomly select augmentations to apply
         to each sequence.
+
+        Returns a boolean mask of shape (batch_size, len(augment_list)).
         """
         # determine the number of augmentations per sequence
         if self.hard_aug:
-            batch_num_aug = self.max_augs_per_seq * np.ones((batch_size,), dtype=int)
+            batch_num_aug = torch.full((batch_size,), int(self.max_augs_per_seq))
         else:
-            batch_num_aug = np.random.randint(
-                1, self.max_augs_per_seq + 1, (batch_size,)
-            )
+            batch_num_aug = torch.randint(1, int(self.max_augs_per_seq) + 1, (batch_size,))
 
         # randomly choose which subset of augmentations from augment_list
-        aug_combos = [
-            list(sorted(np.random.choice(self.max_num_aug, sample, replace=False)))
-            for sample in batch_num_aug
-        ]
-        return aug_combos
+        ranks = torch.rand(batch_size, self.max_num_aug).argsort(dim=1).argsort(dim=1)
+        return ranks < batch_num_aug[:, None]
 
     def _apply_augment(self, x):
-        """Apply augmentations to each sequence in batch, x."""
+        """Apply augmentations to each sequence in batch, x.
+
+        Each augmentation is applied once to the whole batch, masked to the sequences that
+        selected it. Sequences without an insertion are padded with random DNA by the
+        insertion augmentation itself.
+        """
         # number of augmentations per sequence
-        aug_combos = self._sample_aug_combos(x.shape[0])
+        aug_combos = self._sample_aug_combos(x.shape[0]).to(x.device)
 
         # apply augmentation combination to sequences
-        x_new = []
-        for aug_indices, seq in zip(aug_combos, x):
-            seq = torch.unsqueeze(seq, dim=0)
-            insert_status = True  # status to see if random DNA padding is needed
-            for aug_index in aug_indices:
-                seq = self.augment_list[aug_index](seq)
-                if hasattr(self.augment_list[aug_index], "insert_max"):
-                    insert_status = False
-            if insert_status:
-                if self.insert_max:
-                    seq = self._pad_end(seq)
-            x_new.append(seq)
-        return torch.cat(x_new)
+        for aug_index, augment in enumerate(self.augment_list):
+            x = augment(x, mask=aug_combos[:, aug_index])
+        return x
 
     def _pad_end(self, x):
         """Add random DNA padding of length insert_max to the end of each sequence in batch."""
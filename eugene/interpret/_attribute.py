@@ -2,7 +2,8 @@ import numpy as np
 from tqdm.auto import tqdm
 from seqexplainer import attribute
 from .._settings import settings
-from seqdata import get_torch_dataloader
+from ..dataload._dataloader import get_sdata_dataloader
+from ..dataload._prefetch import DevicePrefetcher
 import xarray as xr
 import torch.nn as nn
 from typing import Union, Optional, List, Dict, Any, Literal
@@ -77,17 +78,18 @@ def attribute_sdata(
     prefetch_factor = prefetch_factor if prefetch_factor is not None else None
 
     # Create the dataloader
-    dl = get_torch_dataloader(
+    dl = get_sdata_dataloader(
         sdata,
-        sample_dims=["_sequence"],
-        variables=[seq_var],
+        seq_var=seq_var,
         batch_size=batch_size,
         num_workers=num_workers,
         prefetch_factor=prefetch_factor,
         transforms=transforms,
         shuffle=False,
         drop_last=False,
+        pin_memory=settings.dl_pin_memory_gpu_training and device != "cpu",
     )
+    dl = DevicePrefetcher(dl, device)
 
     # Compute the attributions
     attrs = []
@@ -8,12 +8,13 @@ from tqdm.auto import tqdm
 
 from seqexplainer import get_layer_outputs
 from seqexplainer import get_activators_max_seqlets, get_activators_n_seqlets, get_pfms
-from seqdata import get_torch_dataloader
 from motifdata import from_kernel
 from motifdata._transform import pfms_to_ppms
 from motifdata import write_meme
 from eugene.utils import make_dirs
 from .._settings import settings
+from ..dataload._dataloader import get_sdata_dataloader
+from ..dataload._prefetch import DevicePrefetcher
 
 
 def generate_pfms_sdata(
@@ -96,17 +97,18 @@ def generate_pfms_sdata(
 
     if activations is None:
         # Create the dataloader
-        dl = get_torch_dataloader(
+        dl = get_sdata_dataloader(
             sdata,
-            sample_dims=["_sequence"],
-            variables=[seq_var],
+            seq_var=seq_var,
             batch_size=batch_size,
             num_workers=num_workers,
             prefetch_factor=prefetch_factor,
             transforms=transforms,
             shuffle=False,
             drop_last=False,
+            pin_memory=settings.dl_pin_memory_gpu_training and device != "cpu",
         )
+        dl = DevicePrefetcher(dl, device)
 
         # Compute the acivations for each sequence
         layer_outs = []
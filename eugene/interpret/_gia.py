@@ -164,7 +164,10 @@ def motif_distance_dependence_gia(
 ):
 
     # Make sure the backbones are compatible with the next function
-    backbones = np.array([b"".join(backbone) for backbone in sdata[seq_var].values]).astype('U')
+    backbones = sdata[seq_var].values
+    if backbones.ndim == 2:
+        backbones = backbones.view(f"S{backbones.shape[1]}").squeeze(1)
+    backbones = backbones.astype('U')
 
     # Do the embedding based on the passed in style
     A_seqs, B_seqs, AB_seqs, motif_b_pos, motif_b_distances = embed_deepstarr_distance_cooperativity(
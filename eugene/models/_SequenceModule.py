@@ -1,4 +1,4 @@
-from typing import Callable, Optional, Tuple, Union, Optional, List, Literal, Dict
+from typing import Callable, Optional, Tuple, Union, Optional, List, Literal, Dict, Sequence
 
 import numpy as np
 import torch
@@ -17,6 +17,8 @@ from .base._metrics import (
 )
 from .base._optimizers import OPTIMIZER_REGISTRY
 from .base._schedulers import SCHEDULER_REGISTRY
+from ._utils import _predict_in_batches
+from ._tta import TestTimeAugmentation
 
 
 class SequenceModule(LightningModule):
@@ -151,34 +153,70 @@ class SequenceModule(LightningModule):
         """
         return self.arch(x)
 
-    def predict(self, x, batch_size=128, verbose=True):
+    def predict(
+        self,
+        x,
+        batch_size: int = 128,
+        verbose: bool = True,
+        out=None,
+        seq_var: str = "ohe_seq",
+        transform: Optional[Callable] = None,
+        tta: bool = False,
+        shifts: Optional[Sequence[int]] = None,
+        tta_reduce: str = "mean",
+    ):
         """Predict the output of the model in batches.
 
+        Inputs are streamed one batch at a time and the outputs are written into a single buffer,
+        so predicting on very large (e.g. zarr-backed) datasets runs in constant memory when out
+        is a memory-mapped or zarr array.
+
         Parameters:
         ----------
-        x : np.ndarray or torch.Tensor
-            input sequence, can be a numpy array or a torch tensor
+        x : np.ndarray, torch.Tensor, xr.DataArray or iterable
+            input sequences, can be a numpy array, a torch tensor, a (lazy) SeqData variable or
+            an iterable of batches (e.g. a DataLoader yielding dicts)
         batch_size : int
-            batch size
+            batch size, ignored for iterables of batches
         verbose : bool
             whether to show a progress bar
+        out : torch.Tensor, np.ndarray or zarr.Array, optional
+            preallocated buffer with one row per sequence to write the outputs to. If None,
+            a tensor is allocated (or built from the batches if the length of x is unknown)
+        seq_var : str
+            key of the inputs in batches that are dicts
+        transform : callable, optional
+            function applied to each batch of inputs before the forward pass, e.g.
+            lambda x: x.swapaxes(1, 2) for one-hot SeqData variables
+        tta : bool
+            whether to average the predictions of each sequence and its reverse complement.
+            The variants are stacked into one batch, so this takes a single forward pass
+            per batch (see `eugene.models.TestTimeAugmentation`)
+        shifts : sequence of int, optional
+            shifts of the sequences to also average over, e.g. (-1, 1)
+        tta_reduce : str
+            how to reduce the predictions of the variants, "mean", "median" or "max"
+
+        Returns
+        -------
+        torch.Tensor or type of out
+            predictions
         """
+        forward = self
+        if tta or shifts:
+            forward = TestTimeAugmentation(self, rc=tta, shifts=shifts or (), reduce=tta_reduce)
         with torch.no_grad():
-            device = self.device
             self.eval()
-            if isinstance(x, np.ndarray):
-                x = torch.from_numpy(x.astype(np.float32))
-            outs = []
-            for _, i in tqdm(
-                enumerate(range(0, len(x), batch_size)),
-                desc="Predicting on batches",
-                total=len(x) // batch_size,
-                disable=not verbose,
-            ):
-                batch = x[i : i + batch_size].to(device)
-                out = self(batch).detach().cpu()
-                outs.append(out)
-            return torch.cat(outs)
+            return _predict_in_batches(
+                forward,
+                x,
+                batch_size=batch_size,
+                device=self.device,
+                out=out,
+                seq_var=seq_var,
+                transform=transform,
+                verbose=verbose,
+            )
 
     def _common_step(self, batch, batch_idx, stage: str):
         """Common step for training, validation and test
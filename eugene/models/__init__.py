@@ -4,4 +4,5 @@ from .base._towers import Tower, Conv1DTower
 from ._SequenceModule import SequenceModule
 from ._ProfileModule import ProfileModule
 from ._utils import list_available_layers, get_layer, load_config
+from ._tta import TestTimeAugmentation
 from .base._initializers import init_motif_weights, init_weights
\ No newline at end of file
@@ -0,0 +1,80 @@
+from typing import Literal, Sequence
+
+import torch
+import torch.nn as nn
+
+from .base._layers import RevComp
+
+
+def _shift(x: torch.Tensor, shift: int, dim: int = 2) -> torch.Tensor:
+    """Shift x by shift positions along dim, padding with zeros (N) instead of wrapping around."""
+    if shift == 0:
+        return x
+    out = torch.zeros_like(x)
+    length = x.shape[dim]
+    if abs(shift) >= length:
+        return out
+    if shift > 0:
+        out.narrow(dim, shift, length - shift).copy_(x.narrow(dim, 0, length - shift))
+    else:
+        out.narrow(dim, 0, length + shift).copy_(x.narrow(dim, -shift, length + shift))
+    return out
+
+
+class TestTimeAugmentation(nn.Module):
+    """Wraps a model to average its predictions over reverse complement and shifted inputs.
+
+    The forward, reverse complement and shifted variants of a batch are stacked into a single
+    batch (len(variants) times larger) that goes through the model in one forward pass, and the
+    outputs are reduced over the variants on the device. The outputs of the model must not
+    depend on the strand or position of the inputs (e.g. one row of scalar predictions per
+    sequence), since the outputs of the reverse complement variants are not flipped back.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        Model taking one-hot encoded sequences of shape (N, A, L).
+    rc : bool, optional
+        Whether to add the reverse complement of each variant, by default True
+    shifts : sequence of int, optional
+        Shifts along the length axis to add, e.g. (-1, 1). Shifted sequences are padded with
+        zeros. By default ()
+    reduce : str, optional
+        How to reduce the predictions of the variants, "mean", "median" or "max", by default "mean"
+    """
+
+    def __init__(
+        self,
+        model: nn.Module,
+        rc: bool = True,
+        shifts: Sequence[int] = (),
+        reduce: Literal["mean", "median", "max"] = "mean",
+    ):
+        super().__init__()
+        if reduce not in ["mean", "median", "max"]:
+            raise ValueError(f"Unknown reduce {reduce}, must be 'mean', 'median' or 'max'.")
+        self.model = model
+        self.rc = rc
+        self.shifts = [0] + [shift for shift in shifts if shift != 0]
+        self.reduce = reduce
+        self.revcomp = RevComp(dim=[1, 2])
+
+    @property
+    def n_variants(self) -> int:
+        return len(self.shifts) * (2 if self.rc else 1)
+
+    def augment(self, x: torch.Tensor) -> torch.Tensor:
+        """Stack the variants of x along the batch axis, variant by variant."""
+        variants = [_shift(x, shift, dim=2) for shift in self.shifts]
+        if self.rc:
+            variants += [self.revcomp(variant) for variant in variants]
+        return torch.cat(variants)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        out = self.model(self.augment(x))
+        out = out.reshape(self.n_variants, len(x), *out.shape[1:])
+        if self.reduce == "mean":
+            return out.mean(dim=0)
+        if self.reduce == "median":
+            return out.median(dim=0).values
+        return out.max(dim=0).values
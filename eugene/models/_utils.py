@@ -1,10 +1,13 @@
 import importlib
-from typing import List, Tuple, Union
+from typing import Callable, Iterator, List, Optional, Tuple, Union
 from pathlib import Path
 import os
 from os import PathLike
+import numpy as np
 import torch
+import xarray as xr
 import yaml
+from tqdm.auto import tqdm
 from .._settings import settings
 
 
@@ -61,3 +64,84 @@ def load_config(
         model = model_type(**arch)
     else:
         raise ValueError("Config file must contain either a 'model' or 'module' key")
+
+
+def _iter_input_batches(
+    x,
+    batch_size: int,
+    seq_var: str = "ohe_seq",
+    transform: Optional[Callable] = None,
+) -> Iterator[torch.Tensor]:
+    """Yield float32 tensors of batches of an array, tensor, DataArray or iterable of batches.
+
+    Arrays and (lazy) DataArrays are sliced and converted one batch at a time, so they are
+    never copied as a whole. Batches of iterables (e.g. dataloaders) can be tensors, arrays,
+    tuples (inputs first) or dicts (inputs under seq_var).
+    """
+    if isinstance(x, (np.ndarray, torch.Tensor, xr.DataArray)) or hasattr(x, "oindex"):
+        batches = (x[i : i + batch_size] for i in range(0, len(x), batch_size))
+    else:
+        batches = iter(x)
+    for batch in batches:
+        if isinstance(batch, dict):
+            batch = batch[seq_var]
+        elif isinstance(batch, (tuple, list)):
+            batch = batch[0]
+        if isinstance(batch, xr.DataArray):
+            batch = batch.values
+        if transform is not None:
+            batch = transform(batch)
+        batch = torch.as_tensor(batch)
+        # converted per batch instead of copying the whole input
+        yield batch if batch.dtype in (torch.float32, torch.float16, torch.bfloat16) else batch.float()
+
+
+def _predict_in_batches(
+    forward: Callable[[torch.Tensor], torch.Tensor],
+    x,
+    batch_size: int = 128,
+    device: Union[str, torch.device] = "cpu",
+    out=None,
+    seq_var: str = "ohe_seq",
+    transform: Optional[Callable] = None,
+    verbose: bool = True,
+):
+    """Run forward on batches of x and write the outputs into a buffer as they come.
+
+    If out is None, a tensor is allocated with the first batch when the length of x is known,
+    so no list of outputs is kept. Otherwise, out can be any array-like supporting slice
+    assignment (torch.Tensor, numpy.ndarray, numpy.memmap, zarr.Array...) with one row per
+    sequence, which keeps the memory constant in the number of sequences.
+    """
+    if hasattr(x, "batch_sampler"):
+        # dataloaders: the number of sequences is only known for plain batch samplers
+        sampler = getattr(x.batch_sampler, "sampler", None)
+        n = len(sampler) if sampler is not None and not x.drop_last else None
+        n_batches = len(x)
+    elif hasattr(x, "__len__"):
+        n = len(x)
+        n_batches = -(-n // batch_size)
+    else:
+        n, n_batches = None, None
+    outs: List[torch.Tensor] = []
+    start = 0
+    for batch in tqdm(
+        _iter_input_batches(x, batch_size, seq_var=seq_var, transform=transform),
+        desc="Predicting on batches",
+        total=n_batches,
+        disable=not verbose,
+    ):
+        batch_out = forward(batch.to(device, non_blocking=True)).detach().cpu()
+        stop = start + len(batch_out)
+        if out is None and n is not None:
+            out = torch.empty((n, *batch_out.shape[1:]), dtype=batch_out.dtype)
+        if out is None:
+            outs.append(batch_out)
+        elif isinstance(out, torch.Tensor):
+            out[start:stop] = batch_out
+        else:
+            out[start:stop] = batch_out.numpy()
+        start = stop
+    if out is None:
+        return torch.cat(outs)
+    return out
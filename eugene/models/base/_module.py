@@ -9,6 +9,7 @@ from base._losses import LOSS_REGISTRY
 from base._optimizers import OPTIMIZER_REGISTRY
 from base._schedulers import SCHEDULER_REGISTRY
 from base._metrics import METRIC_REGISTRY, DEFAULT_TASK_METRICS, DEFAULT_METRIC_KWARGS
+from .._utils import _predict_in_batches
 
 
 class BaseModule(LightningModule):
@@ -95,24 +96,16 @@ class BaseModule(LightningModule):
         """
         self.model(x)
 
-    def predict(self, x, batch_size=128):
+    def predict(self, x, batch_size=128, out=None):
         """
-        Predict the output of the model in batches
+        Predict the output of the model in batches, streaming the inputs and writing the
+        outputs into out (any preallocated array-like with one row per sequence) if given
         """
         with torch.no_grad():
-            device = self.model.device
             self.model.eval()
-            if isinstance(x, np.ndarray):
-                x = torch.from_numpy(x.astype(np.float32))
-            outs = []
-            for _, i in tqdm(
-                enumerate(range(0, len(x), batch_size)),
-                desc="Predicting on batches",
-                total=len(x) // batch_size,
-            ):
-                batch = x[i : i + batch_size].to(device)
-                outs.append(self.model(batch))
-            return torch.cat(outs)
+            return _predict_in_batches(
+                self.model, x, batch_size=batch_size, device=self.model.device, out=out
+            )
 
     def _common_step(self, batch, batch_idx, stage: str):
         """Common step for training, validation and test
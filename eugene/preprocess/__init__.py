@@ -2,9 +2,15 @@ from ._seqdata import (
     make_unique_ids_sdata,
     pad_seqs_sdata,
     ohe_seqs_sdata,
+    tokenize_seqs_sdata,
+    count_kmers_sdata,
+    edit_distance_sdata,
+    find_duplicates_sdata,
+    generate_background_sdata,
     train_test_chrom_split,
     train_test_homology_split,
     train_test_random_split,
     clamp_targets_sdata,
     scale_targets_sdata,
 )
+from ._pipeline import Pipeline
@@ -0,0 +1,152 @@
+from os import PathLike
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import dask
+import xarray as xr
+
+from ._seqdata import (
+    _write_zarr,
+    clamp_targets_sdata,
+    count_kmers_sdata,
+    find_duplicates_sdata,
+    make_unique_ids_sdata,
+    ohe_seqs_sdata,
+    pad_seqs_sdata,
+    scale_targets_sdata,
+    tokenize_seqs_sdata,
+    train_test_chrom_split,
+    train_test_random_split,
+)
+
+PREPROCESS_REGISTRY: Dict[str, Callable] = {
+    "pad": pad_seqs_sdata,
+    "ids": make_unique_ids_sdata,
+    "ohe": ohe_seqs_sdata,
+    "tokenize": tokenize_seqs_sdata,
+    "kmers": count_kmers_sdata,
+    "duplicates": find_duplicates_sdata,
+    "chrom_split": train_test_chrom_split,
+    "random_split": train_test_random_split,
+    "clamp": clamp_targets_sdata,
+    "scale": scale_targets_sdata,
+}
+
+
+class Pipeline:
+    """Declarative preprocessing pipeline that runs several steps in a single chunked pass.
+
+    Each step is one of the SeqData preprocessing functions in `eugene.preprocess`, given either
+    by name (see `PREPROCESS_REGISTRY`) or as a callable, together with its keyword arguments.
+    Instead of materializing the output of every step, the SeqData is chunked along "_sequence"
+    and all steps are applied lazily, building a single dask graph. Statistics fitted by steps
+    (e.g. the percentiles of "clamp" or the moments of "scale") are part of the graph too, only
+    "duplicates" computes its sequence hashes when it runs. The new (or modified) variables are
+    then computed together, so every input chunk is read once and every output variable is
+    written once, e.g. to the zarr store the SeqData was read from, replacing the variables it
+    already holds.
+
+    Parameters
+    ----------
+    steps : list of str, or tuples of (str or callable, dict)
+        The steps to run in order, e.g. [("pad", {"length": 200, "pad_value": "N"}), "ids"].
+        The keyword arguments are passed to the step function.
+    chunk_size : int, optional
+        Number of sequences per chunk. If given, all variables with a "_sequence" dimension
+        are (re)chunked before running the steps. If None, the existing chunking of the SeqData
+        is used, by default None
+
+    Examples
+    --------
+    >>> pipeline = Pipeline(
+    ...     [
+    ...         ("pad", {"length": 200, "pad_value": "N"}),
+    ...         ("ids", {}),
+    ...         ("ohe", {"seq_var": "seq_padded"}),
+    ...         ("chrom_split", {"test_chroms": ["chr8"]}),
+    ...     ],
+    ...     chunk_size=10000,
+    ... )
+    >>> pipeline.run(sdata, zarr_path="sdata.zarr")
+    """
+
+    def __init__(
+        self,
+        steps: List[Union[str, Tuple[Union[str, Callable], Dict[str, Any]]]],
+        chunk_size: Optional[int] = None,
+    ):
+        self.steps = [self._parse_step(step) for step in steps]
+        self.chunk_size = chunk_size
+        self.results: Dict[str, Any] = {}
+
+    @staticmethod
+    def _parse_step(
+        step: Union[str, Tuple[Union[str, Callable], Dict[str, Any]]]
+    ) -> Tuple[str, Callable, Dict[str, Any]]:
+        """Resolve a step to its name, function and keyword arguments."""
+        fn, kwargs = (step, {}) if isinstance(step, str) or callable(step) else step
+        if isinstance(fn, str):
+            if fn not in PREPROCESS_REGISTRY:
+                raise ValueError(
+                    f"Unknown preprocessing step {fn}. Available steps are {list(PREPROCESS_REGISTRY.keys())}"
+                )
+            return fn, PREPROCESS_REGISTRY[fn], kwargs
+        return fn.__name__, fn, kwargs
+
+    def run(
+        self,
+        sdata: xr.Dataset,
+        zarr_path: Optional[PathLike] = None,
+        compute: bool = False,
+        copy: bool = False,
+    ) -> Optional[xr.Dataset]:
+        """Run the pipeline on a SeqData object.
+
+        Anything a step returns (e.g. a scaler from scale_targets_sdata with return_scaler=True)
+        is stored in the `results` attribute under the name of the step.
+
+        Parameters
+        ----------
+        sdata : xr.Dataset
+            SeqData object.
+        zarr_path : PathLike, optional
+            Zarr store to write the new and modified variables to in one pass. The variables are
+            replaced in the SeqData with lazy views of the stored arrays. Sparse variables (e.g. the
+            counts of the "kmers" step) are stored as dense arrays, by default None
+        compute : bool, optional
+            Whether to compute the new and modified variables into memory in one pass when no
+            zarr_path is given. If False, they are left as lazy dask arrays, by default False
+        copy : bool, optional
+            Whether to return a copy of the SeqData object, by default False
+
+        Returns
+        -------
+        xr.Dataset
+            Preprocessed SeqData object. If copy is True, a copy of the SeqData
+            object is returned, else the original SeqData object is modified in place.
+        """
+        sdata = sdata.copy() if copy else sdata
+        if self.chunk_size is not None:
+            for var in list(sdata.data_vars):
+                if "_sequence" in sdata[var].dims:
+                    sdata[var] = sdata[var].chunk({"_sequence": self.chunk_size})
+        inputs = {var: sdata.variables[var].data for var in sdata.data_vars}
+        for name, fn, kwargs in self.steps:
+            out = fn(sdata, **kwargs)
+            if out is not None:
+                self.results[name] = out
+        outputs = [
+            var
+            for var in sdata.data_vars
+            if var not in inputs or sdata.variables[var].data is not inputs[var]
+        ]
+        if zarr_path is not None:
+            _write_zarr(sdata, outputs, zarr_path)
+        elif compute:
+            computed = dask.compute(*[sdata[var] for var in outputs])
+            for var, arr in zip(outputs, computed):
+                sdata[var] = arr
+        return sdata if copy else None
+
+    def __repr__(self) -> str:
+        steps = ", ".join(f"{name}({kwargs})" for name, _, kwargs in self.steps)
+        return f"Pipeline([{steps}], chunk_size={self.chunk_size})"
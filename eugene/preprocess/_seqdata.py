@@ -1,14 +1,41 @@
 import os
 import sys
-from typing import Any, Dict, Generic, List, Literal, Optional, Type, Union, cast
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import repeat
+from multiprocessing import get_context
+from os import PathLike
+from typing import Any, Dict, Generic, Iterator, List, Literal, Optional, Tuple, Type, Union, cast
 
+import dask
 import dask.array as da
+from dask.delayed import Delayed
 import dask_ml as dml
 import numpy as np
 import seqpro as sp
 import xarray as xr
+import zarr
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from sklearn.preprocessing import StandardScaler
 
+from ._utils import (
+    _kmer_coords,
+    candidate_pairs,
+    count_kmers,
+    hamming_distance,
+    hash_seqs,
+    kmer_codes,
+    levenshtein_distance,
+    lsh_band_keys,
+    merge_groups,
+    minhash_signatures,
+    pack_tokens,
+    tokenize_seqs,
+    unpack_tokens,
+)
+
 bin_dir = os.path.dirname(sys.executable)
 os.environ["PATH"] += os.pathsep + bin_dir
 
@@ -17,10 +44,13 @@ alphabets ={
     "RNA": sp.alphabets.RNA,
 }
 
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
 
 def make_unique_ids_sdata(
     sdata: xr.Dataset,
     id_var: str = "id",
+    chunk_size: Optional[int] = None,
     copy: bool = False,
 ) -> Optional[xr.Dataset]:
     """Make a set of unique ids for each sequence in a SeqData object and store as new xarray variable. 
@@ -28,12 +58,19 @@ def make_unique_ids_sdata(
     Expects that the dimension for the number of sequences is named "_sequence". Otherwise,
     it will fail. Will also overwrite any existing variable with the same name.
 
+    Ids are generated vectorized as fixed-width bytes (e.g. b"seq0001"). If the SeqData is
+    backed by dask arrays chunked along "_sequence" (or a chunk_size is given), the ids are
+    generated lazily with the same chunking.
+
     Parameters
     ----------
     sdata : xr.Dataset
         SeqData object.
     id_var : str, optional
         Name of the variable to store the ids in, by default "id"
+    chunk_size : int, optional
+        Number of ids to generate per chunk. If not given, the chunking of the SeqData along
+        "_sequence" is used if there is one, by default None
     copy : bool, optional
         Whether to return a copy of the SeqData object, by default False
 
@@ -44,32 +81,59 @@ def make_unique_ids_sdata(
         object is returned, else the original SeqData object is modified in place.
     """
     sdata = sdata.copy() if copy else sdata
-    n_digits = len(str(sdata.dims["_sequence"]))
-    sdata[id_var] = xr.DataArray(
-        [
-            "seq{num:0{width}}".format(num=i, width=n_digits)
-            for i in range(sdata.dims["_sequence"])
-        ],
-        dims=["_sequence"],
-    )
+    n_seqs = sdata.sizes["_sequence"]
+    n_digits = len(str(n_seqs))
+    chunks = chunk_size if chunk_size is not None else _sequence_chunks(sdata)
+    if chunks is not None:
+        ids = da.arange(n_seqs, chunks=chunks).map_blocks(
+            _format_ids, n_digits=n_digits, dtype=f"S{n_digits + 3}"
+        )
+    else:
+        ids = _format_ids(np.arange(n_seqs), n_digits=n_digits)
+    sdata[id_var] = xr.DataArray(ids, dims=["_sequence"])
     return sdata if copy else None
 
 
+def _format_ids(
+    nums: np.ndarray,
+    n_digits: int,
+) -> np.ndarray:
+    """Format integers as zero padded, fixed-width bytes ids, e.g. 1 -> b"seq0001"."""
+    return np.char.add(b"seq", np.char.zfill(nums.astype(f"S{n_digits}"), n_digits))
+
+
+def _sequence_chunks(
+    sdata: xr.Dataset,
+) -> Optional[tuple]:
+    """Get the chunks of the "_sequence" dimension from the first dask-backed variable that has it."""
+    for var in sdata.data_vars.values():
+        if "_sequence" in var.dims and var.chunks is not None:
+            return var.chunks[var.dims.index("_sequence")]
+    return None
+
+
 def pad_seqs_sdata(
     sdata: xr.Dataset,
     length: int,
     seq_var: str = "seq", 
     pad: Literal["left", "both", "right"] = "right",
     pad_value: Optional[str] = None,
+    chunk_size: Optional[int] = None,
     copy: bool = False,
 ) -> Optional[xr.Dataset]:
     """Pad sequences in a SeqData object.
     
-    Wraps the pad_seqs function from SeqPro on the sequences in a SeqData object. Automatically
+    Pads (or truncates) the sequences in a SeqData object to a fixed length. Automatically
     adds a new variable to the SeqData object with the padded sequences called "{seq_var}_padded".
     Assumes that the dimension for the number of sequences is named "_sequence" and will add dimension
     called length to the padded sequences. Will also overwrite any existing variable with the same name.
 
+    Sequences can be variable length strings with dimension ("_sequence") or arrays of characters with
+    dimensions ("_sequence", length), where empty characters at the end are treated as missing. Sequences
+    longer than length are truncated to their first length characters. Padding is done with a single
+    vectorized gather per chunk and results in an array of single characters (dtype S1). If the sequences
+    are backed by a dask array (or a chunk_size is given), padding is done lazily chunk by chunk.
+
     Parameters
     ----------
     sdata : xr.Dataset
@@ -84,6 +148,9 @@ def pad_seqs_sdata(
     pad_val : str, optional
         Single character to pad sequences with. Needed for string input. Ignored for OHE
         sequences, by default None
+    chunk_size : int, optional
+        Number of sequences to pad per chunk. If given, the sequences are (re)chunked along
+        "_sequence" and padded lazily, by default None
     copy : bool, optional
         Whether to return a copy of the SeqData object, by default False
 
@@ -94,17 +161,70 @@ def pad_seqs_sdata(
         object is returned, else the original SeqData object is modified in place.
     """
     sdata = sdata.copy() if copy else sdata
-    padded_seqs = sp.pad_seqs(seqs=sdata["seq"].values, pad=pad, pad_value=pad_value, length=length)
-    sdata[f"{seq_var}_padded"] = xr.DataArray(padded_seqs, dims=["_sequence", "length"])
+    seqs = _chunk_sequences(sdata[seq_var].data, chunk_size)
+    is_bytes = seqs.dtype.kind in "SUO"
+    if is_bytes and pad_value is None:
+        raise ValueError("Need a pad value to pad string sequences.")
+    if isinstance(seqs, da.Array):
+        if seqs.ndim == 1:
+            extra_chunks = dict(new_axis=1)
+        else:
+            seqs = seqs.rechunk({1: -1})
+            extra_chunks = {}
+        padded_seqs = seqs.map_blocks(
+            _pad_block,
+            length=length,
+            pad=pad,
+            pad_value=pad_value,
+            chunks=(seqs.chunks[0], (length,)) + seqs.chunks[2:],
+            dtype="S1" if is_bytes else seqs.dtype,
+            **extra_chunks,
+        )
+    else:
+        padded_seqs = _pad_block(seqs, length=length, pad=pad, pad_value=pad_value)
+    dims = ["_sequence", "length"] + list(sdata[seq_var].dims[2:])
+    sdata[f"{seq_var}_padded"] = xr.DataArray(padded_seqs, dims=dims)
     return sdata if copy else None
 
 
+def _pad_block(
+    seqs: np.ndarray,
+    length: int,
+    pad: Literal["left", "both", "right"] = "right",
+    pad_value: Optional[str] = None,
+) -> np.ndarray:
+    """Pad or truncate a single block of sequences along axis 1 with one gather."""
+    if seqs.dtype.kind in "SUO":
+        arr = np.ascontiguousarray(_as_char_block(seqs), dtype="S1").view(np.uint8)
+        lengths = np.minimum((arr != 0).sum(axis=1), length)
+        fill = ord(pad_value)
+    else:
+        arr = seqs
+        lengths = np.full(len(seqs), min(seqs.shape[1], length))
+        fill = 0
+    if pad == "left":
+        offsets = length - lengths
+    elif pad == "both":
+        offsets = (length - lengths) // 2
+    else:
+        offsets = np.zeros_like(lengths)
+    src = np.arange(length)[None, :] - offsets[:, None]
+    valid = (src >= 0) & (src < lengths[:, None])
+    src = np.clip(src, 0, max(arr.shape[1] - 1, 0))
+    trailing = (1,) * (arr.ndim - 2)
+    padded = np.take_along_axis(arr, src.reshape(src.shape + trailing), axis=1)
+    padded = np.where(valid.reshape(valid.shape + trailing), padded, np.array(fill, dtype=arr.dtype))
+    return padded.view("S1") if seqs.dtype.kind in "SUO" else padded
+
+
 def ohe_seqs_sdata(
     sdata: xr.Dataset,
     alphabet: str = "DNA",
     seq_var: str = "seq",
     ohe_var: str = "ohe_seq",
     fill_value: Union[int, float] = 0,
+    chunk_size: Optional[int] = None,
+    zarr_path: Optional[PathLike] = None,
     copy: bool = False,
 ) -> Optional[xr.Dataset]:
     """One-hot encode sequences in a SeqData object.
@@ -114,6 +234,11 @@ def ohe_seqs_sdata(
     with dimensions ()"_sequence", "length", "_ohe"). Will also overwrite any existing variable
     with the same name.
 
+    If the sequences are backed by a dask array (e.g. a SeqData read from zarr) or a chunk_size
+    is given, the encoding is done lazily chunk by chunk and the new variable is a dask array
+    with the same chunking along "_sequence". Nothing is computed until the variable is loaded
+    or written, so peak memory is bounded by the chunk size rather than the number of sequences.
+
     Parameters
     ----------
     sdata : xr.Dataset
@@ -126,6 +251,12 @@ def ohe_seqs_sdata(
         Name of the variable to store the one-hot encoded sequences in, by default "ohe_seq"
     fill_value : Union[int, float], optional
         Value to fill the one-hot encoded sequences with, by default 0
+    chunk_size : int, optional
+        Number of sequences to encode per chunk. If given, the sequences are (re)chunked along
+        "_sequence" and encoded lazily, by default None
+    zarr_path : PathLike, optional
+        Zarr store to write the encoded sequences to. The variable is written chunk by chunk and
+        replaced in the SeqData with a lazy view of the stored array, by default None
     copy : bool, optional
         Whether to return a copy of the SeqData object, by default False
     
@@ -136,14 +267,728 @@ def ohe_seqs_sdata(
         object is returned, else the original SeqData object is modified in place.
     """
     sdata = sdata.copy() if copy else sdata
-    ohe_seqs = sp.ohe(sdata[seq_var].values, alphabet=alphabets[alphabet])
+    seqs = _chunk_sequences(sdata[seq_var].data, chunk_size)
+    if isinstance(seqs, da.Array):
+        if seqs.ndim != 2:
+            raise ValueError(
+                f"Lazy one-hot encoding expects {seq_var} to be an array of characters with dimensions "
+                "(sequence, length). Use pad_seqs_sdata to convert variable length sequences first."
+            )
+        n_channels = len(alphabets[alphabet].alphabet)
+        dtype = np.dtype(np.uint8) if fill_value == 0 else np.dtype(type(fill_value))
+        ohe_seqs = seqs.map_blocks(
+            _ohe_block,
+            alphabet=alphabets[alphabet],
+            fill_value=fill_value,
+            new_axis=2,
+            chunks=seqs.chunks + ((n_channels,),),
+            dtype=dtype,
+            meta=np.empty((0, 0, 0), dtype=dtype),
+        )
+    else:
+        ohe_seqs = _ohe_block(seqs, alphabet=alphabets[alphabet], fill_value=fill_value)
+    sdata[ohe_var] = xr.DataArray(ohe_seqs, dims=["_sequence", "length", "_ohe"])
+    if zarr_path is not None:
+        _write_zarr(sdata, [ohe_var], zarr_path)
+    return sdata if copy else None
+
+
+def _ohe_block(
+    seqs: np.ndarray,
+    alphabet: sp.alphabets.NucleotideAlphabet,
+    fill_value: Union[int, float] = 0,
+) -> np.ndarray:
+    """One-hot encode a single block of sequences, filling unknown characters with fill_value."""
+    ohe_seqs = sp.ohe(seqs, alphabet=alphabet)
     if fill_value != 0:
         ohe_seqs = ohe_seqs.astype(type(fill_value))
         ohe_seqs[(ohe_seqs == 0).all(-1)] = np.array(np.repeat(fill_value, ohe_seqs.shape[-1]), dtype=type(fill_value))
-    sdata[ohe_var] = xr.DataArray(ohe_seqs, dims=["_sequence", "length", "_ohe"])
+    return ohe_seqs
+
+
+def _chunk_sequences(
+    seqs: Union[np.ndarray, da.Array],
+    chunk_size: Optional[int] = None,
+) -> Union[np.ndarray, da.Array]:
+    """Chunk an array along its first (sequence) axis if a chunk size is given.
+
+    Dask arrays are kept as is unless a chunk size is given. Every other axis is
+    merged into a single chunk so that blocks always hold complete sequences.
+    """
+    if chunk_size is None:
+        return seqs
+    if not isinstance(seqs, da.Array):
+        # explicit chunks, dask can't pick chunks automatically for object arrays
+        return da.from_array(seqs, chunks=(chunk_size,) + seqs.shape[1:])
+    return seqs.rechunk({0: chunk_size, **{i: -1 for i in range(1, seqs.ndim)}})
+
+
+def _write_zarr(
+    sdata: xr.Dataset,
+    variables: List[str],
+    zarr_path: PathLike,
+) -> None:
+    """Write variables of a SeqData to a zarr store and replace them with lazy views of the store.
+
+    Variables are added to the store if it already exists. Existing variables with the same name
+    are replaced as a whole (data type, shape, chunks and attributes) rather than written into.
+    They are first written under temporary names, so variables computed from the arrays they
+    replace (e.g. targets of the store scaled in place) still read the old arrays. Sparse
+    variables (e.g. from count_kmers_sdata) are written as dense arrays, since zarr can't store
+    them.
+    """
+    to_write = sdata[variables]
+    for var in variables:
+        to_write[var] = to_write[var].copy(data=_densify(to_write[var].data))
+        to_write[var].encoding = {}
+    group = zarr.open_group(zarr_path, mode="a")
+    replaced = {var: f"{var}_tmp" for var in variables if var in group}
+    to_write.rename_vars(replaced).to_zarr(zarr_path, mode="a")
+    for var, tmp in replaced.items():
+        del group[var]
+        # arrays are directories of local stores, zarr>=3 can't move them
+        os.rename(os.path.join(zarr_path, tmp), os.path.join(zarr_path, var))
+    if replaced:
+        zarr.consolidate_metadata(zarr_path)
+    stored = xr.open_zarr(zarr_path, concat_characters=False)
+    for var in variables:
+        sdata[var] = stored[var]
+
+
+def _densify(
+    data: Union[np.ndarray, da.Array],
+) -> Union[np.ndarray, da.Array]:
+    """Convert a (dask-backed) sparse array to a dense one, chunk by chunk for dask arrays."""
+    if isinstance(data, da.Array):
+        if not hasattr(data._meta, "todense"):
+            return data
+        meta = np.empty((0,) * data.ndim, dtype=data.dtype)
+        return data.map_blocks(lambda block: block.todense(), dtype=data.dtype, meta=meta)
+    return data.todense() if hasattr(data, "todense") else data
+
+
+def tokenize_seqs_sdata(
+    sdata: xr.Dataset,
+    alphabet: str = "DNA",
+    seq_var: str = "seq",
+    token_var: str = "token_seq",
+    pack: bool = False,
+    chunk_size: Optional[int] = None,
+    zarr_path: Optional[PathLike] = None,
+    copy: bool = False,
+) -> Optional[xr.Dataset]:
+    """Encode sequences in a SeqData object as integer tokens.
+
+    A compact alternative to ohe_seqs_sdata. Each character is stored as a single uint8 token
+    (its index in the alphabet, with len(alphabet) for unknown characters like N) in a variable
+    with dimensions ("_sequence", "length"), a 4x saving over uint8 one-hot encodings and 16x over
+    float32. With pack=True, tokens are further packed 4 per byte along a "_packed_length" dimension
+    and the original length is stored in the "length" attribute of the variable. Packing requires
+    sequences without unknown characters.
+
+    Tokens can be expanded back to one-hot encodings on the fly, e.g. in a dataloader with
+    eugene.dataload.TokensToOHE. Like ohe_seqs_sdata, dask-backed sequences are encoded lazily
+    chunk by chunk. Will also overwrite any existing variable with the same name.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object.
+    alphabet : str, optional
+        Alphabet to use for tokenization, by default "DNA"
+    seq_var : str, optional
+        Name of the variable holding the sequences to be encoded, by default "seq"
+    token_var : str, optional
+        Name of the variable to store the tokens in, by default "token_seq"
+    pack : bool, optional
+        Whether to pack tokens into 2 bits per character, by default False
+    chunk_size : int, optional
+        Number of sequences to encode per chunk. If given, the sequences are (re)chunked along
+        "_sequence" and encoded lazily, by default None
+    zarr_path : PathLike, optional
+        Zarr store to write the tokens to. The variable is written chunk by chunk and
+        replaced in the SeqData with a lazy view of the stored array, by default None
+    copy : bool, optional
+        Whether to return a copy of the SeqData object, by default False
+
+    Returns
+    -------
+    xr.Dataset
+        SeqData object with tokenized sequences. If copy is True, a copy of the SeqData
+        object is returned, else the original SeqData object is modified in place.
+    """
+    sdata = sdata.copy() if copy else sdata
+    letters = alphabets[alphabet].alphabet
+    seqs = _chunk_sequences(sdata[seq_var].data, chunk_size)
+    if seqs.ndim != 2:
+        raise ValueError(
+            f"Tokenization expects {seq_var} to be an array of characters with dimensions "
+            "(sequence, length). Use pad_seqs_sdata to convert variable length sequences first."
+        )
+    length = seqs.shape[1]
+    if isinstance(seqs, da.Array):
+        seqs = seqs.rechunk({1: -1})
+        tokens = seqs.map_blocks(
+            _tokenize_block,
+            alphabet=letters,
+            pack=pack,
+            chunks=(seqs.chunks[0], (-(-length // 4) if pack else length,)),
+            dtype=np.uint8,
+            meta=np.empty((0, 0), dtype=np.uint8),
+        )
+    else:
+        tokens = _tokenize_block(seqs, alphabet=letters, pack=pack)
+    if pack:
+        sdata[token_var] = xr.DataArray(
+            tokens, dims=["_sequence", "_packed_length"], attrs={"length": length}
+        )
+    else:
+        sdata[token_var] = xr.DataArray(tokens, dims=["_sequence", "length"])
+    if zarr_path is not None:
+        _write_zarr(sdata, [token_var], zarr_path)
+    return sdata if copy else None
+
+
+def _tokenize_block(
+    seqs: np.ndarray,
+    alphabet: str,
+    pack: bool = False,
+) -> np.ndarray:
+    """Tokenize (and optionally pack) a single block of sequences."""
+    tokens = tokenize_seqs(seqs, alphabet)
+    return pack_tokens(tokens) if pack else tokens
+
+
+def count_kmers_sdata(
+    sdata: xr.Dataset,
+    k: int,
+    alphabet: str = "DNA",
+    seq_var: str = "seq",
+    kmer_var: Optional[str] = None,
+    canonical: bool = False,
+    frequency: bool = False,
+    sparse: bool = True,
+    chunk_size: Optional[int] = None,
+    copy: bool = False,
+) -> Optional[xr.Dataset]:
+    """Count the k-mers of each sequence in a SeqData object.
+
+    Sequences are tokenized and all k-mers are encoded at once with a sliding window over each
+    chunk, so no Python loop runs over sequences. The spectra are stored in a variable with dimensions
+    ("_sequence", "_kmer") where column i counts the k-mer with base-4 code i (e.g. AAA=0, AAC=1,
+    ..., TTT=63 for k=3). k-mers containing unknown characters like N are skipped. Dask-backed
+    sequences are counted lazily chunk by chunk. Since spectra get sparse quickly with k (a dense
+    chunk holds 4**k counts per sequence), they are stored as [sparse](https://sparse.pydata.org)
+    COO arrays by default.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object.
+    k : int
+        Length of the k-mers (e.g. k=3 counts 3-mers).
+    alphabet : str, optional
+        Alphabet of the sequences, by default "DNA"
+    seq_var : str, optional
+        Name of the variable holding the sequences, by default "seq"
+    kmer_var : str, optional
+        Name of the variable to store the counts in. If None, f"{k}mer_counts" is used, by default None
+    canonical : bool, optional
+        Whether to count k-mers together with their reverse complements. The counts are stored in
+        the column of the lexicographically smaller k-mer, by default False
+    frequency : bool, optional
+        Whether to store the relative k-mer frequency of each sequence in place of counts, by default False
+    sparse : bool, optional
+        Whether to store the counts as a sparse array. Sparse counts are converted to dense arrays
+        when written to zarr, by default True
+    chunk_size : int, optional
+        Number of sequences to count per chunk. If given, the sequences are (re)chunked along
+        "_sequence" and counted lazily, by default None
+    copy : bool, optional
+        Whether to return a copy of the SeqData object, by default False
+
+    Returns
+    -------
+    xr.Dataset
+        SeqData object with k-mer counts. If copy is True, a copy of the SeqData
+        object is returned, else the original SeqData object is modified in place.
+    """
+    # imported here as sparse pulls in numba
+    import sparse as sparse_lib
+
+    sdata = sdata.copy() if copy else sdata
+    letters = alphabets[alphabet].alphabet
+    kmer_var = f"{k}mer_counts" if kmer_var is None else kmer_var
+    seqs = _chunk_sequences(sdata[seq_var].data, chunk_size)
+    if seqs.ndim != 2:
+        raise ValueError(
+            f"k-mer counting expects {seq_var} to be an array of characters with dimensions "
+            "(sequence, length). Use pad_seqs_sdata to convert variable length sequences first."
+        )
+    dtype = np.float64 if frequency else np.int64
+    kwargs = dict(alphabet=letters, k=k, canonical=canonical, frequency=frequency, sparse=sparse)
+    if isinstance(seqs, da.Array):
+        seqs = seqs.rechunk({1: -1})
+        meta = np.empty((0, 0), dtype=dtype)
+        counts = seqs.map_blocks(
+            _count_kmers_block,
+            **kwargs,
+            chunks=(seqs.chunks[0], (len(letters) ** k,)),
+            dtype=dtype,
+            meta=sparse_lib.COO.from_numpy(meta) if sparse else meta,
+        )
+    else:
+        counts = _count_kmers_block(seqs, **kwargs)
+    sdata[kmer_var] = xr.DataArray(
+        counts, dims=["_sequence", "_kmer"], attrs={"k": k, "canonical": int(canonical)}
+    )
+    return sdata if copy else None
+
+
+def _count_kmers_block(
+    seqs: np.ndarray,
+    alphabet: str,
+    k: int,
+    canonical: bool = False,
+    frequency: bool = False,
+    sparse: bool = False,
+):
+    """Count the k-mers of a single block of sequences, as a dense or sparse array."""
+    tokens = tokenize_seqs(seqs, alphabet)
+    if not sparse:
+        return count_kmers(tokens, k, len(alphabet), canonical=canonical, frequency=frequency)
+    import sparse as sparse_lib
+
+    rows, cols, n_kmers = _kmer_coords(tokens, k, len(alphabet), canonical=canonical)
+    counts = sparse_lib.COO(
+        np.stack([rows, cols]),
+        np.ones(len(rows), dtype=np.int64),
+        shape=(len(tokens), n_kmers),
+    )
+    if frequency:
+        totals = np.maximum(np.bincount(rows, minlength=len(tokens)), 1)
+        counts = sparse_lib.COO(
+            counts.coords, counts.data / totals[counts.coords[0]], shape=counts.shape
+        )
+    return counts
+
+
+def edit_distance_sdata(
+    sdata: xr.Dataset,
+    seq_var: str = "seq",
+    other_var: Optional[str] = None,
+    other_sdata: Optional[xr.Dataset] = None,
+    metric: Literal["hamming", "levenshtein"] = "hamming",
+    mode: Literal["pairwise", "all_vs_one"] = "pairwise",
+    reference: int = 0,
+    band_width: Optional[int] = None,
+    alphabet: str = "DNA",
+    distance_var: Optional[str] = None,
+    chunk_size: int = 10000,
+    n_jobs: Optional[int] = None,
+    copy: bool = False,
+) -> Optional[xr.Dataset]:
+    """Compute distances between sequences in a SeqData object, e.g. between evolved and original sequences.
+
+    Sequences can be stored as characters, tokens (see tokenize_seqs_sdata, also packed) or one-hot
+    encodings with an "_ohe" dimension in any axis order, so e.g. "evolved_seqs" can be compared to
+    "ohe_seq" directly. All sequences are converted to tokens and compared in chunks with vectorized
+    NumPy operations, spread over a pool of threads. Levenshtein distances use a dynamic program that
+    is vectorized across all pairs of a chunk and can be restricted to a band around the diagonal.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object.
+    seq_var : str, optional
+        Name of the variable holding the sequences, by default "seq"
+    other_var : str, optional
+        Name of the variable holding the sequences to compare to. If None, seq_var is used, by default None
+    other_sdata : xr.Dataset, optional
+        SeqData object holding other_var. If None, sdata is used, by default None
+    metric : str, optional
+        Either "hamming" (equal length sequences) or "levenshtein", by default "hamming"
+    mode : str, optional
+        With "pairwise", the i-th sequence of seq_var is compared to the i-th sequence of other_var.
+        With "all_vs_one", every sequence of seq_var is compared to the reference-th sequence of
+        other_var, by default "pairwise"
+    reference : int, optional
+        Index of the sequence of other_var to compare to with mode="all_vs_one", by default 0
+    band_width : int, optional
+        Number of diagonals to either side of the main diagonal to consider for Levenshtein distances.
+        Distances larger than band_width are only bounded from below by band_width + 1. If None, exact
+        distances are computed, by default None
+    alphabet : str, optional
+        Alphabet of the sequences if they are stored as characters, by default "DNA"
+    distance_var : str, optional
+        Name of the variable to store the distances in. If None, f"{metric}_distance" is used, by default None
+    chunk_size : int, optional
+        Number of pairs to compare per chunk, by default 10000
+    n_jobs : int, optional
+        Number of threads to use. If None, all available cores are used, by default None
+    copy : bool, optional
+        Whether to return a copy of the SeqData object, by default False
+
+    Returns
+    -------
+    xr.Dataset
+        SeqData object with the distances along "_sequence". If copy is True, a copy of the SeqData
+        object is returned, else the original SeqData object is modified in place.
+    """
+    sdata = sdata.copy() if copy else sdata
+    other_sdata = sdata if other_sdata is None else other_sdata
+    other_var = seq_var if other_var is None else other_var
+    letters = alphabets[alphabet].alphabet
+    tokens = _chunk_sequences(_as_tokens(sdata[seq_var], letters), chunk_size)
+    other = _as_tokens(other_sdata[other_var], letters)
+    if mode == "pairwise":
+        if other.shape[0] != tokens.shape[0]:
+            raise ValueError(
+                f"Pairwise distances need the same number of sequences, got {tokens.shape[0]} and {other.shape[0]}."
+            )
+        other = da.asarray(other).rechunk({0: tokens.chunks[0], 1: -1})
+        distances = da.map_blocks(
+            _distance_block,
+            tokens,
+            other,
+            metric=metric,
+            band_width=band_width,
+            drop_axis=1,
+            dtype=np.int64,
+        )
+    elif mode == "all_vs_one":
+        other = np.asarray(other[reference])
+        distances = tokens.map_blocks(
+            _distance_block,
+            other=other,
+            metric=metric,
+            band_width=band_width,
+            drop_axis=1,
+            dtype=np.int64,
+        )
+    else:
+        raise ValueError(f"Unknown mode {mode}. Use 'pairwise' or 'all_vs_one'.")
+    distances = distances.compute(scheduler="threads", num_workers=n_jobs)
+    distance_var = f"{metric}_distance" if distance_var is None else distance_var
+    sdata[distance_var] = xr.DataArray(distances, dims=["_sequence"])
+    return sdata if copy else None
+
+
+def _as_tokens(
+    seqs: xr.DataArray,
+    alphabet: str,
+) -> Union[np.ndarray, da.Array]:
+    """Convert characters, (packed) tokens or one-hot encodings to tokens with shape (sequence, length).
+
+    One-hot vectors without a 1 (e.g. for N) become the unknown token len(alphabet).
+    """
+    sequence_dim = seqs.dims[0]
+    if "_ohe" in seqs.dims:
+        length_dim = [dim for dim in seqs.dims if dim not in (sequence_dim, "_ohe")][0]
+        ohe = seqs.transpose(sequence_dim, length_dim, "_ohe").data
+        xp = da if isinstance(ohe, da.Array) else np
+        known = (ohe > 0).any(axis=-1)
+        return xp.where(known, ohe.argmax(axis=-1), ohe.shape[-1]).astype(np.uint8)
+    if "_packed_length" in seqs.dims:
+        length = seqs.attrs["length"]
+        return _map_sequence_blocks(seqs.data, unpack_tokens, length, length=length)
+    if seqs.dtype.kind in "SUO":
+        return _map_sequence_blocks(seqs.data, tokenize_seqs, seqs.shape[1], alphabet=alphabet)
+    return seqs.data
+
+
+def _map_sequence_blocks(
+    seqs: Union[np.ndarray, da.Array],
+    fn,
+    length: int,
+    **kwargs,
+) -> Union[np.ndarray, da.Array]:
+    """Apply a function mapping a block of sequences to tokens with shape (sequence, length), lazily for dask."""
+    if isinstance(seqs, da.Array):
+        seqs = seqs.rechunk({1: -1})
+        return seqs.map_blocks(fn, **kwargs, chunks=(seqs.chunks[0], (length,)), dtype=np.uint8)
+    return fn(seqs, **kwargs)
+
+
+def _distance_block(
+    tokens: np.ndarray,
+    other: np.ndarray,
+    metric: Literal["hamming", "levenshtein"] = "hamming",
+    band_width: Optional[int] = None,
+) -> np.ndarray:
+    """Compute distances between a block of sequences and the matching block (or a single sequence)."""
+    if metric == "hamming":
+        return hamming_distance(tokens, other)
+    elif metric == "levenshtein":
+        other = np.broadcast_to(other, (len(tokens), other.shape[-1]))
+        return levenshtein_distance(tokens, other, band_width=band_width)
+    raise ValueError(f"Unknown metric {metric}. Use 'hamming' or 'levenshtein'.")
+
+
+def find_duplicates_sdata(
+    sdata: xr.Dataset,
+    seq_var: str = "seq",
+    train_var: Optional[str] = None,
+    near: bool = False,
+    alphabet: str = "DNA",
+    kmer_size: int = 8,
+    num_perm: int = 128,
+    bands: int = 16,
+    group_var: str = "duplicate_group",
+    duplicate_var: str = "duplicate",
+    leak_var: str = "duplicate_leak",
+    drop: bool = False,
+    chunk_size: Optional[int] = None,
+    copy: bool = False,
+) -> Optional[xr.Dataset]:
+    """Find exact and near-duplicate sequences in a SeqData object and report leakage across splits.
+
+    Sequences are hashed chunk by chunk, so only a few 64-bit integers per sequence are kept in memory
+    and no pairs of sequences are ever compared. Exact duplicates share a hash. With near=True, sequences
+    are also grouped if they share a bucket in any band of their k-mer MinHash signatures, which happens
+    with high probability above a k-mer Jaccard similarity of roughly (1 / bands) ** (bands / num_perm)
+    (0.71 with the defaults). Groups are labeled by the index of their first sequence.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object.
+    seq_var : str, optional
+        Name of the variable holding the sequences, by default "seq"
+    train_var : str, optional
+        Variable holding the train/test split labels. If given, groups with sequences in more than one
+        split are flagged in leak_var and reported, by default None
+    near : bool, optional
+        Whether to also find near-duplicates with MinHash, by default False
+    alphabet : str, optional
+        Alphabet of the sequences. Only used with near=True, by default "DNA"
+    kmer_size : int, optional
+        Length of the k-mers to sketch. Only used with near=True, by default 8
+    num_perm : int, optional
+        Number of MinHash functions. Only used with near=True, by default 128
+    bands : int, optional
+        Number of LSH bands, needs to divide num_perm. Only used with near=True, by default 16
+    group_var : str, optional
+        Name of the variable to store the duplicate group of each sequence in, by default "duplicate_group"
+    duplicate_var : str, optional
+        Name of the variable flagging every sequence but the first of each group, by default "duplicate"
+    leak_var : str, optional
+        Name of the variable flagging sequences in groups spanning more than one split, by default "duplicate_leak"
+    drop : bool, optional
+        Whether to drop all sequences flagged in duplicate_var. As sequences can't be dropped in place,
+        the deduplicated SeqData object is always returned, by default False
+    chunk_size : int, optional
+        Number of sequences to hash per chunk. If None, the existing chunks of dask-backed sequences are
+        used or all sequences are hashed at once, by default None
+    copy : bool, optional
+        Whether to return a copy of the SeqData object, by default False
+
+    Returns
+    -------
+    xr.Dataset
+        SeqData object with duplicate groups and flags. If drop is True, the deduplicated SeqData object is
+        returned. If copy is True, a copy of the SeqData object is returned, else the original SeqData
+        object is modified in place.
+    """
+    sdata = sdata.copy() if copy else sdata
+    letters = alphabets[alphabet].alphabet
+    hashes, band_keys = [], []
+    for block in _iter_sequence_blocks(sdata[seq_var].data, chunk_size):
+        block = _as_char_block(block)
+        # blocks of variable length strings are padded to their own width, only hash the sequence
+        hashes.append(hash_seqs(block, lengths=_char_lengths(block)))
+        if near:
+            band_keys.append(_sketch_block(block, letters, kmer_size, num_perm, bands))
+    n_seqs = sdata.sizes["_sequence"]
+    groups = merge_groups(np.arange(n_seqs), np.concatenate(hashes))
+    n_exact = int((groups != np.arange(n_seqs)).sum())
+    if near:
+        # sequences without valid k-mers all share the empty signature, keep them out of LSH
+        sketched = np.flatnonzero(np.concatenate([block_sketched for _, block_sketched in band_keys]))
+        band_keys = np.concatenate([block_keys for block_keys, _ in band_keys])[sketched]
+        keys = np.arange(n_seqs)
+        for band in range(bands):
+            keys[sketched] = sketched[merge_groups(np.arange(len(sketched)), band_keys[:, band])]
+            groups = merge_groups(groups, keys)
+        del band_keys
+    duplicate = groups != np.arange(n_seqs)
+    print(
+        f"Found {duplicate.sum()} duplicate sequences ({n_exact} exact) "
+        f"in {len(np.unique(groups[duplicate]))} groups"
+    )
+    sdata[group_var] = xr.DataArray(groups, dims=["_sequence"])
+    sdata[duplicate_var] = xr.DataArray(duplicate, dims=["_sequence"])
+    if train_var is not None:
+        _, splits = np.unique(sdata[train_var].values, return_inverse=True)
+        group_splits = np.unique(np.stack([groups, splits.ravel()]), axis=1)
+        leaking_groups = np.unique(group_splits[0][np.diff(group_splits[0], prepend=-1) == 0])
+        leak = np.isin(groups, leaking_groups)
+        print(
+            f"{len(leaking_groups)} duplicate groups with {leak.sum()} sequences span more than "
+            f"one split of {train_var}"
+        )
+        sdata[leak_var] = xr.DataArray(leak, dims=["_sequence"])
+    if drop:
+        return sdata.isel(_sequence=np.flatnonzero(~duplicate))
     return sdata if copy else None
 
 
+def _as_char_block(
+    seqs: np.ndarray,
+) -> np.ndarray:
+    """Convert a block of variable length strings to characters with shape (sequence, length), padded with empty bytes."""
+    if seqs.ndim == 1:
+        seqs = seqs.astype("S")
+        seqs = seqs.view("S1").reshape(len(seqs), seqs.dtype.itemsize)
+    return seqs
+
+
+def _char_lengths(
+    seqs: np.ndarray,
+) -> np.ndarray:
+    """Get the length of each sequence of a character block, ignoring trailing empty bytes."""
+    arr = np.ascontiguousarray(seqs).view(np.uint8).reshape(len(seqs), -1)
+    nonzero = arr != 0
+    return np.where(nonzero.any(axis=1), arr.shape[1] - nonzero[:, ::-1].argmax(axis=1), 0)
+
+
+def generate_background_sdata(
+    sdata: xr.Dataset,
+    n_seqs: Optional[int] = None,
+    seq_var: str = "seq",
+    method: Literal["shuffle", "gc", "random"] = "shuffle",
+    k: int = 2,
+    alphabet: str = "DNA",
+    chunk_size: int = 100000,
+    n_jobs: int = 1,
+    seed: Optional[int] = None,
+    zarr_path: Optional[PathLike] = None,
+) -> xr.Dataset:
+    """Generate background sequences from the sequences in a SeqData object as a new SeqData object.
+
+    Backgrounds (e.g. backbones for global importance analysis) are generated from source sequences drawn
+    from sdata, either by shuffling them while preserving their k-let (by default dinucleotide) frequencies,
+    by sampling random sequences with the same GC content, or uniformly at random. Sequences are generated
+    in vectorized chunks spread over a process pool. Every chunk gets its own random stream spawned from
+    seed, so the output only depends on seed and chunk_size, not on n_jobs.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object with the source sequences.
+    n_seqs : int, optional
+        Number of background sequences to generate. Sources are drawn with replacement if given, else
+        one background is generated per source sequence, by default None
+    seq_var : str, optional
+        Name of the variable holding the source sequences, by default "seq"
+    method : str, optional
+        One of "shuffle" (k-let preserving shuffle), "gc" (GC content matched) or "random", by default "shuffle"
+    k : int, optional
+        Size of the k-lets to preserve the frequencies of with method="shuffle", by default 2
+    alphabet : str, optional
+        Alphabet of the sequences, by default "DNA"
+    chunk_size : int, optional
+        Number of sequences to generate per chunk, by default 100000
+    n_jobs : int, optional
+        Number of processes to generate with, by default 1
+    seed : int, optional
+        Random seed, by default None
+    zarr_path : PathLike, optional
+        Zarr store to write the background SeqData to chunk by chunk. The returned SeqData is then
+        a lazy view of the store, by default None
+
+    Returns
+    -------
+    xr.Dataset
+        SeqData object with the background sequences in "seq" and the index of the source sequence
+        of each background in "source".
+    """
+    seqs = sdata[seq_var]
+    if seqs.ndim != 2:
+        raise ValueError(
+            f"Background generation expects {seq_var} to be an array of characters with dimensions "
+            "(sequence, length). Use pad_seqs_sdata to convert variable length sequences first."
+        )
+    n_sources = seqs.shape[0]
+    seed_seq = np.random.SeedSequence(seed)
+    source_seed, chunk_seed = seed_seq.spawn(2)
+    if n_seqs is None:
+        sources = np.arange(n_sources)
+    else:
+        sources = np.sort(np.random.default_rng(source_seed).integers(0, n_sources, n_seqs))
+    chunks = [sources[i : i + chunk_size] for i in range(0, len(sources), chunk_size)]
+    seeds = chunk_seed.spawn(len(chunks))
+    letters = alphabets[alphabet].alphabet
+    context = get_context("spawn")
+    pool = ProcessPoolExecutor(n_jobs, mp_context=context) if n_jobs > 1 else nullcontext()
+    with pool as executor:
+        backgrounds = _bounded_map(
+            executor,
+            _background_block,
+            (seqs[chunk].values for chunk in chunks),
+            repeat(method),
+            repeat(k),
+            repeat(letters),
+            seeds,
+            window=2 * n_jobs,
+        )
+        if zarr_path is not None:
+            # create the store from a lazy template, then fill it chunk by chunk
+            template = xr.Dataset(
+                {
+                    "seq": (
+                        ("_sequence", "_length"),
+                        da.zeros(
+                            (len(sources), seqs.shape[1]), dtype="S1", chunks=(chunk_size, -1)
+                        ),
+                    ),
+                    "source": (("_sequence",), da.from_array(sources, chunks=chunk_size)),
+                },
+                attrs={"sequence_dim": "_sequence", "length_dim": "_length"},
+            )
+            template.to_zarr(zarr_path, mode="w", compute=False)
+            template[["source"]].to_zarr(zarr_path, mode="r+")
+            store = zarr.open_group(zarr_path, mode="r+")
+            for i, background in enumerate(backgrounds):
+                store["seq"][i * chunk_size : i * chunk_size + len(background)] = background
+        else:
+            background = np.concatenate(list(backgrounds))
+    print(f"Generated {len(sources)} background sequences with method {method}")
+    if zarr_path is not None:
+        return xr.open_zarr(zarr_path, concat_characters=False)
+    return xr.Dataset(
+        {
+            "seq": (("_sequence", "_length"), background),
+            "source": (("_sequence",), sources),
+        },
+        attrs={"sequence_dim": "_sequence", "length_dim": "_length"},
+    )
+
+
+def _background_block(
+    seqs: np.ndarray,
+    method: Literal["shuffle", "gc", "random"],
+    k: int,
+    alphabet: str,
+    seed: np.random.SeedSequence,
+) -> np.ndarray:
+    """Generate one background sequence (as characters) per source sequence of a block."""
+    rng = np.random.default_rng(seed)
+    if method == "shuffle":
+        alphabet = [alpha for alpha in alphabets.values() if alpha.alphabet == alphabet][0]
+        return sp.k_shuffle(seqs, k, alphabet=alphabet, length_axis=1, seed=rng)
+    letters = np.frombuffer(alphabet.encode(), dtype="S1")
+    if method == "gc":
+        # order the alphabet as A, T, C, G so that bit 1 picks GC and bit 0 the base of the pair
+        pairs = letters[[0, 3, 1, 2]]
+        gc = np.isin(np.char.upper(seqs), [b"G", b"C"]).mean(axis=1, keepdims=True)
+        tokens = 2 * (rng.random(seqs.shape) < gc) + (rng.random(seqs.shape) < 0.5)
+        return pairs[tokens]
+    elif method == "random":
+        return letters[rng.integers(0, len(letters), seqs.shape)]
+    raise ValueError(f"Unknown background method {method}. Use 'shuffle', 'gc' or 'random'.")
+
+
 def train_test_chrom_split(
     sdata: xr.Dataset, 
     test_chroms: List[str],
@@ -160,8 +1005,7 @@ def train_test_chrom_split(
     train_var : str, optional
         Name of the variable holding the labels such that True = train and False = test, by default "train_val"
     """
-    train_mask = (~sdata.chrom.isin(test_chroms)).compute()
-    sdata[train_var] = train_mask
+    sdata[train_var] = ~sdata.chrom.isin(test_chroms)
 
 
 def train_test_random_split(
@@ -206,9 +1050,28 @@ def train_test_homology_split(
     train_var: str = "train_val",
     test_size: float = 0.1,
     nucleotide: bool = True,
+    method: Literal["graph-part", "minhash"] = "graph-part",
+    threshold: float = 0.8,
+    kmer_size: int = 8,
+    num_perm: int = 64,
+    bands: int = 16,
+    max_bucket_size: int = 100,
+    n_jobs: int = 1,
+    chunk_size: Optional[int] = None,
+    random_state: Optional[int] = None,
 ):
     """Add a variable labeling sequences as part of the train or test split, splitting by homology.
 
+    With method="graph-part", all pairs of sequences are aligned by graph-part, which does not scale
+    far beyond ~100k sequences. With method="minhash", sequences are instead sketched chunk by chunk
+    with k-mer MinHash signatures and bucketed with locality sensitive hashing (LSH). Only candidate
+    pairs sharing a bucket are aligned (banded edit distance), reading only the sequences of each block
+    of pairs, so memory is bounded by the chunk size and pairs_per_task rather than the number of
+    sequences. Sketching and alignment are spread over a process pool, and connected components of the pairs with an identity of at least threshold
+    are assigned whole to either split. Pairs of sequences with a k-mer Jaccard similarity of roughly
+    (1 / bands) ** (bands / num_perm) or more are likely to become candidates, so lower kmer_size or
+    raise bands to catch more distant homologs at the cost of more alignments.
+
     Parameters
     ----------
     sdata : xr.Dataset
@@ -221,12 +1084,51 @@ def train_test_homology_split(
         Proportion of data to put in the test set, by default 0.1
     nucleotide : bool, optional
         Whether the input sequences are nucleotides or not, by default True
+    method : str, optional
+        Either "graph-part" or "minhash", by default "graph-part"
+    threshold : float, optional
+        Minimum identity (relative to the shorter sequence) of homologous sequences.
+        Only used with method="minhash", by default 0.8
+    kmer_size : int, optional
+        Length of the k-mers to sketch. Only used with method="minhash", by default 8
+    num_perm : int, optional
+        Number of MinHash functions. Only used with method="minhash", by default 64
+    bands : int, optional
+        Number of LSH bands, needs to divide num_perm. Only used with method="minhash", by default 16
+    max_bucket_size : int, optional
+        Buckets with more sequences only get each sequence aligned to the first one instead of
+        all pairs. Only used with method="minhash", by default 100
+    n_jobs : int, optional
+        Number of processes to sketch and align with. Only used with method="minhash", by default 1
+    chunk_size : int, optional
+        Number of sequences to sketch per chunk. If None, the existing chunks of dask-backed sequences
+        are used or all sequences are sketched at once. Only used with method="minhash", by default None
+    random_state : int, optional
+        Random seed to assign clusters to splits. Only used with method="minhash", by default None
 
     Raises
     ------
     ImportError
-        If [graph-part](https://github.com/graph-part/graph-part) is not installed.
+        If method="graph-part" and [graph-part](https://github.com/graph-part/graph-part) is not installed.
     """
+    if method == "minhash":
+        train_group = _minhash_homology_split(
+            sdata[seq_var].data,
+            alphabet=alphabets["DNA"].alphabet if nucleotide else AMINO_ACIDS,
+            test_size=test_size,
+            threshold=threshold,
+            kmer_size=kmer_size,
+            num_perm=num_perm,
+            bands=bands,
+            max_bucket_size=max_bucket_size,
+            n_jobs=n_jobs,
+            chunk_size=chunk_size,
+            random_state=random_state,
+        )
+        sdata[train_var] = xr.DataArray(train_group, dims=["_sequence"])
+        return
+    elif method != "graph-part":
+        raise ValueError(f"Unknown homology split method {method}. Use 'graph-part' or 'minhash'.")
     try:
         from graph_part import train_test_validation_split
     except ImportError:
@@ -254,7 +1156,165 @@ def train_test_homology_split(
     train_group = np.full(sdata.sizes[sdata.attrs["sequence_dim"]], "removed")
     train_group[train_idx] = "train"
     train_group[test_idx] = "val"
-    sdata[train_var] = train_group
+    sdata[train_var] = xr.DataArray(train_group, dims=[sdata.attrs["sequence_dim"]])
+
+
+def _minhash_homology_split(
+    seqs: Union[np.ndarray, da.Array],
+    alphabet: str,
+    test_size: float,
+    threshold: float,
+    kmer_size: int,
+    num_perm: int,
+    bands: int,
+    max_bucket_size: int,
+    n_jobs: int,
+    chunk_size: Optional[int],
+    random_state: Optional[int],
+    pairs_per_task: int = 10000,
+) -> np.ndarray:
+    """Label sequences as "train" or "val" by clustering MinHash/LSH candidate pairs that align."""
+    if seqs.ndim != 2:
+        raise ValueError(
+            "Splitting by homology with MinHash expects sequences with dimensions (sequence, length). "
+            "Use pad_seqs_sdata to convert variable length sequences first."
+        )
+    n_seqs, length = seqs.shape
+    # spawn workers, forking a process that runs dask threads can deadlock
+    context = get_context("spawn")
+    pool = ProcessPoolExecutor(n_jobs, mp_context=context) if n_jobs > 1 else nullcontext()
+    with pool as executor:
+        map_fn = executor.map if n_jobs > 1 else map
+        # only the LSH keys are kept, tokens are fetched again for the candidate pairs
+        keys, sketched = [], []
+        for block_keys, block_sketched in _bounded_map(
+            executor,
+            _sketch_block,
+            _iter_sequence_blocks(seqs, chunk_size),
+            repeat(alphabet),
+            repeat(kmer_size),
+            repeat(num_perm),
+            repeat(bands),
+            window=2 * n_jobs,
+        ):
+            keys.append(block_keys)
+            sketched.append(block_sketched)
+        # sequences without valid k-mers share the empty signature, keep them out of LSH
+        sketched = np.flatnonzero(np.concatenate(sketched))
+        keys = np.concatenate(keys)[sketched]
+        pairs = sketched[candidate_pairs(keys, max_bucket_size=max_bucket_size)]
+        del keys
+
+        # identity relative to the shorter sequence is at least threshold iff the edit distance is
+        # at most max_dist, so a band of max_dist diagonals is enough to decide homology exactly
+        max_dist = int(np.floor((1 - threshold) * length))
+        homologous = np.zeros(len(pairs), dtype=bool)
+        step = pairs_per_task * max(n_jobs, 1)
+        for start in range(0, len(pairs), step):
+            # only the sequences of this block of pairs are read and tokenized
+            block = pairs[start : start + step]
+            rows, block = np.unique(block, return_inverse=True)
+            block = block.reshape(-1, 2)
+            tokens = tokenize_seqs(_take_rows(seqs, rows), alphabet)
+            batches = [block[i : i + pairs_per_task] for i in range(0, len(block), pairs_per_task)]
+            dists = map_fn(
+                levenshtein_distance,
+                [tokens[batch[:, 0]] for batch in batches],
+                [tokens[batch[:, 1]] for batch in batches],
+                repeat(max_dist),
+            )
+            homologous[start : start + step] = np.concatenate(list(dists)) <= max_dist
+            del tokens
+
+    edges = pairs[homologous]
+    graph = coo_matrix(
+        (np.ones(len(edges), dtype=bool), (edges[:, 0], edges[:, 1])), shape=(n_seqs, n_seqs)
+    )
+    n_clusters, clusters = connected_components(graph, directed=False)
+    print(
+        f"Aligned {len(pairs)} candidate pairs, found {len(edges)} homologous pairs "
+        f"forming {n_clusters} clusters"
+    )
+
+    # assign whole clusters in random order to the test split until it is full
+    rng = np.random.default_rng(random_state)
+    sizes = np.bincount(clusters, minlength=n_clusters)
+    order = rng.permutation(n_clusters)
+    n_test = int(round(test_size * n_seqs))
+    is_test = np.zeros(n_clusters, dtype=bool)
+    # greedy: clusters that would overfill the test split are skipped, not ending the assignment
+    for cluster in order:
+        if sizes[cluster] <= n_test:
+            is_test[cluster] = True
+            n_test -= sizes[cluster]
+            if n_test == 0:
+                break
+    return np.where(is_test[clusters], "val", "train")
+
+
+def _take_rows(
+    seqs: Union[np.ndarray, da.Array],
+    rows: np.ndarray,
+) -> np.ndarray:
+    """Get sorted rows of (dask-backed) sequences, only computing the chunks holding them."""
+    block = seqs[rows]
+    return block.compute() if isinstance(block, da.Array) else block
+
+
+def _bounded_map(
+    executor: Optional[ProcessPoolExecutor],
+    fn,
+    *iterables,
+    window: int = 4,
+) -> Iterator[Any]:
+    """Map fn over iterables in a process pool, keeping at most window tasks in flight.
+
+    Unlike executor.map, which submits every task (and loads every input chunk) at once, inputs
+    are only read once a slot is free and results are yielded in order, so memory stays bounded
+    by the window. Runs serially if executor is None.
+    """
+    if executor is None:
+        yield from map(fn, *iterables)
+        return
+    pending: deque = deque()
+    for args in zip(*iterables):
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, *args))
+    while pending:
+        yield pending.popleft().result()
+
+
+def _iter_sequence_blocks(
+    seqs: Union[np.ndarray, da.Array],
+    chunk_size: Optional[int] = None,
+) -> Iterator[np.ndarray]:
+    """Yield blocks of complete sequences as NumPy arrays, computing one dask chunk at a time."""
+    if isinstance(seqs, da.Array) or chunk_size is not None:
+        seqs = _chunk_sequences(seqs, chunk_size) if chunk_size is not None else seqs
+        seqs = seqs.rechunk({i: -1 for i in range(1, seqs.ndim)})
+        for i in range(seqs.numblocks[0]):
+            yield seqs.blocks[i].compute()
+    else:
+        yield seqs
+
+
+def _sketch_block(
+    seqs: np.ndarray,
+    alphabet: str,
+    kmer_size: int,
+    num_perm: int,
+    bands: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Compute the LSH bucket keys of the k-mer MinHash sketches of a block of sequences.
+
+    Also returns a mask of the sequences with at least one valid k-mer, as the keys of all other
+    sequences come from the same empty signature.
+    """
+    tokens = tokenize_seqs(seqs, alphabet)
+    codes, valid = kmer_codes(tokens, kmer_size, alphabet_size=len(alphabet))
+    signatures = minhash_signatures(codes, valid, num_perm=num_perm)
+    return lsh_band_keys(signatures, bands), valid.any(axis=-1)
 
 
 def clamp_targets_sdata(
@@ -262,7 +1322,7 @@ def clamp_targets_sdata(
     target_vars: Union[str, List[str]],
     percentile: float = 0.995,
     train_var: Optional[str] = None,
-    clamp_nums: Optional[List[float]] = None,
+    clamp_nums: Optional[Union[List[float], Dict[str, float]]] = None,
     store_clamp_nums: bool = False,
     suffix: bool = False,
     copy: bool = False,
@@ -270,6 +1330,12 @@ def clamp_targets_sdata(
     """
     Clamp targets to a given percentile in a SeqData object.
 
+    Clamping is applied lazily, so dask-backed targets (e.g. read from zarr) stay lazy, and so do
+    their percentiles: they are computed together with the clamped targets (e.g. when writing
+    them with a `Pipeline`). The percentiles of dask-backed targets are exact and computed chunk
+    by chunk, only keeping the values beyond the percentile (e.g. the largest 0.5% for 0.995) in
+    memory.
+
     Parameters
     ----------
     sdata : xr.Dataset
@@ -280,8 +1346,9 @@ def clamp_targets_sdata(
         Percentile to clamp to, by default 0.995
     train_var : str, optional
         Key to use if you only want to calculate percentiles on training data, by default None
-    clamp_nums : list, optional
-        You can provide numbers to clamp to, by default None
+    clamp_nums : list or dict, optional
+        You can provide numbers to clamp to, either in the order of target_vars or keyed
+        by target variable, by default None
     store_clamp_nums : bool, optional
         Whether to store the clamp numbers in the SeqData object, by default False
     suffix : bool, optional
@@ -299,29 +1366,33 @@ def clamp_targets_sdata(
     if type(target_vars) is str:
         target_vars = [target_vars]
     if clamp_nums is None:
-        if train_var is not None:
-            train_idx = np.where(sdata["train_val"])[0]
-            clamp_nums = (
-                sdata.isel(_sequence=train_idx)[target_vars]
-                .to_pandas()
-                .quantile(percentile)
+        targets = _fit_targets(sdata, target_vars, train_var)
+        clamp_nums = {
+            target_var: (
+                da.from_delayed(
+                    _tail_quantile(targets[target_var].data, percentile), shape=(), dtype=float
+                )
+                if isinstance(targets[target_var].data, da.Array)
+                else float(targets[target_var].quantile(percentile, dim="_sequence"))
             )
-        else:
-            clamp_nums = sdata[target_vars].to_pandas().quantile(percentile)
-    else:
+            for target_var in target_vars
+        }
+    elif not isinstance(clamp_nums, dict):
         assert len(clamp_nums) == len(target_vars)
+        clamp_nums = dict(zip(target_vars, clamp_nums))
     for target_var in target_vars:
-        if suffix:
-            sdata[f"{target_var}_clamped"] = xr.DataArray(
-                sdata[target_var].to_pandas().clip(upper=clamp_nums[target_var]),
-                dims=["_sequence"],
-            )
-        else:
-            sdata[target_var].values = (
-                sdata[target_var].to_pandas().clip(upper=clamp_nums[target_var])
-            )
+        clamp_num = clamp_nums[target_var]
+        if isinstance(clamp_num, da.Array):
+            clamp_num = clamp_num.astype(sdata[target_var].dtype)
+        clamped = sdata[target_var].clip(max=clamp_num)
+        sdata[f"{target_var}_clamped" if suffix else target_var] = clamped
     if store_clamp_nums:
-        sdata["clamp_nums"] = xr.DataArray(clamp_nums, dims=["_targets"])
+        sdata["clamp_nums"] = xr.DataArray(
+            da.stack([clamp_nums[target_var] for target_var in target_vars])
+            if any(isinstance(num, da.Array) for num in clamp_nums.values())
+            else [clamp_nums[target_var] for target_var in target_vars],
+            dims=["_targets"],
+        )
     return sdata if copy else None
 
 
@@ -335,36 +1406,122 @@ def scale_targets_sdata(
     copy: bool = False,
 ):
     """
-    Scale targets in a SeqData object.
+    Scale targets in a SeqData object to zero mean and unit variance.
+
+    The means and variances of all targets are computed in a single chunked pass (dask
+    combines per-chunk moments like StandardScaler.partial_fit would), and the scaling is
+    applied lazily, so dask-backed targets (e.g. read from zarr) stay lazy. Unless the scaler
+    is returned, the statistics of dask-backed targets stay lazy too and are computed together
+    with the scaled targets (e.g. when writing them with a `Pipeline`). The fitted statistics
+    are returned as a regular scikit-learn StandardScaler, which can be pickled and passed back
+    in as scaler to apply the same scaling at inference time.
+
+    Parameters
+    ----------
+    sdata : xr.Dataset
+        SeqData object.
+    target_vars : list
+        List of target variables to scale.
+    train_var : str, optional
+        Key to use if you only want to calculate statistics on training data, by default None
+    scaler : StandardScaler, optional
+        A fitted scaler to apply instead of fitting a new one, by default None
+    return_scaler : bool, optional
+        Whether to return the scaler, by default False
+    suffix : bool, optional
+        Whether to add a suffix to the variable name, by default False
+    copy : bool, optional
+        Whether to return a copy of the SeqData object, by default False
+
+    Returns
+    -------
+    StandardScaler, SeqData
+        The scaler if return_scaler is True and the SeqData object with scaled targets if
+        copy is True, else the original SeqData object is modified in place.
     """
     sdata = sdata.copy() if copy else sdata
     if type(target_vars) is str:
         target_vars = [target_vars]
-    if train_var is not None:
-        scale_data = sdata.isel(_sequence=np.where(sdata[train_var])[0])[
-            target_vars
-        ].to_pandas()
-    else:
-        scale_data = sdata[target_vars].to_pandas()
-    to_scale = sdata[target_vars].to_pandas()
-    if len(target_vars) == 1:
-        scale_data = scale_data.values.reshape(-1, 1)
-        to_scale.values.reshape(-1, 1)
     if scaler is None:
-        scaler = StandardScaler()
-        scaler.fit(scale_data)
-    assert scaler.n_features_in_ == len(target_vars)
-    to_scale = scaler.transform(to_scale)
-    for i, target_var in enumerate(target_vars):
-        if suffix:
-            sdata[f"{target_var}_scaled"] = xr.DataArray(
-                to_scale[:, i], dims=["_sequence"]
+        targets = _fit_targets(sdata, target_vars, train_var)
+        stats = [
+            (
+                targets[target_var].mean().data,
+                targets[target_var].var().data,
+                targets[target_var].count().data,
             )
+            for target_var in target_vars
+        ]
+        lazy = any(isinstance(mean, da.Array) for mean, _, _ in stats)
+        if lazy and not return_scaler:
+            means = [mean for mean, _, _ in stats]
+            scales = [da.where(var > 0, da.sqrt(var), 1.0) for _, var, _ in stats]
         else:
-            sdata[target_var].values = to_scale[:, i]
+            stats = dask.compute(*stats)
+            means, variances, counts = (np.array(stat, dtype=np.float64) for stat in zip(*stats))
+            scaler = StandardScaler()
+            scaler.mean_ = means
+            scaler.var_ = variances
+            scaler.scale_ = np.where(variances > 0, np.sqrt(variances), 1.0)
+            scaler.n_features_in_ = len(target_vars)
+            scaler.n_samples_seen_ = counts.astype(np.int64)
+    if scaler is not None:
+        assert scaler.n_features_in_ == len(target_vars)
+        means = scaler.mean_ if scaler.mean_ is not None else np.zeros(len(target_vars))
+        scales = scaler.scale_ if scaler.scale_ is not None else np.ones(len(target_vars))
+    for i, target_var in enumerate(target_vars):
+        scaled = (sdata[target_var] - means[i]) / scales[i]
+        sdata[f"{target_var}_scaled" if suffix else target_var] = scaled
     if return_scaler and copy:
         return scaler, sdata
     elif return_scaler and not copy:
         return scaler
     else:
         return sdata if copy else None
+
+
+def _tail_quantile(values: da.Array, q: float) -> Delayed:
+    """Exact quantile of a 1D dask array ignoring NaNs, as np.nanquantile with linear interpolation.
+
+    Only the largest values (the smallest for q < 0.5) down to the quantile are kept when reducing
+    the chunks with `dask.array.topk`, instead of gathering the whole array in one chunk.
+    """
+    sign = 1 if q >= 0.5 else -1
+    q = q if sign == 1 else 1 - q
+    values = sign * values
+    # the tail is largest when there are no NaNs, so this many values are always enough
+    n_tail = len(values) - int(np.floor(q * (len(values) - 1)))
+    isnan = da.isnan(values)
+    tail = da.topk(da.where(isnan, -np.inf, values), n_tail)
+    return dask.delayed(_quantile_from_tail)(tail, (~isnan).sum(), q, sign)
+
+
+def _quantile_from_tail(tail: np.ndarray, n_valid: int, q: float, sign: int) -> float:
+    """Linearly interpolate quantile q of n_valid values from their largest values, in decreasing order."""
+    if n_valid == 0:
+        return np.nan
+    pos = q * (n_valid - 1)
+    lower = int(np.floor(pos))
+    # the i-th smallest value is the (n_valid - 1 - i)-th largest
+    below = tail[n_valid - 1 - lower]
+    above = tail[n_valid - 2 - lower] if lower + 1 < n_valid else below
+    return sign * (below + (pos - lower) * (above - below))
+
+
+def _fit_targets(
+    sdata: xr.Dataset,
+    target_vars: List[str],
+    train_var: Optional[str] = None,
+) -> xr.Dataset:
+    """Get the targets to fit statistics on, masking non-training sequences with NaN if train_var is given.
+
+    train_var can hold booleans (True = train) or "train"/"val" labels, as in `train_val_indices`.
+    """
+    from ..dataload._dataloader import train_val_indices
+
+    targets = sdata[target_vars].astype(np.float64)
+    if train_var is not None:
+        train = np.zeros(sdata.sizes["_sequence"], dtype=bool)
+        train[train_val_indices(sdata, train_var)[0]] = True
+        targets = targets.where(xr.DataArray(train, dims=["_sequence"]))
+    return targets
@@ -1,6 +1,8 @@
 import numpy as np
 from numpy.typing import NDArray
-from typing import List, Literal, Optional, Union, cast
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from typing import List, Literal, Optional, Tuple, Union, cast
 
 
 def binarize_values(
@@ -26,3 +28,463 @@ def binarize_values(
     else:
         bin_values = np.where(values <= upper_threshold, 0, bin_values)
     return bin_values
+
+
+def tokenize_seqs(
+    seqs: NDArray[np.bytes_],
+    alphabet: str,
+) -> NDArray[np.uint8]:
+    """
+    Function to convert an array of single characters to integer tokens
+
+    Each character is mapped to its index in the alphabet (case insensitive). Characters
+    that are not in the alphabet (e.g. N) are mapped to len(alphabet).
+
+    Parameters
+    ----------
+    seqs: numpy.ndarray
+        Array of single characters (dtype S1), e.g. with shape (sequence, length)
+    alphabet: str
+        The alphabet to use, e.g. "ACGT"
+    """
+    lut = np.full(256, len(alphabet), dtype=np.uint8)
+    for i, char in enumerate(alphabet):
+        lut[ord(char.upper())] = i
+        lut[ord(char.lower())] = i
+    return lut[np.asarray(seqs, dtype="S1").view(np.uint8)]
+
+
+def pack_tokens(
+    tokens: NDArray[np.uint8],
+) -> NDArray[np.uint8]:
+    """
+    Function to pack 2-bit tokens (values 0-3) along the last axis, 4 tokens per byte
+
+    The last axis is padded with 0 up to a multiple of 4, so the original length needs
+    to be kept to unpack the tokens.
+
+    Parameters
+    ----------
+    tokens: numpy.ndarray
+        The tokens to pack, e.g. with shape (sequence, length)
+    """
+    if tokens.size > 0 and tokens.max() > 3:
+        raise ValueError(
+            "Only tokens 0-3 can be packed into 2 bits. Sequences with characters outside the alphabet "
+            "(e.g. N) need to be stored as unpacked tokens."
+        )
+    length = tokens.shape[-1]
+    padded_length = -(-length // 4) * 4
+    tokens = np.pad(
+        tokens.astype(np.uint8, copy=False),
+        [(0, 0)] * (tokens.ndim - 1) + [(0, padded_length - length)],
+    )
+    tokens = tokens.reshape(*tokens.shape[:-1], padded_length // 4, 4)
+    return (
+        (tokens[..., 0] << 6) | (tokens[..., 1] << 4) | (tokens[..., 2] << 2) | tokens[..., 3]
+    ).astype(np.uint8)
+
+
+def unpack_tokens(
+    packed: NDArray[np.uint8],
+    length: int,
+) -> NDArray[np.uint8]:
+    """
+    Function to unpack tokens that were packed with pack_tokens
+
+    Parameters
+    ----------
+    packed: numpy.ndarray
+        The packed tokens, e.g. with shape (sequence, ceil(length / 4))
+    length: int
+        The length of the unpacked tokens
+    """
+    shifts = np.array([6, 4, 2, 0], dtype=np.uint8)
+    tokens = (packed[..., None] >> shifts) & 3
+    return tokens.reshape(*packed.shape[:-1], -1)[..., :length]
+
+
+def kmer_codes(
+    tokens: NDArray[np.uint8],
+    k: int,
+    alphabet_size: int = 4,
+) -> Tuple[NDArray[np.int64], NDArray[np.bool_]]:
+    """
+    Function to compute integer codes of all k-mers of tokenized sequences
+
+    The code of a k-mer is its base-alphabet_size representation, so k-mers are
+    numbered 0 to alphabet_size**k - 1. k-mers containing unknown tokens are marked invalid.
+
+    Parameters
+    ----------
+    tokens: numpy.ndarray
+        Tokens with shape (sequence, length), as returned by tokenize_seqs
+    k: int
+        Length of the k-mers
+    alphabet_size: int, optional
+        Number of characters in the alphabet
+
+    Returns
+    -------
+    codes: numpy.ndarray
+        k-mer codes with shape (sequence, max(length - k + 1, 0))
+    valid: numpy.ndarray
+        Whether each k-mer only contains characters of the alphabet
+    """
+    if tokens.shape[-1] < k:
+        # no complete k-mer, e.g. a block of short variable length sequences
+        empty = np.zeros((*tokens.shape[:-1], 0), dtype=np.int64)
+        return empty, empty.astype(bool)
+    windows = np.lib.stride_tricks.sliding_window_view(tokens, k, axis=-1)
+    valid = (windows < alphabet_size).all(-1)
+    powers = alphabet_size ** np.arange(k - 1, -1, -1, dtype=np.int64)
+    codes = (windows.astype(np.int64) * powers).sum(-1)
+    return codes, valid
+
+
+def _mix64(
+    x: NDArray[np.uint64],
+) -> NDArray[np.uint64]:
+    """SplitMix64 finalizer, used as a fast vectorized 64-bit hash function."""
+    x = x + np.uint64(0x9E3779B97F4A7C15)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def minhash_signatures(
+    codes: NDArray[np.int64],
+    valid: NDArray[np.bool_],
+    num_perm: int = 64,
+    seed: int = 13,
+) -> NDArray[np.uint64]:
+    """
+    Function to compute MinHash signatures of the k-mer sets of sequences
+
+    Parameters
+    ----------
+    codes: numpy.ndarray
+        k-mer codes with shape (sequence, n_kmers), as returned by kmer_codes
+    valid: numpy.ndarray
+        Mask of the k-mers to use, as returned by kmer_codes
+    num_perm: int, optional
+        Number of hash functions (length of the signature)
+    seed: int, optional
+        Seed of the hash functions. Signatures are only comparable if computed with the same seed
+
+    Returns
+    -------
+    numpy.ndarray
+        Signatures with shape (sequence, num_perm). Sequences without valid k-mers get the
+        maximum value in every position
+    """
+    salts = _mix64(np.arange(num_perm, dtype=np.uint64) + np.uint64(seed))
+    codes = codes.astype(np.uint64)
+    empty = np.iinfo(np.uint64).max
+    signatures = np.empty((len(codes), num_perm), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for i, salt in enumerate(salts):
+            hashes = np.where(valid, _mix64(codes ^ salt), empty)
+            signatures[:, i] = hashes.min(axis=-1, initial=empty)
+    return signatures
+
+
+def lsh_band_keys(
+    signatures: NDArray[np.uint64],
+    bands: int,
+) -> NDArray[np.uint64]:
+    """
+    Function to hash each band of rows of MinHash signatures into a single bucket key
+
+    Two sequences share a bucket in a band if all rows of that band agree, which happens
+    with probability s**(num_perm / bands) for sequences with Jaccard similarity s.
+
+    Parameters
+    ----------
+    signatures: numpy.ndarray
+        Signatures with shape (sequence, num_perm), as returned by minhash_signatures
+    bands: int
+        Number of bands. Needs to divide num_perm
+
+    Returns
+    -------
+    numpy.ndarray
+        Bucket keys with shape (sequence, bands)
+    """
+    n_seqs, num_perm = signatures.shape
+    if num_perm % bands != 0:
+        raise ValueError(f"Number of bands ({bands}) needs to divide num_perm ({num_perm}).")
+    rows = signatures.reshape(n_seqs, bands, num_perm // bands)
+    keys = np.zeros((n_seqs, bands), dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for r in range(rows.shape[-1]):
+            keys = _mix64(keys ^ rows[..., r])
+    return keys
+
+
+def candidate_pairs(
+    keys: NDArray[np.uint64],
+    max_bucket_size: int = 100,
+) -> NDArray[np.int64]:
+    """
+    Function to get the pairs of sequences that share an LSH bucket in any band
+
+    Buckets with more than max_bucket_size members only contribute the pairs of each
+    member with the first member of the bucket, to keep the number of pairs linear.
+
+    Parameters
+    ----------
+    keys: numpy.ndarray
+        Bucket keys with shape (sequence, bands), as returned by lsh_band_keys
+    max_bucket_size: int, optional
+        Largest bucket for which all pairs are returned
+
+    Returns
+    -------
+    numpy.ndarray
+        Unique candidate pairs (i, j) with i < j, shape (n_pairs, 2)
+    """
+    pairs = [np.empty((0, 2), dtype=np.int64)]
+    for band in keys.T:
+        order = np.argsort(band, kind="stable")
+        sorted_keys = band[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        sizes = np.diff(np.r_[starts, len(order)])
+        for start, size in zip(starts[sizes > 1], sizes[sizes > 1]):
+            members = order[start : start + size]
+            if size > max_bucket_size:
+                pairs.append(np.stack([np.full(size - 1, members[0]), members[1:]], axis=1))
+            else:
+                i, j = np.triu_indices(size, k=1)
+                pairs.append(np.stack([members[i], members[j]], axis=1))
+    pairs = np.sort(np.concatenate(pairs), axis=1)
+    return np.unique(pairs, axis=0)
+
+
+def levenshtein_distance(
+    a: NDArray[np.uint8],
+    b: NDArray[np.uint8],
+    band_width: Optional[int] = None,
+) -> NDArray[np.int64]:
+    """
+    Function to compute Levenshtein (edit) distances between pairs of tokenized sequences
+
+    Uses a banded dynamic program that is vectorized over all pairs and over the band, so
+    the number of NumPy operations only grows with the sequence length. The distance is exact
+    when it is at most band_width, otherwise an upper bound larger than band_width is returned.
+
+    Parameters
+    ----------
+    a: numpy.ndarray
+        First sequences of the pairs with shape (pair, length_a)
+    b: numpy.ndarray
+        Second sequences of the pairs with shape (pair, length_b)
+    band_width: int, optional
+        Maximum number of diagonals to either side of the main diagonal to consider. If
+        None, the full dynamic program is computed
+
+    Returns
+    -------
+    numpy.ndarray
+        Edit distances with shape (pair,)
+    """
+    n_pairs, length_a = a.shape
+    length_b = b.shape[1]
+    w = max(length_a, length_b) if band_width is None else band_width
+    if abs(length_a - length_b) > w:
+        return np.full(n_pairs, max(length_a, length_b), dtype=np.int64)
+    inf = length_a + length_b + 1
+    offsets = np.arange(-w, w + 1)
+    band_idx = np.arange(2 * w + 1)
+    # row 0 of the dynamic program: D[0, j] = j
+    row = np.where((offsets >= 0) & (offsets <= length_b), offsets, inf)
+    dist = np.repeat(row[None, :], n_pairs, axis=0)
+    b_padded = np.concatenate([b, np.zeros((n_pairs, 1), dtype=b.dtype)], axis=1)
+    for i in range(1, length_a + 1):
+        cols = i + offsets
+        in_range = (cols >= 0) & (cols <= length_b)
+        mismatch = a[:, i - 1 : i] != b_padded[:, np.clip(cols - 1, 0, length_b)]
+        diagonal = dist + mismatch
+        up = np.concatenate([dist[:, 1:], np.full((n_pairs, 1), inf)], axis=1) + 1
+        best = np.minimum(diagonal, up)
+        best[:, cols == 0] = i
+        best[:, ~in_range] = inf
+        # insertions: D[i, d] = min over d' <= d of best[i, d'] + (d - d')
+        dist = np.minimum.accumulate(best - band_idx, axis=1) + band_idx
+        dist[:, ~in_range] = inf
+    return np.minimum(dist[:, w + length_b - length_a], inf).astype(np.int64)
+
+
+def reverse_complement_codes(
+    codes: NDArray[np.int64],
+    k: int,
+) -> NDArray[np.int64]:
+    """
+    Function to compute the codes of the reverse complements of nucleotide k-mers
+
+    Assumes k-mers were encoded with an alphabet in ACGT (or ACGU) order, so the complement
+    of token t is 3 - t.
+
+    Parameters
+    ----------
+    codes: numpy.ndarray
+        k-mer codes, as returned by kmer_codes with alphabet_size=4
+    k: int
+        Length of the k-mers
+
+    Returns
+    -------
+    numpy.ndarray
+        Codes of the reverse complemented k-mers
+    """
+    rc_codes = np.zeros_like(codes)
+    for _ in range(k):
+        rc_codes = (rc_codes << 2) | (3 - (codes & 3))
+        codes = codes >> 2
+    return rc_codes
+
+
+def count_kmers(
+    tokens: NDArray[np.uint8],
+    k: int,
+    alphabet_size: int = 4,
+    canonical: bool = False,
+    frequency: bool = False,
+) -> NDArray[Union[np.int64, np.float64]]:
+    """
+    Function to count the k-mers of tokenized sequences
+
+    Parameters
+    ----------
+    tokens: numpy.ndarray
+        Tokens with shape (sequence, length), as returned by tokenize_seqs
+    k: int
+        Length of the k-mers
+    alphabet_size: int, optional
+        Number of characters in the alphabet
+    canonical: bool, optional
+        Whether to count each k-mer together with its reverse complement under the smaller
+        of the two codes. Only valid for nucleotide alphabets
+    frequency: bool, optional
+        Whether to return relative k-mer frequencies of each sequence in place of counts
+
+    Returns
+    -------
+    numpy.ndarray
+        k-mer counts with shape (sequence, alphabet_size**k), columns ordered by k-mer code
+    """
+    rows, cols, n_kmers = _kmer_coords(tokens, k, alphabet_size, canonical)
+    counts = np.bincount(rows * n_kmers + cols, minlength=len(tokens) * n_kmers)
+    counts = counts.reshape(len(tokens), n_kmers)
+    if frequency:
+        return counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+    return counts
+
+
+def _kmer_coords(
+    tokens: NDArray[np.uint8],
+    k: int,
+    alphabet_size: int = 4,
+    canonical: bool = False,
+) -> Tuple[NDArray[np.int64], NDArray[np.int64], int]:
+    """Get the (sequence, k-mer code) coordinates of all valid k-mers, one entry per occurrence."""
+    if canonical and alphabet_size != 4:
+        raise ValueError("Canonical k-mers are only defined for nucleotide alphabets.")
+    codes, valid = kmer_codes(tokens, k, alphabet_size)
+    if canonical:
+        codes = np.minimum(codes, reverse_complement_codes(codes, k))
+    rows = np.broadcast_to(np.arange(len(tokens))[:, None], codes.shape)
+    return rows[valid], codes[valid], alphabet_size**k
+
+
+def hamming_distance(
+    a: NDArray,
+    b: NDArray,
+) -> NDArray[np.int64]:
+    """
+    Function to compute Hamming distances between pairs of equal length sequences
+
+    Parameters
+    ----------
+    a: numpy.ndarray
+        First sequences of the pairs with shape (pair, length), as tokens or characters
+    b: numpy.ndarray
+        Second sequences of the pairs with shape (pair, length) or (length,) to compare
+        every sequence in a against the same sequence
+
+    Returns
+    -------
+    numpy.ndarray
+        Number of mismatching positions with shape (pair,)
+    """
+    if a.shape[-1] != b.shape[-1]:
+        raise ValueError(
+            f"Hamming distance requires sequences of equal length, got {a.shape[-1]} and {b.shape[-1]}."
+        )
+    return (a != b).sum(axis=-1, dtype=np.int64)
+
+
+def hash_seqs(
+    seqs: NDArray,
+    lengths: Optional[NDArray[np.integer]] = None,
+) -> NDArray[np.uint64]:
+    """
+    Function to compute 64-bit hashes of sequences, equal for identical sequences
+
+    Parameters
+    ----------
+    seqs: numpy.ndarray
+        Sequences with shape (sequence, length), e.g. as characters or tokens
+    lengths: numpy.ndarray, optional
+        Length of each sequence in bytes with shape (sequence,). Only the first lengths[i] bytes
+        of each sequence are hashed, so padded sequences hash the same regardless of the padded
+        width. If None, all bytes are hashed
+
+    Returns
+    -------
+    numpy.ndarray
+        Hashes with shape (sequence,)
+    """
+    arr = np.ascontiguousarray(seqs).view(np.uint8).reshape(len(seqs), -1)
+    if lengths is None:
+        lengths = np.full(len(seqs), arr.shape[1])
+    lengths = np.asarray(lengths, dtype=np.uint64)
+    hashes = lengths.copy()
+    with np.errstate(over="ignore"):
+        for i, column in enumerate(arr.T):
+            mixed = _mix64(hashes ^ column.astype(np.uint64))
+            hashes = np.where(lengths > i, mixed, hashes)
+    return hashes
+
+
+def merge_groups(
+    groups: NDArray[np.int64],
+    keys: NDArray,
+) -> NDArray[np.int64]:
+    """
+    Function to merge groups of sequences that share a key
+
+    Parameters
+    ----------
+    groups: numpy.ndarray
+        Group of each sequence with shape (sequence,), e.g. np.arange(n) for singletons
+    keys: numpy.ndarray
+        Key of each sequence with shape (sequence,), e.g. a hash or an LSH bucket key
+
+    Returns
+    -------
+    numpy.ndarray
+        Merged groups with shape (sequence,), labeled by the smallest index of their members
+    """
+    n_seqs = len(groups)
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    first = order[np.maximum.accumulate(np.where(starts, np.arange(n_seqs), 0))]
+    rows = np.concatenate([np.arange(n_seqs), order])
+    cols = np.concatenate([groups, first])
+    graph = coo_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n_seqs, n_seqs))
+    _, components = connected_components(graph, directed=False)
+    representatives = np.full(components.max(initial=-1) + 1, n_seqs)
+    np.minimum.at(representatives, components, np.arange(n_seqs))
+    return representatives[components]
@@ -2,8 +2,10 @@ import os
 from os import PathLike
 from typing import Dict, List, Type, Union, Literal, Optional
 
-import seqdata as sd
 import xarray as xr
+from ..dataload._dataloader import get_sdata_dataloader, nan_target_mask, train_val_indices
+from ..dataload._prefetch import DevicePrefetcher
+from ..dataload._utils import ConcatSeqData
 from ..models import SequenceModule
 from pytorch_lightning import LightningModule, Trainer, seed_everything
 from pytorch_lightning.callbacks import ModelCheckpoint
@@ -37,6 +39,7 @@ def fit(
     model_checkpoint_k: int = 1,
     model_checkpoint_monitor: str = "val_loss_epoch",
     seed: Optional[int] = None,
+    prefetch_to_device: bool = False,
     return_trainer: bool = False,
     **kwargs,
 ) -> Optional[Trainer]:
@@ -73,6 +76,10 @@ def fit(
         Whether to print early stopping messages.
     seed : int
         The seed to use for reproducibility.
+    prefetch_to_device : bool
+        Whether to load the next batches in a background thread and copy them to the device
+        while the model trains on the current one (see `eugene.dataload.DevicePrefetcher`).
+        Only supported when training on a single device. Default is False.
     kwargs : dict
         Additional varword arguments to pass to the PL Trainer.
 
@@ -119,6 +126,15 @@ def fit(
         **kwargs,
     )
 
+    # Overlap loading and copying the batches with training
+    if prefetch_to_device:
+        if trainer.world_size > 1:
+            raise ValueError("prefetch_to_device is only supported on a single device.")
+        device = trainer.strategy.root_device
+        train_dataloader = DevicePrefetcher(train_dataloader, device=device)
+        if val_dataloader is not None:
+            val_dataloader = DevicePrefetcher(val_dataloader, device=device)
+
     # Fit
     trainer.fit(
         model, train_dataloaders=train_dataloader, val_dataloaders=val_dataloader
@@ -141,6 +157,8 @@ def fit_sequence_module(
     prefetch_factor: int = None,
     transforms: Optional[Dict] = None,
     drop_last: bool = False,
+    contiguous_batches: bool = False,
+    shuffle_buffer: Optional[int] = None,
     logger: str = "tensorboard",
     log_dir: Optional[PathLike] = None,
     name: Optional[str] = None,
@@ -151,6 +169,7 @@ def fit_sequence_module(
     model_checkpoint_k: int = 1,
     model_checkpoint_monitor: str = "val_loss_epoch",
     seed: Optional[int] = None,
+    prefetch_to_device: bool = False,
     return_trainer: bool = False,
     **kwargs,
 ) -> Optional[Trainer]:
@@ -162,8 +181,9 @@ def fit_sequence_module(
     ----------
     model : 
         The model to train.
-    sdata : SeqData
-        The SeqData object to train on.
+    sdata : SeqData or ConcatSeqData
+        The SeqData object to train on, or a virtual concatenation of several
+        (see `eugene.dataload.concat_sdatas`).
     target_vars : str or list of str
         The target vars in sdata to use aas labels for training
     in_memory : bool
@@ -186,6 +206,15 @@ def fit_sequence_module(
         information.
     drop_last : bool
         Whether to drop the last batch if it is smaller than the batch size.
+    contiguous_batches : bool
+        Whether to train on batches of consecutive training sequences, read with a single slice
+        each, and only shuffle the order of the batches every epoch. Much faster on large
+        chunked SeqDatas, at the cost of fixed batch compositions. Default is False.
+    shuffle_buffer : int
+        The number of chunks of seq_var to shuffle the training sequences within, so that each batch
+        reads from a few chunks only. Useful for zarr-backed SeqDatas, especially on network
+        filesystems. Shuffling is reproducible from seed. Can't be used with contiguous_batches.
+        Default is None (shuffle all sequences).
     logger : str or Logger
         The logger to use. If a string, must be one of "csv", "tensorboard", or "wandb".
     log_dir : PathLike
@@ -206,6 +235,10 @@ def fit_sequence_module(
         The metric to use for model checkpointing.
     seed : int
         The seed to use for reproducibility.
+    prefetch_to_device : bool
+        Whether to load the next batches in a background thread and copy them to the device
+        while the model trains on the current one. Only supported on a single device.
+        Default is False.
     return_trainer : bool
         Whether to return the trainer object.
     kwargs : dict
@@ -217,54 +250,53 @@ def fit_sequence_module(
         The PyTorch Lightning Trainer object.
     """
 
-    # Set-up dataloaders
+    # Set-up dataloaders that stream from the shared sdata by index
     batch_size = batch_size if batch_size is not None else settings.batch_size
     num_workers = num_workers if num_workers is not None else settings.dl_num_workers
-    if target_vars is not None:
-        if isinstance(target_vars, str):
-            target_vars = [target_vars]
-        if len(target_vars) == 1:
-            sdata["target"] = sdata[target_vars[0]]
-        else:
-            sdata["target"] = xr.concat(
-                [sdata[target_var] for target_var in target_vars], dim="_targets"
-            ).transpose("_sequence", "_targets")
-        nan_mask = sdata['target'].isnull()
-        if sdata["target"].ndim > 1:
-            nan_mask = nan_mask.any('_targets')
-        print(f"Dropping {nan_mask.sum().compute().item()} sequences with NaN targets.")
     if in_memory:
         print(f"Loading {seq_var} and {target_vars} into memory")
-        sdata[seq_var].load()
-        sdata["target"].load()
-    sdata[train_var].load()
-    train_sdata = sdata.sel(_sequence=(sdata[train_var] == True).compute())  # noqa
-    val_sdata = sdata.sel(_sequence=(sdata[train_var] == False).compute())  # noqa
-    train_dataloader = sd.get_torch_dataloader(
-        train_sdata,
-        sample_dims=["_sequence"],
-        variables=[seq_var, "target"],
+        for _sdata in sdata.sdatas if isinstance(sdata, ConcatSeqData) else [sdata]:
+            _sdata[seq_var].load()
+            for target_var in [target_vars] if isinstance(target_vars, str) else target_vars or []:
+                _sdata[target_var].load()
+    gpus = gpus if gpus is not None else settings.gpus
+    pin_memory = settings.dl_pin_memory_gpu_training and gpus > 0
+    train_idx, val_idx = train_val_indices(sdata, train_var)
+    if target_vars is not None:
+        nan_mask = nan_target_mask(sdata, target_vars)
+        print(f"Dropping {nan_mask.sum()} sequences with NaN targets.")
+        train_idx, val_idx = train_idx[~nan_mask[train_idx]], val_idx[~nan_mask[val_idx]]
+    train_dataloader = get_sdata_dataloader(
+        sdata,
+        seq_var=seq_var,
+        target_vars=target_vars,
+        indices=train_idx,
         batch_size=batch_size,
         num_workers=num_workers,
         prefetch_factor=prefetch_factor,
         transforms=transforms,
         shuffle=True,
+        contiguous_batches=contiguous_batches,
+        shuffle_buffer=shuffle_buffer,
+        seed=seed,
+        pin_memory=pin_memory,
         drop_last=drop_last,
     )
-    val_dataloader = sd.get_torch_dataloader(
-        val_sdata,
-        sample_dims=["_sequence"],
-        variables=[seq_var, "target"],
+    val_dataloader = get_sdata_dataloader(
+        sdata,
+        seq_var=seq_var,
+        target_vars=target_vars,
+        indices=val_idx,
         batch_size=batch_size,
         num_workers=num_workers,
         prefetch_factor=prefetch_factor,
         transforms=transforms,
         shuffle=False,
+        pin_memory=pin_memory,
         drop_last=drop_last,
     )
 
     # Set training parameters
-    gpus = gpus if gpus is not None else settings.gpus
     log_dir = log_dir if log_dir is not None else settings.logging_dir
     model_name = model.__class__.__name__
     name = name if name is not None else model_name
@@ -286,6 +318,7 @@ def fit_sequence_module(
         model_checkpoint_k=model_checkpoint_k,
         model_checkpoint_monitor=model_checkpoint_monitor,
         seed=seed,
+        prefetch_to_device=prefetch_to_device,
         return_trainer=return_trainer,
         **kwargs,
     )
@@ -1,10 +1,10 @@
 from os import PathLike
 from typing import List, Union, Optional
-import seqdata as sd
 import numpy as np
 import xarray as xr
 import importlib
 from eugene import models, settings
+from ..dataload._dataloader import get_sdata_dataloader, nan_target_mask, train_val_indices
 from pytorch_lightning import Trainer, seed_everything
 from pytorch_lightning.loggers import TensorBoardLogger
 from ray import tune
@@ -120,24 +120,16 @@ def hyperopt_with_tune(
     if train_dataloader is not None:
         assert val_dataloader is not None
     elif sdata is not None:
+        train_idx, val_idx = train_val_indices(sdata, train_var)
         if target_vars is not None:
-            sdata["target"] = xr.concat(
-                [sdata[target_var] for target_var in target_vars], dim="_targets"
-            ).transpose("_sequence", "_targets")
-            targs = sdata["target"].values
-            if len(targs.shape) == 1:
-                nan_mask = np.isnan(targs)
-            else:
-                nan_mask = np.any(np.isnan(targs), axis=1)
+            nan_mask = nan_target_mask(sdata, target_vars)
             print(f"Dropping {nan_mask.sum()} sequences with NaN targets.")
-            sdata = sdata.isel(_sequence=~nan_mask)
-        train_mask = np.where(sdata[train_var])[0]
-        train_sdata = sdata.isel(_sequence=train_mask)
-        val_sdata = sdata.isel(_sequence=~train_mask)
-        train_dataloader = sd.get_torch_dataloader(
-            train_sdata,
-            sample_dims=["_sequence"],
-            variables=[seq_var, "target"],
+            train_idx, val_idx = train_idx[~nan_mask[train_idx]], val_idx[~nan_mask[val_idx]]
+        train_dataloader = get_sdata_dataloader(
+            sdata,
+            seq_var=seq_var,
+            target_vars=target_vars,
+            indices=train_idx,
             transforms=transforms,
             prefetch_factor=None,
             shuffle=True,
@@ -145,10 +137,11 @@ def hyperopt_with_tune(
             batch_size=batch_size,
             num_workers=num_workers,
         )
-        val_dataloader = sd.get_torch_dataloader(
-            val_sdata,
-            sample_dims=["_sequence"],
-            variables=[seq_var, "target"],
+        val_dataloader = get_sdata_dataloader(
+            sdata,
+            seq_var=seq_var,
+            target_vars=target_vars,
+            indices=val_idx,
             transforms=transforms,
             prefetch_factor=None,
             shuffle=False,
@@ -0,0 +1,444 @@
+"""
+Tests to make sure dataload utilities work on SeqData
+"""
+
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+import seqpro as sp
+import torch
+import xarray as xr
+from eugene import preprocess as pp
+from eugene import dataload as dl
+from pathlib import Path
+
+HERE = Path(__file__).parent
+
+
+@pytest.fixture
+def sdata():
+    seqs = sp.random_seqs((100, 20), sp.alphabets.DNA, seed=13)
+    sdata = xr.Dataset({"seq": (("_sequence", "_length"), seqs)})
+    pp.ohe_seqs_sdata(sdata)
+    return sdata
+
+
+@pytest.mark.parametrize("pack", [False, True])
+def test_tokens_to_ohe(sdata, pack):
+    pp.tokenize_seqs_sdata(sdata, pack=pack)
+    transform = dl.TokensToOHE(length=20 if pack else None)
+    ohe = transform(sdata["token_seq"].values)
+    assert ohe.dtype == np.float32
+    np.testing.assert_array_equal(ohe, sdata["ohe_seq"].values)
+    ohe_torch = dl.TokensToOHE(length=20 if pack else None, channels_first=True)(
+        torch.as_tensor(sdata["token_seq"].values)
+    )
+    np.testing.assert_array_equal(
+        ohe_torch.numpy(), sdata["ohe_seq"].values.swapaxes(1, 2)
+    )
+
+
+@pytest.mark.parametrize(
+    "augment, length",
+    [
+        (dl.RandomRC(rc_prob=1.0), 20),
+        (dl.RandomJitter(max_jitter=2, length_axis=2), 16),
+        (dl.RandomMutation(mut_frac=0.25, inplace=True), 20),
+        (dl.RandomInsertion(insert_min=3, insert_max=3), 23),
+        (dl.RandomDeletion(delete_min=3, delete_max=3), 20),
+        (dl.RandomTranslocation(shift_min=3, shift_max=3), 20),
+    ],
+)
+def test_augment(sdata, augment, length):
+    x = torch.as_tensor(sdata["ohe_seq"].values.swapaxes(1, 2))
+    x_aug = augment(x.clone())
+    assert x_aug.shape == (100, 4, length)
+    assert torch.all(x_aug.sum(1) == 1)
+    # masked out sequences are left alone (or only padded)
+    mask = torch.arange(100) % 2 == 0
+    x_masked = augment(x.clone(), mask=mask)
+    if isinstance(augment, dl.RandomJitter):
+        x = x[..., 2:-2]
+    assert torch.equal(x_masked[~mask][..., :20], x[~mask])
+    if isinstance(augment, dl.RandomRC):
+        assert torch.equal(x_aug, x.flip(dims=[1, 2]))
+    if isinstance(augment, dl.RandomTranslocation):
+        rolled = [x[:1].roll(3, dims=2), x[:1].roll(-3, dims=2)]
+        assert any(torch.equal(x_aug[:1], r) for r in rolled)
+
+
+def test_random_augment(sdata):
+    augment = dl.RandomAugment(
+        [dl.RandomRC(), dl.RandomInsertion(0, 5), dl.RandomMutation(), dl.RandomDeletion()],
+        max_augs_per_seq=2,
+    )
+    assert torch.all(augment.sample_combos(100).sum(1) == 2)
+    x_aug = augment(sdata["ohe_seq"].values.swapaxes(1, 2))
+    assert x_aug.shape == (100, 4, 25)
+    assert torch.all(x_aug.sum(1) == 1)
+
+
+@pytest.fixture
+def targets_sdata(sdata):
+    rng = np.random.default_rng(13)
+    sdata["target_0"] = xr.DataArray(rng.normal(size=100), dims=["_sequence"])
+    sdata["target_1"] = xr.DataArray(rng.normal(size=100), dims=["_sequence"])
+    sdata["train_val"] = xr.DataArray(np.arange(100) % 4 != 0, dims=["_sequence"])
+    return sdata.chunk({"_sequence": 32})
+
+
+def test_get_sdata_dataloader(targets_sdata):
+    indices = np.array([90, 3, 50, 7, 1])
+    dataloader = dl.get_sdata_dataloader(
+        targets_sdata,
+        seq_var="ohe_seq",
+        target_vars=["target_0", "target_1"],
+        indices=indices,
+        batch_size=4,
+        transforms={"ohe_seq": lambda x: x.swapaxes(1, 2)},
+    )
+    batches = list(dataloader)
+    assert [len(batch["target"]) for batch in batches] == [4, 1]
+    assert "target" not in targets_sdata
+    batch = batches[0]
+    assert batch["ohe_seq"].shape == (4, 4, 20)
+    assert batch["ohe_seq"].dtype == torch.float32
+    np.testing.assert_allclose(
+        batch["target"].numpy(),
+        np.stack(
+            [targets_sdata["target_0"].values, targets_sdata["target_1"].values], axis=1
+        )[indices[:4]],
+        rtol=1e-6,
+    )
+    np.testing.assert_array_equal(
+        batch["ohe_seq"].numpy(),
+        targets_sdata["ohe_seq"].values[indices[:4]].swapaxes(1, 2),
+    )
+
+
+def test_get_sdata_dataloader_tuple_transforms(targets_sdata):
+    dataloader = dl.get_sdata_dataloader(
+        targets_sdata,
+        seq_var="ohe_seq",
+        target_vars="target_0",
+        batch_size=4,
+        transforms={("ohe_seq", "target"): lambda arrs: (arrs[0].swapaxes(1, 2), -arrs[1])},
+    )
+    batch = next(iter(dataloader))
+    np.testing.assert_array_equal(
+        batch["ohe_seq"].numpy(), targets_sdata["ohe_seq"].values[:4].swapaxes(1, 2)
+    )
+    np.testing.assert_allclose(
+        batch["target"].numpy(), -targets_sdata["target_0"].values[:4], rtol=1e-6
+    )
+    with pytest.raises(ValueError, match="target_1"):
+        dl.get_sdata_dataloader(
+            targets_sdata,
+            seq_var="ohe_seq",
+            target_vars="target_0",
+            transforms={("ohe_seq", "target_1"): lambda arrs: arrs},
+        )
+
+
+def test_contiguous_batches(targets_sdata):
+    n_seqs = targets_sdata.sizes["_sequence"]
+    sampler = dl.ContiguousBatchSampler(n_seqs, batch_size=32, shuffle=True, seed=0)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == -(-n_seqs // 32)
+    assert sorted(sum(batches, [])) == list(range(n_seqs))
+    assert batches == list(dl.ContiguousBatchSampler(n_seqs, 32, shuffle=True, seed=0))
+
+    indices = np.arange(10, n_seqs)
+    dataloader = dl.get_sdata_dataloader(
+        targets_sdata,
+        seq_var="ohe_seq",
+        target_vars="target_0",
+        indices=indices,
+        batch_size=16,
+        shuffle=True,
+        contiguous_batches=True,
+        seed=0,
+    )
+    for batch in dataloader:
+        target = targets_sdata["target_0"].values
+        start = np.argmin(np.abs(target - batch["target"][0].item()))
+        np.testing.assert_array_equal(
+            batch["ohe_seq"].numpy(),
+            targets_sdata["ohe_seq"].values[start : start + len(batch["ohe_seq"])],
+        )
+    with pytest.raises(ValueError, match="sampler"):
+        dl.get_sdata_dataloader(
+            targets_sdata, seq_var="ohe_seq", contiguous_batches=True, sampler=sampler
+        )
+
+
+def test_chunk_shuffle_sampler(targets_sdata):
+    chunks = targets_sdata["ohe_seq"].chunksizes["_sequence"]
+    indices = np.flatnonzero(targets_sdata["train_val"].values)
+    sampler = dl.ChunkShuffleSampler(indices, chunks, buffer_size=2, seed=0)
+    positions = list(sampler)
+    assert len(positions) == len(sampler) == len(indices)
+    assert sorted(positions) == list(range(len(indices)))
+    assert positions == list(dl.ChunkShuffleSampler(indices, chunks, buffer_size=2, seed=0))
+    assert positions != list(range(len(indices)))
+    # 4 chunks in buffers of 2: the sequences of each buffer are yielded together
+    chunk_ids = indices[positions] // 32
+    assert any(
+        len(set(chunk_ids[:b])) == 2 and len(set(chunk_ids[b:])) == 2
+        for b in range(1, len(chunk_ids))
+    )
+
+    dataloader = dl.get_sdata_dataloader(
+        targets_sdata,
+        seq_var="ohe_seq",
+        target_vars="target_0",
+        indices=indices,
+        batch_size=16,
+        shuffle=True,
+        shuffle_buffer=2,
+        seed=0,
+    )
+    assert isinstance(dataloader.sampler, dl.ChunkShuffleSampler)
+    assert sum(len(batch["target"]) for batch in dataloader) == len(indices)
+    for kwargs in [{"contiguous_batches": True}, {"sampler": sampler}]:
+        with pytest.raises(ValueError, match="shuffle_buffer"):
+            dl.get_sdata_dataloader(
+                targets_sdata, seq_var="ohe_seq", shuffle=True, shuffle_buffer=2, **kwargs
+            )
+
+
+def test_concat_sdatas_virtual(targets_sdata):
+    other = targets_sdata.isel(_sequence=slice(0, 20)).compute()
+    concat = dl.concat_sdatas([targets_sdata, other], keys=["a", "b"])
+    assert "batch" not in targets_sdata
+    cdata = dl.concat_sdatas([targets_sdata, other], keys=["a", "b"], virtual=True)
+    assert len(cdata) == concat.sizes["_sequence"] == 120
+    indices = np.array([110, 3, 100, 64, 99])
+    subset = cdata.isel(_sequence=indices).compute()
+    for var in ["ohe_seq", "target_0", "batch"]:
+        np.testing.assert_array_equal(subset[var].values, concat[var].values[indices])
+    np.testing.assert_array_equal(cdata["target_1"].values, concat["target_1"].values)
+
+    sampler = cdata.weighted_sampler(num_samples=2000, seed=0)
+    from_b = (cdata.origin[list(sampler)] == 1).mean()
+    assert 0.4 < from_b < 0.6
+    dataloader = dl.get_sdata_dataloader(
+        cdata,
+        seq_var="ohe_seq",
+        target_vars="target_0",
+        batch_size=16,
+        sampler=cdata.weighted_sampler(seed=0),
+    )
+    assert sum(len(batch["ohe_seq"]) for batch in dataloader) == 120
+
+
+@pytest.mark.parametrize("lazy", [False, True])
+def test_add_obs(lazy):
+    ids = np.array([f"seq{i}".encode() for i in range(10)])
+    sdata = xr.Dataset({"id": (("_sequence",), ids)})
+    sdata = sdata.chunk({"_sequence": 4}) if lazy else sdata
+    obs = pd.DataFrame(
+        {"id": [f"seq{i}" for i in range(8)][::-1], "count": np.arange(8), "label": list("abcdefgh")}
+    )
+    dl.add_obs(sdata, obs, on="id", columns=["count"])
+    assert "label" not in sdata
+    assert sdata["id"].dtype == ids.dtype
+    assert isinstance(sdata["count"].data, np.ndarray) != lazy
+    np.testing.assert_array_equal(sdata["count"].values, [7, 6, 5, 4, 3, 2, 1, 0, np.nan, np.nan])
+    with pytest.raises(ValueError):
+        dl.add_obs(sdata, pd.concat([obs, obs]), on="id")
+    dl.add_obs(sdata, obs.iloc[:0], on="id", columns=["label"])
+    assert pd.isna(sdata["label"].values).all()
+    dl.add_obs(sdata, obs, on="id", columns=["label"], report_unmatched=False)
+    assert isinstance(sdata["label"].data, np.ndarray) != lazy
+    assert sdata["label"].values[:8].tolist() == list("hgfedcba")
+    assert pd.isna(sdata["label"].values[8:]).all()
+
+
+def test_fit_sequence_module(targets_sdata, tmp_path):
+    from eugene import models, train
+    from eugene.models.zoo import FCN
+
+    model = models.SequenceModule(arch=FCN(input_len=20, output_dim=2), task="regression")
+    train.fit_sequence_module(
+        model,
+        targets_sdata,
+        seq_var="ohe_seq",
+        target_vars=["target_0", "target_1"],
+        epochs=1,
+        gpus=1,
+        batch_size=16,
+        transforms={"ohe_seq": lambda x: x.swapaxes(1, 2)},
+        log_dir=tmp_path,
+        logger="csv",
+        version="v0",
+        enable_progress_bar=False,
+        enable_model_summary=False,
+    )
+    assert "target" not in targets_sdata
+
+    # batches are loaded and copied to the device in the background
+    trainer = train.fit_sequence_module(
+        model,
+        targets_sdata,
+        seq_var="ohe_seq",
+        target_vars=["target_0", "target_1"],
+        epochs=1,
+        gpus=1,
+        batch_size=16,
+        transforms={"ohe_seq": lambda x: x.swapaxes(1, 2)},
+        log_dir=tmp_path,
+        logger="csv",
+        version="v1",
+        prefetch_to_device=True,
+        return_trainer=True,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+    )
+    assert isinstance(trainer.train_dataloader, dl.DevicePrefetcher)
+    assert trainer.global_step == 5
+
+
+def test_nan_target_mask(targets_sdata):
+    from eugene.dataload._dataloader import nan_target_mask
+
+    multitask = np.random.default_rng(13).normal(size=(100, 50))
+    multitask[[5, 60], [3, 49]] = np.nan
+    targets_sdata["cells"] = xr.DataArray(multitask, dims=["_sequence", "_cells"]).chunk(
+        {"_sequence": 32, "_cells": 10}
+    )
+    targets_sdata["target_0"][7] = np.nan
+    mask = nan_target_mask(targets_sdata, ["target_0", "cells"])
+    np.testing.assert_array_equal(np.flatnonzero(mask), [5, 7, 60])
+
+
+def test_mmap_dataloader(targets_sdata, tmp_path):
+    dl.write_mmap_sdata(
+        targets_sdata,
+        tmp_path / "mmap",
+        "ohe_seq",
+        target_vars=["target_0", "target_1"],
+        dtypes={"ohe_seq": np.float32},
+    )
+    train_idx = np.flatnonzero(targets_sdata["train_val"].values)
+    dataloader = dl.get_mmap_dataloader(
+        tmp_path / "mmap",
+        indices=train_idx,
+        batch_size=16,
+        transforms={"ohe_seq": lambda x: x.swapaxes(-1, -2)},
+    )
+    batch = next(iter(dataloader))
+    assert batch["ohe_seq"].shape == (16, 4, 20)
+    np.testing.assert_array_equal(
+        batch["ohe_seq"].numpy(),
+        targets_sdata["ohe_seq"].values[train_idx[:16]].swapaxes(1, 2),
+    )
+    np.testing.assert_allclose(
+        batch["target"].numpy()[:, 1], targets_sdata["target_1"].values[train_idx[:16]]
+    )
+    assert sum(len(batch["target"]) for batch in dataloader) == len(train_idx)
+    dataset = dl.MmapDataset(tmp_path / "mmap")
+    assert dataset[3]["target"].shape == (2,)
+    # single samples are views of the maps
+    assert np.shares_memory(dataset[3]["ohe_seq"].numpy(), dataset.arrays["ohe_seq"])
+    # DataLoaders of torch<2 collate lists of items
+    items = dl.MmapDataset.collate([dataset[i] for i in [3, 5]])
+    for key, value in dataset.__getitems__([3, 5]).items():
+        assert torch.equal(items[key], value)
+    assert pickle.loads(pickle.dumps(dataset))._arrays is None
+
+
+def test_genome_dataloader(tmp_path):
+    rng = np.random.default_rng(13)
+    chroms = {
+        "chr1": "".join(rng.choice(list("ACGTN"), 1003, p=[0.24, 0.24, 0.24, 0.24, 0.04])),
+        "chr2": "".join(rng.choice(list("ACGTacgt"), 517)),
+    }
+    with open(tmp_path / "genome.fa", "w") as f:
+        for name, seq in chroms.items():
+            f.write(f">{name} test\n")
+            f.writelines(seq[i : i + 60] + "\n" for i in range(0, len(seq), 60))
+    intervals = [("chr1", 0, 20, 1.0), ("chr1", 990, 1003, 2.0), ("chr2", 100, 130, 3.0)]
+    with open(tmp_path / "intervals.bed", "w") as f:
+        f.writelines("\t".join(map(str, interval)) + "\n" for interval in intervals)
+
+    dataloader = dl.get_genome_dataloader(
+        tmp_path / "genome.fa", tmp_path / "intervals.bed", seq_length=24, target_cols=[3]
+    )
+    batch = next(iter(dataloader))
+    assert batch["ohe_seq"].shape == (3, 24, 4)
+    np.testing.assert_array_equal(batch["target"].numpy(), [1.0, 2.0, 3.0])
+    for ohe, (chrom, start, end, _) in zip(batch["ohe_seq"].numpy(), intervals):
+        seq = chroms[chrom].upper()
+        positions = range((start + end) // 2 - 12, (start + end) // 2 + 12)
+        expected = "".join(seq[p] if 0 <= p < len(seq) else "N" for p in positions)
+        decoded = "".join("ACGT"[row.argmax()] if row.any() else "N" for row in ohe)
+        assert decoded == expected
+
+    dataset = dl.GenomeDataset(
+        tmp_path / "genome.fa", tmp_path / "intervals.bed", seq_length=24, rc_prob=1.0
+    )
+    rc = dataset.__getitems__([0, 1, 2])["ohe_seq"]
+    assert torch.equal(rc, batch["ohe_seq"].flip(dims=[1, 2]))
+    items = dl.GenomeDataset.collate([dataset[i] for i in range(3)])
+    assert torch.equal(items["ohe_seq"], rc)
+    assert pickle.loads(pickle.dumps(dataset))._genome is None
+
+
+def test_fit_genome_dataloader(tmp_path):
+    from eugene import models, train
+    from eugene.models.zoo import FCN
+
+    seq = "".join(np.random.default_rng(13).choice(list("ACGT"), 500))
+    with open(tmp_path / "genome.fa", "w") as f:
+        f.write(f">chr1\n{seq}\n")
+    intervals = pd.DataFrame(
+        {"chrom": "chr1", "start": np.arange(0, 400, 25), "end": np.arange(20, 420, 25)}
+    )
+    intervals["target"] = np.arange(16, dtype=np.float32)
+    dataloader = dl.get_genome_dataloader(
+        tmp_path / "genome.fa",
+        intervals,
+        batch_size=8,
+        transforms={"ohe_seq": lambda x: x.swapaxes(1, 2)},
+    )
+    model = models.SequenceModule(arch=FCN(input_len=20, output_dim=1), task="regression")
+    step = model._common_step(next(iter(dataloader)), 0, "train")
+    assert step["outs"].shape == step["y"].shape == (8,)
+    assert step["loss"].shape == ()
+    train.fit(
+        model,
+        dataloader,
+        epochs=1,
+        gpus=1,
+        log_dir=tmp_path,
+        logger="csv",
+        version="v0",
+        early_stopping_metric=None,
+        model_checkpoint_monitor=None,
+        max_steps=1,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+    )
+
+
+def test_device_prefetcher(targets_sdata):
+    dataloader = dl.get_sdata_dataloader(
+        targets_sdata, seq_var="ohe_seq", target_vars="target_0", batch_size=32
+    )
+    prefetcher = dl.DevicePrefetcher(dataloader, device="cpu")
+    assert len(prefetcher) == len(dataloader) == 4
+    for batch, expected in zip(prefetcher, dataloader):
+        assert batch["ohe_seq"].device == torch.device("cpu")
+        assert torch.equal(batch["ohe_seq"], expected["ohe_seq"])
+    # stopping early doesn't hang
+    next(iter(prefetcher))
+
+    def failing():
+        yield torch.zeros(1)
+        raise RuntimeError("loading failed")
+
+    with pytest.raises(RuntimeError):
+        list(dl.DevicePrefetcher(failing(), device="cpu"))
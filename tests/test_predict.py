@@ -0,0 +1,309 @@
+"""
+Tests to make sure streaming prediction works on arrays, SeqData variables and dataloaders
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import seqpro as sp
+import torch
+import xarray as xr
+import zarr
+from eugene import preprocess as pp
+from eugene import dataload as dl
+from eugene import models
+from eugene import evaluate
+from eugene.models.zoo import FCN
+
+
+@pytest.fixture
+def sdata():
+    seqs = sp.random_seqs((50, 20), sp.alphabets.DNA, seed=13)
+    sdata = xr.Dataset({"seq": (("_sequence", "_length"), seqs)})
+    pp.ohe_seqs_sdata(sdata)
+    sdata["target"] = xr.DataArray(np.random.default_rng(13).normal(size=50), dims=["_sequence"])
+    return sdata.chunk({"_sequence": 16})
+
+
+@pytest.fixture
+def model():
+    torch.manual_seed(13)
+    return models.SequenceModule(FCN(input_len=20, output_dim=2))
+
+
+def test_predict_streaming(sdata, model, tmp_path):
+    x = sdata["ohe_seq"].values.swapaxes(1, 2)
+    expected = model.predict(x, batch_size=16, verbose=False)
+    assert expected.shape == (50, 2)
+    assert expected.dtype == torch.float32
+
+    transform = lambda batch: batch.swapaxes(1, 2)
+    lazy = model.predict(sdata["ohe_seq"], batch_size=16, transform=transform, verbose=False)
+    torch.testing.assert_close(lazy, expected)
+
+    out = np.lib.format.open_memmap(
+        tmp_path / "preds.npy", mode="w+", dtype=np.float32, shape=(50, 2)
+    )
+    assert model.predict(x, batch_size=16, out=out, verbose=False) is out
+    np.testing.assert_allclose(out, expected.numpy(), rtol=1e-5)
+
+    dataloader = dl.get_sdata_dataloader(
+        sdata, seq_var="ohe_seq", batch_size=16, transforms={"ohe_seq": transform}
+    )
+    out = zarr.zeros((50, 2), chunks=(16, 2), dtype="f4")
+    model.predict(dataloader, out=out, verbose=False)
+    np.testing.assert_allclose(out[:], expected.numpy(), rtol=1e-5)
+    batches = (torch.as_tensor(x[i : i + 20]) for i in range(0, 50, 20))
+    torch.testing.assert_close(model.predict(batches, verbose=False), expected)
+
+
+def test_inference_engine(sdata, model, tmp_path):
+    transforms = {"ohe_seq": lambda x: x.swapaxes(1, 2)}
+    expected = model.predict(sdata["ohe_seq"].values.swapaxes(1, 2), verbose=False).numpy()
+    engine = evaluate.InferenceEngine(model, device="cpu", batch_size=16)
+    pred_vars = engine.predict_sdata(sdata, transforms=transforms, indices=np.arange(10, 50))
+    assert pred_vars == ["predictions_0", "predictions_1"]
+    dataloader = dl.get_sdata_dataloader(
+        sdata, seq_var="ohe_seq", batch_size=16, transforms=transforms
+    )
+    batches = ({"x": batch["ohe_seq"]} for batch in dataloader)
+    np.testing.assert_allclose(
+        engine.predict(batches, seq_var="x").numpy(), expected, rtol=1e-5
+    )
+    assert np.isnan(sdata["predictions_0"].values[:10]).all()
+    np.testing.assert_allclose(sdata["predictions_1"].values[10:], expected[10:, 1], rtol=1e-5)
+
+    evaluate.predictions_sequence_module(
+        model,
+        sdata,
+        target_vars="target",
+        transforms=transforms,
+        engine=engine,
+        out_dir=tmp_path,
+        name="fcn",
+        file_label="test",
+    )
+    np.testing.assert_allclose(sdata["target_predictions"].values, expected[:, 0], rtol=1e-5)
+    assert (tmp_path / "fcn" / "test_predictions.tsv").exists()
+
+
+def test_train_val_predictions_single_pass(sdata, model, tmp_path):
+    sdata["train_val"] = xr.DataArray(np.arange(50) % 5 != 0, dims=["_sequence"])
+    transforms = {"ohe_seq": lambda x: x.swapaxes(1, 2)}
+    expected = model.predict(sdata["ohe_seq"].values.swapaxes(1, 2), verbose=False).numpy()
+    evaluate.train_val_predictions_sequence_module(
+        model,
+        sdata,
+        target_vars="target",
+        transforms=transforms,
+        batch_size=16,
+        gpus=0,
+        out_dir=tmp_path,
+        name="fcn",
+        prefix="fcn_",
+    )
+    np.testing.assert_allclose(sdata["fcn_target_predictions"].values, expected[:, 0], rtol=1e-5)
+    for label, n_seqs in [("train", 40), ("val", 10)]:
+        with open(tmp_path / "fcn" / f"{label}_predictions.tsv") as f:
+            assert len(f.readlines()) == n_seqs + 1
+
+
+@pytest.mark.parametrize("write_format", ["zarr", "parquet"])
+def test_train_val_predictions_store(sdata, model, tmp_path, write_format):
+    train = np.arange(50) % 5 != 0
+    sdata["train_val"] = xr.DataArray(train, dims=["_sequence"])
+    expected = model.predict(sdata["ohe_seq"].values.swapaxes(1, 2), verbose=False).numpy()
+    kwargs = dict(
+        target_vars="target",
+        transforms={"ohe_seq": lambda x: x.swapaxes(1, 2)},
+        batch_size=16,
+        gpus=0,
+        out_dir=tmp_path,
+        name="fcn",
+        write_format=write_format,
+    )
+    calls = []
+    handle = model.arch.register_forward_hook(lambda m, i, o: calls.append(len(i[0])))
+    evaluate.train_val_predictions_sequence_module(model, sdata, **kwargs)
+    # both splits are predicted in a single pass
+    assert calls == [16, 16, 16, 2]
+    for label, split in [("train", train), ("val", ~train)]:
+        path = str(tmp_path / "fcn" / f"{label}_predictions")
+        store = evaluate.PredictionStore(path, format=write_format, resume=True)
+        preds, targets = store.read()
+        np.testing.assert_allclose(preds[:, 0], expected[split, 0], rtol=1e-5)
+        np.testing.assert_allclose(targets[:, 0], sdata["target"].values[split], rtol=1e-6)
+
+    # batches written to both stores are read back, the others are predicted again
+    store = evaluate.PredictionStore(
+        str(tmp_path / "fcn" / "val_predictions"), format=write_format
+    )
+    for batch_idx in range(3):
+        batch = np.arange(16 * batch_idx, 16 * (batch_idx + 1))
+        batch = batch[~train[batch]]
+        store.append(expected[batch, :1], sdata["target"].values[batch], batch_idx=batch_idx)
+    store.flush()
+    calls.clear()
+    sdata = sdata.drop_vars("target_predictions")
+    evaluate.train_val_predictions_sequence_module(model, sdata, resume=True, **kwargs)
+    handle.remove()
+    assert calls == [2]
+    np.testing.assert_allclose(sdata["target_predictions"].values, expected[:, 0], rtol=1e-5)
+
+
+@pytest.mark.parametrize("write_format", ["zarr", "parquet"])
+def test_prediction_store(sdata, model, tmp_path, write_format):
+    transforms = {"ohe_seq": lambda x: x.swapaxes(1, 2)}
+    expected = model.predict(sdata["ohe_seq"].values.swapaxes(1, 2), verbose=False).numpy()
+    kwargs = dict(
+        target_vars="target",
+        transforms=transforms,
+        batch_size=16,
+        gpus=0,
+        out_dir=tmp_path,
+        name="fcn",
+        file_label="test",
+        write_format=write_format,
+    )
+    evaluate.predictions_sequence_module(model, sdata, **kwargs)
+    path = str(tmp_path / "fcn" / "test_predictions")
+    store = evaluate.PredictionStore(path, format=write_format, resume=True)
+    assert store.batches == [0, 1, 2, 3]
+    preds, targets = store.read()
+    assert preds.dtype == targets.dtype == np.float32
+    np.testing.assert_allclose(preds[:, 0], expected[:, 0], rtol=1e-5)
+    np.testing.assert_allclose(targets[:, 0], sdata["target"].values, rtol=1e-6)
+
+    # batches already written are skipped when appending and when predicting
+    store.append(np.zeros((16, 1)), np.zeros((16, 1)), batch_idx=0)
+    np.testing.assert_allclose(store.read(0)[0][:, 0], expected[:16, 0], rtol=1e-5)
+    if write_format == "zarr":
+        # rows of an interrupted batch are dropped when resuming
+        store._group["predictions"].resize((40, 1))
+        store._group["batches"].resize((2, 3))
+    else:
+        # rewrite the store with the first 2 batches only
+        preds, targets = store.read([0, 1])
+        os.remove(store._part(0))
+        store = evaluate.PredictionStore(path, format=write_format, resume=True)
+        store.append(preds[:16], targets[:16], batch_idx=0)
+        store.append(preds[16:], targets[16:], batch_idx=1)
+        store.flush()
+    calls = []
+    handle = model.arch.register_forward_hook(lambda m, i, o: calls.append(len(i[0])))
+    sdata = sdata.drop_vars("target_predictions")
+    evaluate.predictions_sequence_module(model, sdata, resume=True, **kwargs)
+    handle.remove()
+    assert calls == [16, 2]
+    np.testing.assert_allclose(sdata["target_predictions"].values, expected[:, 0], rtol=1e-5)
+    preds, _ = evaluate.PredictionStore(path, format=write_format, resume=True).read()
+    np.testing.assert_allclose(preds[:, 0], expected[:, 0], rtol=1e-5)
+
+
+def test_prediction_store_parquet_parts(tmp_path):
+    path = str(tmp_path / "test_predictions")
+    store = evaluate.PredictionStore(path, format="parquet", chunk_size=16)
+    preds = np.arange(40, dtype=np.float32).reshape(10, 4, 1)
+    for batch_idx in [1, 0, *range(2, 10)]:
+        store.append(preds[batch_idx], -preds[batch_idx], batch_idx=batch_idx)
+    # 4 batches of 4 rows per part file, the last 2 batches are buffered
+    assert sorted(os.listdir(path + ".parquet")) == [
+        "part-00000000.parquet",
+        "part-00000001.parquet",
+    ]
+    store.flush()
+    store = evaluate.PredictionStore(path, format="parquet", chunk_size=16, resume=True)
+    assert store.batches == list(range(10))
+    np.testing.assert_array_equal(store.read()[0], preds.reshape(40, 1))
+    np.testing.assert_array_equal(store.read([9, 0])[1], -preds[[9, 0]].reshape(8, 1))
+
+
+def test_prediction_writer_streams_batches(sdata, model, tmp_path):
+    sdata = sdata.load()
+    transforms = {"ohe_seq": lambda x: x.swapaxes(1, 2)}
+    expected = model.predict(sdata["ohe_seq"].values.swapaxes(1, 2), verbose=False).numpy()
+    kwargs = dict(
+        target_vars="target",
+        transforms=transforms,
+        batch_size=16,
+        gpus=1,
+        out_dir=tmp_path,
+        name="fcn",
+        file_label="test",
+        write_format="zarr",
+        use_trainer=True,
+    )
+    evaluate.predictions_sequence_module(model, sdata, **kwargs)
+    np.testing.assert_allclose(sdata["target_predictions"].values, expected[:, 0], rtol=1e-5)
+    store = zarr.open_group(tmp_path / "fcn" / "test_predictions.zarr", mode="r")
+    assert store["predictions"].shape == store["targets"].shape[:1] + (2,) == (50, 2)
+
+    # only the batch missing from the store is predicted again
+    store = evaluate.PredictionStore(
+        str(tmp_path / "fcn" / "test_predictions"), format="zarr", resume=True
+    )
+    store._group["batches"].resize((3, 3))
+    calls = []
+    handle = model.arch.register_forward_hook(lambda m, i, o: calls.append(len(i[0])))
+    evaluate.predictions_sequence_module(model, sdata, resume=True, **kwargs)
+    handle.remove()
+    assert calls == [2]
+    np.testing.assert_allclose(sdata["target_predictions"].values, expected[:, 0], rtol=1e-5)
+
+
+def test_test_time_augmentation(sdata, model):
+    x = torch.as_tensor(sdata["ohe_seq"].values.swapaxes(1, 2), dtype=torch.float32)
+    forward = model.predict(x, verbose=False)
+    rc = model.predict(x.flip([1, 2]), verbose=False)
+    shifted = torch.zeros_like(x)
+    shifted[..., 1:] = x[..., :-1]
+    shifted = model.predict(shifted, verbose=False)
+
+    tta = model.predict(x, batch_size=16, tta=True, verbose=False)
+    torch.testing.assert_close(tta, (forward + rc) / 2)
+    tta = model.predict(x, batch_size=16, shifts=[1], tta_reduce="max", verbose=False)
+    torch.testing.assert_close(tta, torch.maximum(forward, shifted))
+
+    # the variants of each batch go through the model in a single forward pass
+    tta_model = models.TestTimeAugmentation(model, rc=True, shifts=(-1, 1))
+    calls = []
+    handle = model.arch.register_forward_hook(lambda m, i, o: calls.append(len(i[0])))
+    with torch.no_grad():
+        tta_model(x[:16])
+    handle.remove()
+    assert calls == [96]
+
+    evaluate.predictions_sequence_module(
+        model,
+        sdata,
+        target_vars="target",
+        transforms={"ohe_seq": lambda x: x.swapaxes(1, 2)},
+        batch_size=16,
+        gpus=0,
+        tta=True,
+        store_only=True,
+    )
+    np.testing.assert_allclose(
+        sdata["target_predictions"].values, ((forward + rc) / 2)[:, 0].numpy(), rtol=1e-5
+    )
+
+    # an existing engine is configured with test-time augmentation instead
+    engine = evaluate.InferenceEngine(model, device="cpu", batch_size=16, tta=True)
+    with pytest.raises(ValueError):
+        evaluate.predictions_sequence_module(
+            model, sdata, target_vars="target", tta=True, engine=engine, store_only=True
+        )
+    evaluate.predictions_sequence_module(
+        model,
+        sdata,
+        target_vars="target",
+        transforms={"ohe_seq": lambda x: x.swapaxes(1, 2)},
+        engine=engine,
+        store_only=True,
+        suffix="_engine",
+    )
+    np.testing.assert_allclose(
+        sdata["target_predictions_engine"].values, ((forward + rc) / 2)[:, 0].numpy(), rtol=1e-5
+    )
@@ -0,0 +1,418 @@
+"""
+Tests to make sure preprocess functions work lazily on chunked SeqData
+"""
+
+import pickle
+
+import numpy as np
+import pytest
+import seqpro as sp
+import xarray as xr
+import dask.array as da
+from eugene import preprocess as pp
+from pathlib import Path
+
+HERE = Path(__file__).parent
+
+
+@pytest.fixture
+def seqs():
+    seqs = sp.random_seqs((100, 20), sp.alphabets.DNA, seed=13)
+    seqs[0, 3] = b"N"
+    return seqs
+
+
+@pytest.fixture
+def sdata(seqs):
+    sdata = xr.Dataset(
+        {"seq": (("_sequence", "_length"), da.from_array(seqs, chunks=(32, 20)))}
+    )
+    return sdata
+
+
+def test_ohe_seqs_sdata_lazy(sdata, seqs):
+    pp.ohe_seqs_sdata(sdata)
+    assert isinstance(sdata["ohe_seq"].data, da.Array)
+    assert sdata["ohe_seq"].data.chunks[0] == (32, 32, 32, 4)
+    np.testing.assert_array_equal(
+        sdata["ohe_seq"].values, sp.ohe(seqs, sp.alphabets.DNA)
+    )
+
+
+def test_ohe_seqs_sdata_fill_value_lazy(sdata, seqs):
+    eager = xr.Dataset({"seq": (("_sequence", "_length"), seqs)})
+    pp.ohe_seqs_sdata(eager, fill_value=0.25)
+    pp.ohe_seqs_sdata(sdata, fill_value=0.25)
+    np.testing.assert_array_equal(sdata["ohe_seq"].values, eager["ohe_seq"].values)
+
+
+def test_ohe_seqs_sdata_chunk_size(seqs):
+    sdata = xr.Dataset({"seq": (("_sequence", "_length"), seqs)})
+    pp.ohe_seqs_sdata(sdata, chunk_size=10)
+    assert sdata["ohe_seq"].data.chunks[0] == (10,) * 10
+
+
+def test_ohe_seqs_sdata_zarr(sdata, seqs, tmp_path):
+    pp.ohe_seqs_sdata(sdata, zarr_path=tmp_path / "sdata.zarr")
+    stored = xr.open_zarr(tmp_path / "sdata.zarr")
+    assert "ohe_seq" in stored
+    np.testing.assert_array_equal(
+        stored["ohe_seq"].values, sp.ohe(seqs, sp.alphabets.DNA)
+    )
+
+
+def test_tokenize_seqs_sdata_lazy(sdata, seqs):
+    pp.tokenize_seqs_sdata(sdata)
+    assert isinstance(sdata["token_seq"].data, da.Array)
+    assert sdata["token_seq"].dtype == np.uint8
+    ohe = np.concatenate([np.eye(4), np.zeros((1, 4))])[sdata["token_seq"].values]
+    np.testing.assert_array_equal(ohe, sp.ohe(seqs, sp.alphabets.DNA))
+
+
+def test_tokenize_seqs_sdata_pack(sdata, seqs):
+    sdata["seq"][0, 3] = b"A"
+    pp.tokenize_seqs_sdata(sdata, pack=True)
+    assert sdata["token_seq"].shape == (100, 5)
+    assert sdata["token_seq"].attrs["length"] == 20
+    tokens = pp._utils.unpack_tokens(sdata["token_seq"].values, 20)
+    np.testing.assert_array_equal(
+        tokens, pp._utils.tokenize_seqs(sdata["seq"].values, "ACGT")
+    )
+
+
+def test_make_unique_ids_sdata_lazy(sdata):
+    pp.make_unique_ids_sdata(sdata)
+    assert sdata["id"].data.chunks == ((32, 32, 32, 4),)
+    assert sdata["id"].dtype == np.dtype("S6")
+    assert sdata["id"].values[0] == b"seq000"
+    assert sdata["id"].values[-1] == b"seq099"
+
+
+@pytest.mark.parametrize("pad", ["left", "both", "right"])
+def test_pad_seqs_sdata_lazy(pad):
+    strs = np.array(["ACGT", "ACGTACGTAA", "A", "GGGGGGG"], dtype=object)
+    sdata = xr.Dataset({"seq": (("_sequence",), da.from_array(strs, chunks=2))})
+    pp.pad_seqs_sdata(sdata, length=7, pad=pad, pad_value="N")
+    assert isinstance(sdata["seq_padded"].data, da.Array)
+    np.testing.assert_array_equal(
+        sdata["seq_padded"].values,
+        sp.pad_seqs(strs, pad=pad, pad_value="N", length=7),
+    )
+
+
+def test_pad_seqs_sdata_chunk_size():
+    strs = np.array(["ACGT", "ACGTACGTAA", "A", "GGGGGGG", "TT"], dtype=object)
+    sdata = xr.Dataset({"seq": (("_sequence",), strs)})
+    pp.pad_seqs_sdata(sdata, length=7, pad_value="N", chunk_size=2)
+    assert sdata["seq_padded"].data.chunks[0] == (2, 2, 1)
+    np.testing.assert_array_equal(
+        sdata["seq_padded"].values, sp.pad_seqs(strs, pad="right", pad_value="N", length=7)
+    )
+
+
+def test_pipeline(seqs, tmp_path):
+    sdata = xr.Dataset(
+        {
+            "seq": (("_sequence", "_length"), seqs),
+            "chrom": (("_sequence",), np.array(["chr1", "chr2"] * 50)),
+        }
+    )
+    pipeline = pp.Pipeline(
+        [
+            ("pad", {"length": 24, "pad_value": "N", "pad": "both"}),
+            "ids",
+            ("ohe", {"seq_var": "seq_padded"}),
+            ("chrom_split", {"test_chroms": ["chr2"]}),
+        ],
+        chunk_size=32,
+    )
+    pipeline.run(sdata, zarr_path=tmp_path / "sdata.zarr")
+    stored = xr.open_zarr(tmp_path / "sdata.zarr")
+    assert set(stored.data_vars) == {"seq_padded", "id", "ohe_seq", "train_val"}
+    assert sdata["ohe_seq"].data.chunks[0] == (32, 32, 32, 4)
+    expected = sp.ohe(
+        np.pad(seqs, ((0, 0), (2, 2)), constant_values=b"N"), sp.alphabets.DNA
+    )
+    np.testing.assert_array_equal(stored["ohe_seq"].values, expected)
+    assert stored["train_val"].values.sum() == 50
+
+
+def test_pipeline_lazy_overwrite(seqs, tmp_path):
+    from dask.callbacks import Callback
+
+    target = np.random.default_rng(13).normal(3, 2, 100)
+    xr.Dataset(
+        {"seq": (("_sequence", "_length"), seqs), "target": (("_sequence",), target)}
+    ).to_zarr(tmp_path / "sdata.zarr")
+    sdata = xr.open_zarr(tmp_path / "sdata.zarr", concat_characters=False)
+    pipeline = pp.Pipeline(
+        [
+            ("pad", {"length": 24, "pad_value": "N"}),
+            ("scale", {"target_vars": "target"}),
+            ("clamp", {"target_vars": "target", "percentile": 0.9}),
+        ]
+    )
+    computes = []
+
+    class CountComputes(Callback):
+        def _start(self, dsk):
+            computes.append(dsk)
+
+    # steps stay lazy until the variables are written
+    with CountComputes():
+        pipeline.run(sdata.copy())
+    assert computes == []
+
+    # variables are replaced, including the ones they are computed from
+    pipeline.run(sdata, zarr_path=tmp_path / "sdata.zarr")
+    scaled = (target - target.mean()) / target.std()
+    expected = np.minimum(scaled, np.quantile(scaled, 0.9))
+    stored = xr.open_zarr(tmp_path / "sdata.zarr", concat_characters=False)
+    np.testing.assert_allclose(stored["target"].values, expected)
+    pp.Pipeline([("pad", {"length": 30, "pad_value": "N"})]).run(
+        stored.drop_vars("seq_padded"), zarr_path=tmp_path / "sdata.zarr"
+    )
+    stored = xr.open_zarr(tmp_path / "sdata.zarr", concat_characters=False)
+    assert set(stored.data_vars) == {"seq", "target", "seq_padded"}
+    assert stored["seq_padded"].shape == (100, 30)
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_pipeline_kmers(seqs, tmp_path, sparse):
+    sdata = xr.Dataset({"seq": (("_sequence", "_length"), seqs)})
+    pipeline = pp.Pipeline([("kmers", {"k": 2, "sparse": sparse})], chunk_size=32)
+    pipeline.run(sdata, zarr_path=tmp_path / "sdata.zarr")
+    stored = xr.open_zarr(tmp_path / "sdata.zarr")
+    counts = stored["2mer_counts"].values
+    assert counts.shape == (100, 16)
+    assert counts[1:].sum(axis=1).tolist() == [19] * 99
+    np.testing.assert_array_equal(sdata["2mer_counts"].values, counts)
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_train_test_homology_split_minhash(n_jobs):
+    rng = np.random.default_rng(13)
+    families = sp.random_seqs((20, 100), sp.alphabets.DNA, seed=13)
+    seqs = np.repeat(families, 5, axis=0)
+    mutate = rng.integers(0, 100, size=len(seqs))
+    seqs[np.arange(len(seqs)), mutate] = rng.choice([b"A", b"C", b"G", b"T"], len(seqs))
+    sdata = xr.Dataset(
+        {"seq": (("_sequence", "_length"), da.from_array(seqs, chunks=(32, 100)))}
+    )
+    pp.train_test_homology_split(
+        sdata, "seq", method="minhash", test_size=0.2, n_jobs=n_jobs, random_state=13
+    )
+    labels = sdata["train_val"].values.reshape(20, 5)
+    assert set(np.unique(labels)) == {"train", "val"}
+    assert (labels == labels[:, :1]).all()
+    assert (labels[:, 0] == "val").sum() == 4
+
+
+@pytest.mark.parametrize("random_state", [0, 1, 2, 3, 4])
+def test_train_test_homology_split_minhash_test_size(random_state):
+    # families of very different sizes, a large family must not end filling the val split
+    rng = np.random.default_rng(random_state)
+    sizes = np.array([40, 25, 10] + [1] * 25)
+    families = sp.random_seqs((len(sizes), 100), sp.alphabets.DNA, seed=random_state)
+    seqs = np.repeat(families, sizes, axis=0)
+    mutate = rng.integers(0, 100, size=len(seqs))
+    seqs[np.arange(len(seqs)), mutate] = rng.choice([b"A", b"C", b"G", b"T"], len(seqs))
+    sdata = xr.Dataset(
+        {"seq": (("_sequence", "_length"), da.from_array(seqs, chunks=(32, 100)))}
+    )
+    pp.train_test_homology_split(
+        sdata, "seq", method="minhash", test_size=0.2, random_state=random_state
+    )
+    val_frac = (sdata["train_val"].values == "val").mean()
+    assert abs(val_frac - 0.2) <= 0.02
+
+
+@pytest.fixture
+def targets_sdata():
+    rng = np.random.default_rng(13)
+    return xr.Dataset(
+        {
+            "target_0": (("_sequence",), da.from_array(rng.normal(3, 2, 100), chunks=32)),
+            "target_1": (("_sequence",), da.from_array(rng.exponential(5, 100), chunks=32)),
+            "train_val": (("_sequence",), np.arange(100) < 80),
+        }
+    )
+
+
+def test_scale_targets_sdata_lazy(targets_sdata):
+    from sklearn.preprocessing import StandardScaler
+
+    expected = StandardScaler().fit(
+        targets_sdata[["target_0", "target_1"]].to_pandas()[:80]
+    )
+    original = targets_sdata.copy()
+    scaler = pp.scale_targets_sdata(
+        targets_sdata, ["target_0", "target_1"], train_var="train_val", return_scaler=True
+    )
+    assert isinstance(targets_sdata["target_0"].data, da.Array)
+    np.testing.assert_allclose(scaler.mean_, expected.mean_)
+    np.testing.assert_allclose(scaler.scale_, expected.scale_)
+    np.testing.assert_allclose(
+        np.stack([targets_sdata["target_0"], targets_sdata["target_1"]], axis=1),
+        expected.transform(original[["target_0", "target_1"]].to_pandas()),
+    )
+    scaler = pickle.loads(pickle.dumps(scaler))
+    pp.scale_targets_sdata(
+        original, ["target_0", "target_1"], scaler=scaler, suffix=True
+    )
+    np.testing.assert_allclose(original["target_0_scaled"], targets_sdata["target_0"])
+
+
+@pytest.mark.parametrize("labels", [False, True])
+def test_clamp_targets_sdata_lazy(targets_sdata, labels):
+    if labels:
+        # e.g. from train_test_homology_split
+        split = np.where(np.arange(100) < 80, "train", "val")
+        targets_sdata["train_val"] = xr.DataArray(split, dims=["_sequence"])
+    expected = np.quantile(targets_sdata["target_1"].values[:80], 0.9)
+    pp.clamp_targets_sdata(
+        targets_sdata,
+        ["target_0", "target_1"],
+        percentile=0.9,
+        train_var="train_val",
+        store_clamp_nums=True,
+        suffix=True,
+    )
+    assert isinstance(targets_sdata["target_1_clamped"].data, da.Array)
+    assert targets_sdata["clamp_nums"].values[1] == pytest.approx(expected)
+    assert targets_sdata["target_1_clamped"].max().values == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("percentile", [0.05, 0.5, 0.995])
+def test_clamp_targets_sdata_percentile(targets_sdata, percentile):
+    targets_sdata["target_0"][[3, 40, 77]] = np.nan
+    expected = np.nanquantile(targets_sdata["target_0"].values, percentile)
+    clamped = pp.clamp_targets_sdata(
+        targets_sdata, "target_0", percentile=percentile, store_clamp_nums=True, copy=True
+    )
+    assert clamped["target_0"].data.chunks == targets_sdata["target_0"].data.chunks
+    assert clamped["clamp_nums"].values[0] == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("canonical", [False, True])
+@pytest.mark.parametrize("sparse", [False, True])
+def test_count_kmers_sdata(sdata, seqs, canonical, sparse):
+    pp.count_kmers_sdata(sdata, k=3, canonical=canonical, sparse=sparse)
+    assert isinstance(sdata["3mer_counts"].data, da.Array)
+    counts = sdata["3mer_counts"].data.compute()
+    counts = counts.todense() if sparse else counts
+    assert counts.shape == (100, 64)
+    kmers = [
+        "".join(kmer)
+        for kmer in np.array(list("ACGT"))[np.indices((4,) * 3).reshape(3, -1).T]
+    ]
+    comp = str.maketrans("ACGT", "TGCA")
+    for i in [0, 1, 99]:
+        seq = seqs[i].tobytes().decode()
+        expected = np.zeros(64, dtype=int)
+        for j in range(len(seq) - 2):
+            kmer = seq[j : j + 3]
+            if "N" in kmer:
+                continue
+            if canonical:
+                kmer = min(kmer, kmer.translate(comp)[::-1])
+            expected[kmers.index(kmer)] += 1
+        np.testing.assert_array_equal(counts[i], expected)
+
+
+def test_count_kmers_sdata_frequency(sdata):
+    pp.count_kmers_sdata(sdata, k=2, frequency=True, sparse=False)
+    freqs = sdata["2mer_counts"].values
+    np.testing.assert_allclose(freqs.sum(axis=1), 1)
+
+
+def test_edit_distance_sdata(sdata, seqs):
+    mutated = seqs.copy()
+    mutated[::2, 5] = np.where(seqs[::2, 5] == b"A", b"C", b"A")
+    sdata["mutated"] = xr.DataArray(mutated, dims=["_sequence", "_length"])
+    pp.ohe_seqs_sdata(sdata, seq_var="mutated", ohe_var="ohe_mutated")
+    sdata["ohe_mutated"] = sdata["ohe_mutated"].transpose("_sequence", "_ohe", "length")
+    pp.edit_distance_sdata(sdata, "seq", other_var="ohe_mutated", chunk_size=16)
+    np.testing.assert_array_equal(
+        sdata["hamming_distance"].values, np.arange(100) % 2 == 0
+    )
+    pp.edit_distance_sdata(sdata, "seq", other_var="mutated", metric="levenshtein")
+    np.testing.assert_array_equal(
+        sdata["levenshtein_distance"].values, np.arange(100) % 2 == 0
+    )
+
+
+def test_edit_distance_sdata_all_vs_one(sdata, seqs):
+    pp.edit_distance_sdata(sdata, mode="all_vs_one", reference=1)
+    np.testing.assert_array_equal(
+        sdata["hamming_distance"].values, (seqs != seqs[1]).sum(axis=1)
+    )
+    shifted = xr.Dataset({"seq": (("_sequence", "_length"), np.roll(seqs, 1, axis=1))})
+    pp.edit_distance_sdata(
+        sdata, other_sdata=shifted, metric="levenshtein", mode="all_vs_one", reference=1
+    )
+    assert sdata["levenshtein_distance"].values[1] <= 2
+
+
+@pytest.mark.parametrize("near", [False, True])
+def test_find_duplicates_sdata(seqs, near):
+    seqs = seqs.copy()
+    seqs[10] = seqs[3]
+    seqs[20] = seqs[3]
+    seqs[50] = seqs[40]
+    shifted = np.pad(seqs[60:61, 1:], ((0, 0), (0, 1)), constant_values=b"A")
+    seqs = np.concatenate([seqs, shifted])
+    sdata = xr.Dataset(
+        {
+            "seq": (("_sequence", "_length"), da.from_array(seqs, chunks=(32, 20))),
+            "train_val": (("_sequence",), np.arange(101) < 45),
+        }
+    )
+    deduped = pp.find_duplicates_sdata(
+        sdata,
+        train_var="train_val",
+        near=near,
+        kmer_size=4,
+        num_perm=32,
+        bands=8,
+        drop=True,
+    )
+    groups = sdata["duplicate_group"].values
+    assert groups[10] == groups[20] == 3
+    assert groups[50] == 40
+    assert (groups[100] == 60) == near
+    np.testing.assert_array_equal(
+        np.flatnonzero(sdata["duplicate_leak"].values), [40, 50]
+    )
+    assert deduped.sizes["_sequence"] == 101 - 3 - near
+
+
+@pytest.mark.parametrize("near", [False, True])
+def test_find_duplicates_sdata_variable_length(near):
+    seqs = np.array(["ACGT", "ACGTACGTAA", "ACGT", "TT", "NN"], dtype=object)
+    sdata = xr.Dataset({"seq": (("_sequence",), da.from_array(seqs, chunks=2))})
+    pp.find_duplicates_sdata(sdata, near=near, kmer_size=3, num_perm=8, bands=4)
+    np.testing.assert_array_equal(sdata["duplicate_group"].values, [0, 1, 0, 3, 4])
+
+
+def test_generate_background_sdata(seqs, tmp_path):
+    seqs = sp.random_seqs((100, 50), sp.alphabets.DNA, seed=13)
+    sdata = xr.Dataset({"seq": (("_sequence", "_length"), seqs)})
+    background = pp.generate_background_sdata(
+        sdata, n_seqs=250, chunk_size=64, seed=13, zarr_path=tmp_path / "bg.zarr"
+    )
+    assert background["seq"].shape == (250, 50)
+    assert background["seq"].data.chunks[0] == (64, 64, 64, 58)
+    for seq, source in zip(background["seq"].values[:5], background["source"].values):
+        dinucs = lambda s: sorted(s[i : i + 2] for i in range(len(s) - 1))
+        assert dinucs(seq.tobytes()) == dinucs(seqs[source].tobytes())
+    gc = pp.generate_background_sdata(sdata, method="gc", seed=13)
+    np.testing.assert_array_equal(gc["source"].values, np.arange(100))
+    gc_content = lambda s: np.isin(s, [b"G", b"C"]).mean()
+    assert gc_content(gc["seq"].values) == pytest.approx(gc_content(seqs), abs=0.02)
+    # chunks are generated in a bounded window of workers and written in order
+    parallel = pp.generate_background_sdata(
+        sdata, n_seqs=250, chunk_size=16, seed=13, n_jobs=2, zarr_path=tmp_path / "bg2.zarr"
+    )
+    serial = pp.generate_background_sdata(sdata, n_seqs=250, chunk_size=16, seed=13)
+    np.testing.assert_array_equal(parallel["seq"].values, serial["seq"].values)